@@ -0,0 +1,229 @@
+"""api.py.
+
+read-only JSON api over top files, file search, sessions and activity per file
+Every response carries an ETag and Last-Modified taken from the table_version
+counters of the tables it reads. Clients that send If-None-Match or
+If-Modified-Since get a 304 without a query being run. Response bodies are cached in
+memory per url and counters, so more clients do not mean more queries. All requests
+share the connection pool of one async engine. Writes by other processes show up
+within `VERSIONS_TTL` seconds
+
+Usage:
+    ipy api.py -i -- --port 8050
+    curl -i 'localhost:8050/files/top?n=10&mime_type=application/pdf'
+    curl -i 'localhost:8050/files/search?q=thesis'
+    curl -i 'localhost:8050/sessions?n=5'
+    curl -i 'localhost:8050/files/<file_id>/activity?days=30'
+"""
+
+import argparse
+import functools
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from email.utils import format_datetime
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import pandas as pd
+from aiohttp import hdrs, web  # type: ignore[import]
+from gdrive_insights import config as config_dir
+from gdrive_insights.core.cache import CACHE
+from gdrive_insights.db.async_helpers import (
+    aget_file_history,
+    aget_recent_sessions,
+    aget_top_files,
+    asearch_files,
+)
+from gdrive_insights.db.table_versions import aget_table_versions
+from gdrive_insights.settings import API_PORT
+from rarc_utils.log import LOG_FMT, setup_logger
+from rarc_utils.sqlalchemy_base import get_async_session, load_config
+
+logger = logging.getLogger(__name__)
+
+ASYNC_SESSION = "async_session"
+# bodies stay valid as long as the counters do, the ttl only bounds memory
+RESPONSE_TTL = 3600
+MAX_ROWS = 500
+
+Read = Callable[[web.Request], Awaitable[pd.DataFrame]]
+
+
+def _int_param(request: web.Request, name: str, default: int) -> int:
+    try:
+        value = int(request.query.get(name, default))
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} should be an integer")
+    if not 0 < value <= MAX_ROWS:
+        raise web.HTTPBadRequest(text=f"{name} should be between 1 and {MAX_ROWS}")
+
+    return value
+
+
+def _opaque(etag: str) -> str:
+    # weak comparison, see RFC 7232 2.3.2
+    etag = etag.strip()
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def is_not_modified(
+    request: web.Request, etag: str, last_modified: Optional[datetime]
+) -> bool:
+    """Tell whether the client's copy is still current.
+
+    If-Modified-Since is only used when there is no If-None-Match
+    """
+    if_none_match = request.headers.get(hdrs.IF_NONE_MATCH)
+    if if_none_match is not None:
+        tags = {_opaque(tag) for tag in if_none_match.split(",")}
+        return "*" in tags or _opaque(etag) in tags
+
+    since = request.if_modified_since
+    return since is not None and last_modified is not None and last_modified <= since
+
+
+def validators(
+    versions: Dict[str, Tuple[int, Optional[datetime]]],
+    tables: Tuple[str, ...],
+    daily: bool = False,
+) -> Tuple[str, Optional[datetime]]:
+    """ETag and Last-Modified of a read of `tables`, from their counters.
+
+    The date is part of the ETag, since time ranges like `days` shift every day.
+    For such `daily` reads Last-Modified is at least the start of today, so
+    If-Modified-Since does not revalidate yesterday's window either
+    """
+    counters = [versions.get(table, (0, None)) for table in tables]
+    etag = 'W/"{}-{:%Y%m%d}"'.format(
+        "-".join(str(version) for version, _ in counters), date.today()
+    )
+    updated = [dt for _, dt in counters if dt is not None]
+    last_modified = (
+        max(updated).replace(microsecond=0, tzinfo=timezone.utc) if updated else None
+    )
+    if daily:
+        # the window starts at local midnight, see `file_activity`
+        today = datetime.combine(date.today(), time.min).astimezone(timezone.utc)
+        last_modified = max(last_modified, today) if last_modified else today
+
+    return etag, last_modified
+
+
+def versioned(tables: Tuple[str, ...], daily: bool = False):
+    """Serve the rows of a read of `tables` as JSON, revalidated on their counters.
+
+    Set `daily` for reads whose time range moves with the date
+    """
+
+    def decorator(read: Read):
+        @functools.wraps(read)
+        async def handler(request: web.Request) -> web.Response:
+            versions = await aget_table_versions(request.app[ASYNC_SESSION])
+            etag, last_modified = validators(versions, tables, daily)
+            headers = {hdrs.ETAG: etag, hdrs.CACHE_CONTROL: "no-cache"}
+            if last_modified is not None:
+                headers[hdrs.LAST_MODIFIED] = format_datetime(
+                    last_modified, usegmt=True
+                )
+            if is_not_modified(request, etag, last_modified):
+                return web.Response(status=304, headers=headers)
+
+            key = (__name__, request.path_qs, etag)
+            hit, body = CACHE.get(key)
+            if not hit:
+                df = await read(request)
+                body = df.to_json(orient="records", date_format="iso").encode()
+                CACHE.set(key, body, tables=tables, ttl=RESPONSE_TTL)
+
+            return web.Response(
+                body=body, content_type="application/json", headers=headers
+            )
+
+        return handler
+
+    return decorator
+
+
+@versioned(tables=("file", "file_activity"))
+async def top_files(request: web.Request) -> pd.DataFrame:
+    return await aget_top_files(
+        request.app[ASYNC_SESSION],
+        n=_int_param(request, "n", 25),
+        mime_type=request.query.get("mime_type"),
+    )
+
+
+@versioned(tables=("file", "file_activity"))
+async def search_files(request: web.Request) -> pd.DataFrame:
+    search = request.query.get("q", "").strip()
+    if not search:
+        raise web.HTTPBadRequest(text="q is required")
+
+    return await asearch_files(
+        request.app[ASYNC_SESSION], search, n=_int_param(request, "n", 25)
+    )
+
+
+@versioned(tables=("file_session", "file_session_association"))
+async def sessions(request: web.Request) -> pd.DataFrame:
+    return await aget_recent_sessions(
+        request.app[ASYNC_SESSION], n=_int_param(request, "n", 25)
+    )
+
+
+@versioned(tables=("revision_rollup",), daily=True)
+async def file_activity(request: web.Request) -> pd.DataFrame:
+    days = _int_param(request, "days", 90)
+    since = datetime.combine(date.today() - timedelta(days=days), datetime.min.time())
+    return await aget_file_history(
+        request.app[ASYNC_SESSION], request.match_info["file_id"], since
+    )
+
+
+def make_app(async_session) -> web.Application:
+    app = web.Application()
+    app[ASYNC_SESSION] = async_session
+    app.add_routes(
+        [
+            web.get("/files/top", top_files),
+            web.get("/files/search", search_files),
+            web.get("/files/{file_id}/activity", file_activity),
+            web.get("/sessions", sessions),
+        ]
+    )
+
+    return app
+
+
+parser = argparse.ArgumentParser(description="api.py cli parameters")
+parser.add_argument(
+    "--host",
+    type=str,
+    default="0.0.0.0",
+    help="interface to listen on",
+)
+parser.add_argument(
+    "--port",
+    type=int,
+    default=API_PORT,
+    help="port to listen on",
+)
+
+
+def main(args):
+    """Run main app."""
+    psql = load_config(db_name="gdrive", cfg_file="postgres.cfg", config_dir=config_dir)
+    web.run_app(make_app(get_async_session(psql)), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    logger = setup_logger(
+        cmdLevel=logging.INFO,
+        saveFile=0,
+        savePandas=0,
+        jsonLogger=0,
+        color=1,
+        fmt=LOG_FMT,
+    )
+    cli_args = parser.parse_args()
+
+    main(cli_args)
@@ -0,0 +1,96 @@
+"""accounts.py, accounts and shared drives to ingest, and their rate limiters.
+
+accounts.cfg has one section per worker:
+
+    [default]
+    storage_json    = /home/paul/repos/gdrive-insights/gdrive_insights/storage.json
+    client_id_json  = /home/paul/repos/gdrive-insights/gdrive_insights/client_id.json
+    qps             = 5
+
+    [books]
+    storage_json    = /home/paul/repos/gdrive-insights/gdrive_insights/storage_work.json
+    drive_id        = 0AbCdEfGhIjKlUk9PVA
+    qps             = 2
+
+`drive_id` selects a shared drive instead of "My Drive". The section named
+`default` keeps using the `change` stream checkpoint of single account mode
+"""
+import configparser
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from ..settings import CLIENT_ID_JSON_FILE, STORAGE_JSON_FILE
+
+DEFAULT_ACCOUNT = "default"
+
+
+@dataclass
+class Account:
+    """One Google account or shared drive, fetched by its own worker."""
+
+    name: str
+    storage_json: str = str(STORAGE_JSON_FILE)
+    client_id_json: str = str(CLIENT_ID_JSON_FILE)
+    drive_id: Optional[str] = None
+    qps: float = 5.0
+
+    @property
+    def stream(self) -> str:
+        """Name of the page_checkpoint row of this account."""
+        if self.name == DEFAULT_ACCOUNT:
+            return "change"
+
+        return f"change:{self.name}"
+
+
+def load_accounts(path: Path) -> List[Account]:
+    """Load accounts from an ini file, one section per account."""
+    cfg = configparser.ConfigParser()
+    if not cfg.read(path):
+        raise FileNotFoundError(f"cannot read accounts file {path}")
+
+    accounts = []
+    for name in cfg.sections():
+        section = cfg[name]
+        accounts.append(
+            Account(
+                name=name,
+                storage_json=section.get("storage_json", str(STORAGE_JSON_FILE)),
+                client_id_json=section.get("client_id_json", str(CLIENT_ID_JSON_FILE)),
+                drive_id=section.get("drive_id", None),
+                qps=section.getfloat("qps", 5.0),
+            )
+        )
+
+    return accounts
+
+
+class RateLimiter:
+    """Token bucket limiting calls per second, safe to share between threads."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        assert rate > 0, f"{rate=} should be positive"
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a call is allowed."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.last) * self.rate
+                )
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
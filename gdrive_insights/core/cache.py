@@ -0,0 +1,167 @@
+"""cache.py, in-process LRU result cache with TTLs.
+
+Entries are tagged with the tables they were read from, so a push to a table
+can drop them right away with `invalidate(table)`
+
+Usage:
+    @cached(tables=("revision",), ttl=60)
+    def top_files(n=25):
+        ...
+"""
+import functools
+import inspect
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 60.0
+DEFAULT_MAXSIZE = 512
+
+
+class TTLCache:
+    """Thread-safe LRU cache, entries expire after `ttl` seconds.
+
+    When more than `maxsize` entries are stored, the least recently used is dropped
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, maxsize: int = DEFAULT_MAXSIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Tuple[float, Any, Tuple[str, ...]]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                self._data.pop(key, None)
+                self.misses += 1
+                return False, None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, item[1]
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        tables: Iterable[str] = (),
+        ttl: Optional[float] = None,
+    ) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value, tuple(tables))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, table: Optional[str] = None) -> int:
+        """Drop entries read from `table`, or all entries. Return number dropped."""
+        with self._lock:
+            keys = [k for k, v in self._data.items() if table is None or table in v[2]]
+            for k in keys:
+                del self._data[k]
+
+        if keys:
+            logger.debug(f"invalidated {len(keys)} entries of {table=}")
+
+        return len(keys)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+CACHE = TTLCache()
+
+
+def invalidate(table: Optional[str] = None) -> int:
+    return CACHE.invalidate(table)
+
+
+def _freeze(value: Any) -> Hashable:
+    """Make lists, sets and dicts usable as part of a key."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+
+    return value
+
+
+def cached(
+    tables: Iterable[str] = (),
+    ttl: Optional[float] = None,
+    cache: TTLCache = CACHE,
+    version: Optional[Callable[[], Hashable]] = None,
+    ignore: Iterable[str] = (),
+    copy: bool = False,
+):
+    """Cache results of a function per arguments.
+
+    version:    optional callable whose result is part of the key, e.g. the change
+                counters of `tables`, so writes by other processes also miss
+    ignore:     names of arguments left out of the key, e.g. a connection
+    copy:       return a copy of cached results, for callers that modify dataframes
+
+    Coroutine functions are cached too, their results are awaited once per miss
+    """
+    tables = tuple(tables)
+    ignore = frozenset(ignore)
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def make_key(args, kwargs) -> Hashable:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return (
+                func.__module__,
+                func.__qualname__,
+                tuple(
+                    (name, _freeze(value))
+                    for name, value in bound.arguments.items()
+                    if name not in ignore
+                ),
+                version() if version is not None else None,
+            )
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def awrapper(*args, **kwargs):
+                key = make_key(args, kwargs)
+                hit, value = cache.get(key)
+                if not hit:
+                    value = await func(*args, **kwargs)
+                    cache.set(key, value, tables=tables, ttl=ttl)
+
+                return value.copy() if copy else value
+
+            return awrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            hit, value = cache.get(key)
+            if not hit:
+                value = func(*args, **kwargs)
+                cache.set(key, value, tables=tables, ttl=ttl)
+
+            return value.copy() if copy else value
+
+        return wrapper
+
+    return decorator
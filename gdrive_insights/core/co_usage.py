@@ -0,0 +1,239 @@
+"""co_usage.py, sparse file-by-file co-usage matrix for session suggestions.
+
+Two files are used together when they are in the same opened fileSession, or were
+both revised on the same day. Candidate sessions of sessionize.py are only counted
+once they are opened, they come from the same revisions as the days. Counts are kept in a SciPy CSR matrix with one row and column
+per file id, so memory grows with the number of pairs seen, not with files squared.
+Updates only read sessions not counted yet, and days with files added since the last
+update, by `revision_rollup.created`. Revisions fetched after their day has closed
+are counted too. The matrix is persisted to CO_USAGE_FILE
+
+Usage:
+    co = CoUsage.load()
+    co.update(con)
+    co.save()
+    co.suggest(["1a2b3c"], n=5)
+"""
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from itertools import repeat
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse  # type: ignore[import]
+
+from ..settings import CO_USAGE_FILE
+
+logger = logging.getLogger(__name__)
+
+# opening files together says more than editing them on the same day
+SESSION_WEIGHT = 2.0
+REVISION_WEIGHT = 1.0
+# bigger groups are bulk uploads or syncs, not files used together
+MAX_GROUP_SIZE = 50
+MIN_DAY = datetime(1970, 1, 1)
+TMP_SFX = ".part"
+
+# files added to existing sessions are only counted by a full update
+SESSION_GROUPS = """
+    SELECT fsa.file_session_id AS key, array_agg(fsa.file_id) AS file_ids
+    FROM file_session_association AS fsa
+    JOIN file_session AS fs ON fs.id = fsa.file_session_id
+    WHERE NOT fs.is_candidate AND fsa.file_id IS NOT NULL
+        AND fs.id <> ALL(%(counted)s)
+    GROUP BY fsa.file_session_id
+    ORDER BY fsa.file_session_id;
+"""
+
+NOW_UTC = "SELECT now() AT TIME ZONE 'utc';"
+
+# whole days only, the current day still receives revisions. An update until `until`
+# counts the rows created until then of the days before it, the next one counts the
+# rest: rows created later, and all rows of days that had not closed yet
+REVISION_GROUPS = """
+    WITH new AS (
+        SELECT bucket, file_id FROM revision_rollup
+        WHERE granularity = 'day' AND created <= %(until)s
+            AND bucket < date_trunc('day', CAST(%(until)s AS timestamp))
+            AND (created > %(after)s
+                OR bucket >= date_trunc('day', CAST(%(after)s AS timestamp)))
+    )
+    SELECT rr.bucket AS key, array_agg(rr.file_id) AS file_ids,
+        array_agg(new.file_id) FILTER (WHERE new.file_id IS NOT NULL) AS new_ids
+    FROM revision_rollup AS rr
+    LEFT JOIN new ON new.bucket = rr.bucket AND new.file_id = rr.file_id
+    WHERE rr.granularity = 'day' AND rr.created <= %(until)s
+        AND rr.bucket IN (SELECT bucket FROM new)
+    GROUP BY rr.bucket
+    ORDER BY rr.bucket;
+"""
+
+
+class CoUsage:
+    """Weighted number of times every pair of files was used together."""
+
+    def __init__(
+        self,
+        ids: Sequence[str] = (),
+        matrix: Optional[sparse.csr_matrix] = None,
+        sessions: Iterable[int] = (),
+        last_update=MIN_DAY,
+    ):
+        self.ids: List[str] = list(ids)
+        self.index: Dict[str, int] = {file_id: i for i, file_id in enumerate(self.ids)}
+        n = len(self.ids)
+        if matrix is None:
+            matrix = sparse.csr_matrix((n, n), dtype=np.float32)
+        self.matrix = matrix
+        # ids of counted sessions, candidates are counted when they are opened
+        self.sessions: Set[int] = set(sessions)
+        # UTC time until which rows of revision_rollup were counted
+        self.last_update = last_update
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _indices(self, file_ids: Iterable[str]) -> np.ndarray:
+        """Get matrix indices of `file_ids`, adding the ones not seen before."""
+        res = []
+        for file_id in file_ids:
+            if (i := self.index.get(file_id)) is None:
+                i = self.index[file_id] = len(self.ids)
+                self.ids.append(file_id)
+            res.append(i)
+
+        return np.array(res, dtype=np.int64)
+
+    def add_groups(
+        self,
+        groups: Iterable[Sequence[str]],
+        weight=1.0,
+        new: Optional[Iterable[Sequence[str]]] = None,
+    ) -> int:
+        """Count every pair of files within each group. Return number of groups used.
+
+        new:    per group the files added since it was counted, only pairs with at
+                least one of them are counted
+        """
+        rows: List[np.ndarray] = []
+        cols: List[np.ndarray] = []
+        for group, new_ids in zip(groups, repeat(None) if new is None else new):
+            file_ids = sorted(set(f for f in group if f is not None))
+            if not 2 <= len(file_ids) <= MAX_GROUP_SIZE:
+                continue
+            ix = self._indices(file_ids)
+            row, col = np.repeat(ix, len(ix)), np.tile(ix, len(ix))
+            keep = row != col
+            if new_ids is not None:
+                is_new = np.isin(file_ids, list(new_ids))
+                keep &= np.repeat(is_new, len(ix)) | np.tile(is_new, len(ix))
+            if not keep.any():
+                continue
+            rows.append(row[keep])
+            cols.append(col[keep])
+
+        n = len(self.ids)
+        if self.matrix.shape[0] < n:
+            self.matrix = _resize(self.matrix, n)
+
+        if rows:
+            row, col = np.concatenate(rows), np.concatenate(cols)
+            data = np.full(len(row), weight, dtype=np.float32)
+            # duplicate pairs are summed
+            self.matrix = self.matrix + sparse.csr_matrix(
+                (data, (row, col)), shape=(n, n)
+            )
+
+        return len(rows)
+
+    def update(self, con) -> Tuple[int, int]:
+        """Count sessions and days not seen yet. Return number of sessions and days."""
+        sessions = pd.read_sql(
+            SESSION_GROUPS, con, params={"counted": sorted(self.sessions)}
+        )
+        nsession = self.add_groups(sessions.file_ids, weight=SESSION_WEIGHT)
+        self.sessions.update(int(key) for key in sessions.key)
+
+        with con.cursor() as cur:
+            cur.execute(NOW_UTC)
+            until = cur.fetchone()[0]
+        days = pd.read_sql(
+            REVISION_GROUPS, con, params={"after": self.last_update, "until": until}
+        )
+        nday = self.add_groups(days.file_ids, weight=REVISION_WEIGHT, new=days.new_ids)
+        self.last_update = until
+
+        logger.info(
+            f"{nsession=:,} {nday=:,}, {len(self):,} files {self.matrix.nnz:,} pairs"
+        )
+
+        return nsession, nday
+
+    def suggest(self, file_ids: Sequence[str], n=10) -> List[Tuple[str, float]]:
+        """Get (file_id, weight) of files most often used with `file_ids`."""
+        ix = [self.index[f] for f in file_ids if f in self.index]
+        if not ix:
+            return []
+
+        sub = self.matrix[ix].tocoo()
+        cols, inverse = np.unique(sub.col, return_inverse=True)
+        weights = np.bincount(inverse, weights=sub.data)
+        keep = ~np.isin(cols, ix)
+        cols, weights = cols[keep], weights[keep]
+        top = np.argsort(-weights, kind="stable")[:n]
+
+        return [(self.ids[c], float(w)) for c, w in zip(cols[top], weights[top])]
+
+    def save(self, path: Path = CO_USAGE_FILE) -> None:
+        m = self.matrix
+        tmp = Path(str(path) + TMP_SFX)
+        with open(tmp, "wb") as f:
+            np.savez_compressed(
+                f,
+                data=m.data,
+                indices=m.indices,
+                indptr=m.indptr,
+                shape=np.array(m.shape),
+                ids=np.array(self.ids, dtype=str),
+                sessions=np.array(sorted(self.sessions), dtype=np.int64),
+                last_update=np.datetime64(self.last_update),
+            )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path = CO_USAGE_FILE) -> "CoUsage":
+        """Load a saved matrix, or start an empty one."""
+        if not Path(path).exists():
+            return cls()
+
+        with np.load(path) as f:
+            matrix = sparse.csr_matrix(
+                (f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"])
+            )
+            if "last_update" in f:
+                last_update = pd.Timestamp(f["last_update"][()]).to_pydatetime()
+            else:
+                # rows of days up to last_day were counted, their `created` was set
+                # to their day by the migration
+                last_day = pd.Timestamp(f["last_day"][()]).to_pydatetime()
+                last_update = last_day + timedelta(days=1)
+            if "sessions" in f:
+                sessions = f["sessions"].tolist()
+            else:
+                # saved before candidates were skipped, all sessions up to
+                # last_session were counted
+                sessions = range(1, int(f["last_session"]) + 1)
+            return cls(
+                ids=f["ids"].tolist(),
+                matrix=matrix,
+                sessions=sessions,
+                last_update=last_update,
+            )
+
+
+def _resize(m: sparse.csr_matrix, n: int) -> sparse.csr_matrix:
+    """Grow a square CSR matrix to n x n, new rows are empty."""
+    indptr = np.concatenate([m.indptr, np.full(n - m.shape[0], m.indptr[-1])])
+    return sparse.csr_matrix((m.data, m.indices, indptr), shape=(n, n))
@@ -0,0 +1,237 @@
+"""metrics.py, in-process metrics for the ingestion daemon.
+
+Metrics are rendered in Prometheus text format, and can be scraped over http
+with `serve_metrics`, or dumped to a file periodically with `start_metrics_dumper`
+
+Usage:
+    with API_LATENCY.time(endpoint="changes.list"):
+        ...
+    ROWS_UPSERTED.inc(100, table="file")
+    print(render_metrics())
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from ..settings import DRIVE_DAILY_QUOTA
+
+logger = logging.getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_REGISTRY: List["Metric"] = []
+
+
+class Metric:
+    """Base metric, holds one value per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        assert set(labels) == set(self.labels), f"{labels=} != {self.labels=}"
+        return tuple(str(labels[k]) for k in self.labels)
+
+    def _fmt_labels(self, key: LabelValues, extra: str = "") -> str:
+        pairs = [f'{k}="{v}"' for k, v in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{self._fmt_labels(key)} {value}"
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.doc}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+
+class Counter(Metric):
+    """Monotonically increasing counter."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """Cumulative histogram with fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = buckets
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = [(k, list(v), self._sums[k]) for k, v in self._counts.items()]
+        for key, counts, total in items:
+            bounds = [str(b) for b in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, counts):
+                le = 'le="{}"'.format(bound)
+                yield f"{self.name}_bucket{self._fmt_labels(key, le)} {count}"
+            yield f"{self.name}_sum{self._fmt_labels(key)} {total}"
+            yield f"{self.name}_count{self._fmt_labels(key)} {counts[-1]}"
+
+
+API_CALLS = Counter(
+    "gdrive_api_calls_total", "Drive API calls per endpoint", ("endpoint", "status")
+)
+API_LATENCY = Histogram(
+    "gdrive_api_latency_seconds", "Drive API call latency per endpoint", ("endpoint",)
+)
+API_QUOTA_REMAINING = Gauge(
+    "gdrive_api_quota_remaining", "Drive API calls left in today's (UTC) quota"
+)
+CYCLE_PAGES = Gauge("gdrive_cycle_pages", "Pages fetched in last cycle", ("stream",))
+CYCLE_ITEMS = Gauge("gdrive_cycle_items", "Items fetched in last cycle", ("stream",))
+ROWS_UPSERTED = Counter(
+    "gdrive_db_rows_upserted_total", "Rows upserted per table", ("table",)
+)
+FORBIDDEN_FILES = Counter(
+    "gdrive_forbidden_files_total", "Files the Drive API refused to serve"
+)
+CHANGE_LAG = Gauge(
+    "gdrive_change_lag_seconds", "Seconds between newest ingested change and now"
+)
+
+_calls_today: Dict[str, int] = {}
+_calls_lock = threading.Lock()
+
+
+def _count_quota() -> None:
+    day = datetime.utcnow().date().isoformat()
+    with _calls_lock:
+        if day not in _calls_today:
+            _calls_today.clear()
+            _calls_today[day] = 0
+        _calls_today[day] += 1
+        API_QUOTA_REMAINING.set(DRIVE_DAILY_QUOTA - _calls_today[day])
+
+
+def api_call(endpoint: str, request):
+    """Execute a Drive API request, recording count, latency and quota use."""
+    status = "ok"
+    start = time.perf_counter()
+    try:
+        return request.execute()
+    except Exception as e:
+        status = str(getattr(getattr(e, "resp", None), "status", "error"))
+        raise
+    finally:
+        API_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+        API_CALLS.inc(endpoint=endpoint, status=status)
+        _count_quota()
+
+
+def render_metrics() -> str:
+    """Render all registered metrics in Prometheus text format."""
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+
+    return "\n".join(lines) + "\n"
+
+
+def dump_metrics(path: Path) -> None:
+    """Write metrics to file atomically, so readers never see a partial dump."""
+    path = Path(path)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(render_metrics())
+    tmp.replace(path)
+
+
+def start_metrics_dumper(path: Path, interval: float = 60) -> threading.Thread:
+    """Dump metrics to `path` every `interval` seconds in a daemon thread."""
+
+    def run():
+        while True:
+            try:
+                dump_metrics(path)
+            except OSError as e:
+                logger.warning(f"cannot dump metrics: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="metrics-dumper", daemon=True)
+    thread.start()
+    logger.info(f"dumping metrics to {path} every {interval}s")
+
+    return thread
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve metrics at http://host:port/ in a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    )
+    thread.start()
+    logger.info(f"serving metrics on {host}:{port}")
+
+    return server
@@ -0,0 +1,169 @@
+"""mount_index.py, index of all files on the rclone mount in a local sqlite file.
+
+Maps (name, size, modified time) to the path of a file relative to the mount, the
+way `File.path` is stored. Rescans are incremental: a directory is only listed again
+when its modification time changed, unchanged directories are walked using the
+subdirectories stored in the index, without touching the mount
+
+Usage:
+    index = MountIndex()
+    index.scan("/home/paul/gdrive")
+    index.lookup("book.pdf", 1_234_567, modified)
+"""
+import logging
+import os
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from ..settings import MOUNT_INDEX_FILE
+
+logger = logging.getLogger(__name__)
+
+# rclone reports modification times rounded to whole seconds
+MTIME_TOLERANCE = 1.0
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS dir (
+        path TEXT PRIMARY KEY,
+        parent TEXT,
+        mtime REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS ix_dir_parent ON dir (parent);
+    CREATE TABLE IF NOT EXISTS entry (
+        path TEXT PRIMARY KEY,
+        dir TEXT NOT NULL,
+        name TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS ix_entry_name_size ON entry (name, size);
+    CREATE INDEX IF NOT EXISTS ix_entry_dir ON entry (dir);
+"""
+
+
+class MountIndex:
+    """On-disk index of the files on a mount."""
+
+    def __init__(self, index_file: Path = MOUNT_INDEX_FILE):
+        self.con = sqlite3.connect(str(index_file))
+        self.con.executescript(SCHEMA)
+
+    def scan(self, mount: str, full=False) -> Tuple[int, int]:
+        """Update the index, return number of directories listed and skipped.
+
+        full:   list every directory, also when its modification time is unchanged
+        """
+        mount = str(mount).rstrip("/")
+        nlisted, nskipped = 0, 0
+        stack = ["/"]
+        with self.con:
+            while stack:
+                rel = stack.pop()
+                try:
+                    mtime = os.stat(mount + rel).st_mtime
+                except OSError as e:
+                    logger.warning(f"cannot stat {rel}: {e!r}")
+                    self._remove_dir(rel)
+                    continue
+
+                row = self.con.execute(
+                    "SELECT mtime FROM dir WHERE path = ?", (rel,)
+                ).fetchone()
+                if not full and row is not None and row[0] == mtime:
+                    stack.extend(self._subdirs(rel))
+                    nskipped += 1
+                    continue
+
+                stack.extend(self._list_dir(mount, rel, mtime))
+                nlisted += 1
+
+        logger.info(f"{nlisted=:,} {nskipped=:,} directories")
+
+        return nlisted, nskipped
+
+    def _subdirs(self, rel: str) -> List[str]:
+        rows = self.con.execute("SELECT path FROM dir WHERE parent = ?", (rel,))
+        return [path for (path,) in rows]
+
+    def _list_dir(self, mount: str, rel: str, mtime: float) -> List[str]:
+        """Replace the entries of one directory, return its subdirectories."""
+        subdirs, files = [], []
+        with os.scandir(mount + rel) as it:
+            for item in it:
+                path = _join(rel, item.name)
+                try:
+                    if item.is_dir(follow_symlinks=False):
+                        subdirs.append(path)
+                    elif item.is_file(follow_symlinks=False):
+                        st = item.stat(follow_symlinks=False)
+                        files.append((path, rel, item.name, st.st_size, st.st_mtime))
+                except OSError as e:
+                    logger.warning(f"cannot stat {path}: {e!r}")
+
+        # subdirectories that disappeared, with everything below them
+        for old in set(self._subdirs(rel)) - set(subdirs):
+            self._remove_dir(old)
+
+        self.con.execute("DELETE FROM entry WHERE dir = ?", (rel,))
+        self.con.executemany("INSERT INTO entry VALUES (?, ?, ?, ?, ?)", files)
+        parent = None if rel == "/" else str(Path(rel).parent)
+        self.con.execute(
+            "INSERT OR REPLACE INTO dir VALUES (?, ?, ?)", (rel, parent, mtime)
+        )
+        # new subdirectories are listed, since they have no mtime in the index yet
+        return subdirs
+
+    def _remove_dir(self, rel: str) -> None:
+        # no LIKE, `_` and `%` are common in file names
+        pfx = rel.rstrip("/") + "/"
+        args = (rel, len(pfx), pfx)
+        self.con.execute(
+            "DELETE FROM entry WHERE dir = ? OR substr(dir, 1, ?) = ?", args
+        )
+        self.con.execute(
+            "DELETE FROM dir WHERE path = ? OR substr(path, 1, ?) = ?", args
+        )
+
+    def candidates(self, name: str, size: int) -> List[Tuple[str, float]]:
+        """Get (path, mtime) of all files with this name and size."""
+        rows = self.con.execute(
+            "SELECT path, mtime FROM entry WHERE name = ? AND size = ?", (name, size)
+        )
+        return rows.fetchall()
+
+    def lookup(
+        self, name: str, size: int, modified: Optional[datetime] = None
+    ) -> Tuple[Optional[str], int]:
+        """Find the path of a file. Return (path, number of matches).
+
+        The path is None when nothing, or more than one file matches
+        """
+        matches = self.candidates(name, size)
+        if len(matches) > 1 and modified is not None:
+            ts = _timestamp(modified)
+            matches = [m for m in matches if abs(m[1] - ts) <= MTIME_TOLERANCE]
+
+        if len(matches) == 1:
+            return matches[0][0], 1
+
+        return None, len(matches)
+
+    def __len__(self) -> int:
+        return self.con.execute("SELECT count(*) FROM entry").fetchone()[0]
+
+    def close(self) -> None:
+        self.con.close()
+
+
+def _join(rel: str, name: str) -> str:
+    return rel.rstrip("/") + "/" + name
+
+
+def _timestamp(modified: datetime) -> float:
+    """Unix time of a naive UTC datetime, as stored in `File.modifiedTime`."""
+    if modified.tzinfo is None:
+        modified = modified.replace(tzinfo=timezone.utc)
+
+    return modified.timestamp()
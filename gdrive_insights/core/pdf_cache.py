@@ -0,0 +1,152 @@
+"""pdf_cache.py, local copies of PDFs on the rclone mount.
+
+Every file gets its own directory, `PDF_CACHE_DIR/<file_id>/<file name>`, so viewers
+still show the real file name. Copies keep the modification time of the remote file,
+which tells whether a copy is stale. The directory modification time is touched on
+every use, and is used to evict the least recently used copies once the cache grows
+beyond its budget
+"""
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable, List, Optional, Set, Tuple
+
+from ..settings import PDF_CACHE_BUDGET, PDF_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+TMP_SFX = ".part"
+
+
+class PdfCache:
+    """Size-bounded LRU cache of files copied from the mount."""
+
+    def __init__(self, cache_dir: Path = PDF_CACHE_DIR, budget: int = PDF_CACHE_BUDGET):
+        self.cache_dir = Path(cache_dir)
+        self.budget = budget
+
+    def _entry(self, file_id: str, src: Path) -> Path:
+        return self.cache_dir / file_id / src.name
+
+    def lookup(self, file_id: str, src: Path) -> Optional[Path]:
+        """Get an up to date copy of `src`, and mark it as used."""
+        copy = self._entry(file_id, src)
+        try:
+            cstat = copy.stat()
+        except FileNotFoundError:
+            return None
+
+        # stat on the mount is answered from rclone's directory cache
+        try:
+            sstat = src.stat()
+        except OSError:
+            # mount unavailable, a possibly stale copy beats no file at all
+            sstat = cstat
+
+        if (cstat.st_size, int(cstat.st_mtime)) != (sstat.st_size, int(sstat.st_mtime)):
+            return None
+
+        os.utime(copy.parent)
+
+        return copy
+
+    def resolve(self, file_id: str, src: Path) -> Path:
+        """Get the cached copy of `src` if there is one, else `src` itself."""
+        return self.lookup(file_id, src) or src
+
+    def add(self, file_id: str, src: Path) -> Optional[Path]:
+        """Copy `src` into the cache, unless it is already there. Return the copy."""
+        if (copy := self.lookup(file_id, src)) is not None:
+            return copy
+
+        copy = self._entry(file_id, src)
+        if copy.parent.exists():
+            # stale copy, or a renamed file
+            shutil.rmtree(copy.parent)
+        copy.parent.mkdir(parents=True)
+
+        tmp = copy.with_name(copy.name + TMP_SFX)
+        try:
+            shutil.copy2(src, tmp)
+            tmp.rename(copy)
+        except OSError as e:
+            logger.warning(f"cannot copy {src}: {e!r}")
+            shutil.rmtree(copy.parent, ignore_errors=True)
+            return None
+
+        return copy
+
+    def entries(self) -> List[Tuple[float, int, Path]]:
+        """Get (last used, size, directory) of every cached file, oldest first."""
+        res = []
+        if not self.cache_dir.exists():
+            return res
+
+        for entry in self.cache_dir.iterdir():
+            if not entry.is_dir():
+                continue
+            size = sum(f.stat().st_size for f in entry.iterdir() if f.is_file())
+            res.append((entry.stat().st_mtime, size, entry))
+
+        return sorted(res)
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep: Iterable[str] = (), target: Optional[int] = None) -> int:
+        """Remove least recently used copies until `target` bytes, by default the budget.
+
+        Return bytes freed
+        """
+        keep = set(keep)
+        target = self.budget if target is None else target
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+        for _, size, entry in entries:
+            if total - freed <= target:
+                break
+            if entry.name in keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            freed += size
+
+        if freed:
+            logger.info(f"evicted {freed / 2**20:,.1f} MB from {self.cache_dir}")
+
+        return freed
+
+    def prefetch(self, files: Iterable[Tuple[str, Path]]) -> Set[str]:
+        """Copy files in order of priority, as long as they fit the budget.
+
+        Copies of files not passed are evicted to make room, files that still do not
+        fit are skipped
+        """
+        files = list(files)
+        wanted = {file_id for file_id, _ in files}
+        self.evict(keep=wanted)
+
+        used = self.size()
+        cached: Set[str] = set()
+        for file_id, src in files:
+            if self.lookup(file_id, src) is not None:
+                cached.add(file_id)
+                continue
+            try:
+                size = src.stat().st_size
+            except OSError as e:
+                logger.warning(f"cannot stat {src}: {e!r}")
+                continue
+            if used + size > self.budget:
+                used -= self.evict(keep=wanted, target=self.budget - size)
+            if used + size > self.budget:
+                logger.debug(f"{src.name} does not fit the budget, skipping")
+                continue
+
+            if self.add(file_id, src) is not None:
+                used += size
+                cached.add(file_id)
+                logger.info(f"prefetched {src.name} ({size / 2**20:,.1f} MB)")
+
+        return cached
@@ -31,7 +31,8 @@ def unnest_col(
         logger.warning(f"no none value found for {pfxCol=}")
         return df
 
-    kys = sel.values[0].keys()
+    # union of keys, optional fields like `size` are missing for some items
+    kys = dict.fromkeys(k for x in sel.values for k in x.keys())
 
     renameAs = renameColAs or pfxCol
     newKeys = [(k, f"{renameAs}_{k}") for k in kys]
@@ -49,15 +50,20 @@ def is_not_none(x: Optional[int]) -> TypeGuard[int]:
     return x is not None
 
 
-def create_gdrive() -> Resource:
-    """Create Google Drive API connector."""
-    store = file.Storage(STORAGE_JSON_FILE)
+def create_gdrive(
+    storage_json_file=STORAGE_JSON_FILE, client_id_json_file=CLIENT_ID_JSON_FILE
+) -> Resource:
+    """Create Google Drive API connector.
+
+    Pass other credential files to connect to another account
+    """
+    store = file.Storage(storage_json_file)
     creds = store.get()
 
     # TODO: auto refresh access token
     # however, creds.refresh(Request()) cannot be used
     if not creds or creds.invalid:
-        flow = client.flow_from_clientsecrets(CLIENT_ID_JSON_FILE, SCOPES)
+        flow = client.flow_from_clientsecrets(client_id_json_file, SCOPES)
         creds = tools.run_flow(flow, store)
 
     DRIVE = build("drive", "v3", credentials=creds)
@@ -0,0 +1,76 @@
+"""dashboard.py, streamlit dashboard of recent revisions.
+
+Reads only the rollup tables through the cached queries in db/queries.py,
+so redraws do not touch `revision`
+
+Usage:
+    # backfill rollups once, after that fetching keeps them up to date
+    python db/rollups.py --backfill
+    streamlit run dashboard.py
+"""
+import logging
+
+import streamlit as st
+from gdrive_insights.db import queries
+from gdrive_insights.settings import PDF_FILETYPE
+
+logger = logging.getLogger(__name__)
+
+MIME_TYPES = {
+    "all": None,
+    "pdf": PDF_FILETYPE,
+    "google doc": "application/vnd.google-apps.document",
+    "google sheet": "application/vnd.google-apps.spreadsheet",
+}
+
+st.set_page_config(page_title="gdrive-insights", layout="wide")
+st.title("gdrive-insights")
+
+with st.sidebar:
+    days = st.slider("days", min_value=7, max_value=365, value=30, step=7)
+    n = st.slider("files", min_value=5, max_value=100, value=25, step=5)
+    mime_type = MIME_TYPES[st.selectbox("file type", list(MIME_TYPES))]
+
+daily = queries.daily_activity(days=days)
+
+col1, col2, col3 = st.columns(3)
+col1.metric("revisions", f"{int(daily['nrevision'].sum()):,}")
+col2.metric("active days", f"{len(daily):,}")
+col3.metric("busiest day", f"{int(daily['nrevision'].max()):,}" if len(daily) else "-")
+
+st.subheader(f"Revisions per day, last {days} days")
+st.bar_chart(daily.set_index("day")["nrevision"])
+
+left, right = st.columns(2)
+
+with left:
+    st.subheader("Most active files")
+    top = queries.top_files(n=n, mime_type=mime_type)
+    st.dataframe(top.drop(columns=["file_id"]), use_container_width=True)
+
+with right:
+    st.subheader("Recently revised files")
+    recent = queries.recent_files(n=n)
+    st.dataframe(recent.drop(columns=["file_id"]), use_container_width=True)
+
+left, right = st.columns(2)
+
+with left:
+    st.subheader("Revisions per file type")
+    by_mime = queries.mime_activity(days=days)
+    st.line_chart(
+        by_mime.pivot_table(
+            index="bucket", columns="mime_type", values="nrevision", aggfunc="sum"
+        )
+    )
+
+with right:
+    st.subheader("Revisions per hour of day (UTC)")
+    st.bar_chart(queries.hourly_activity(days=days))
+
+if not top.empty:
+    st.subheader("File history")
+    names = dict(zip(top["file_name"], top["file_id"]))
+    file_name = st.selectbox("file", list(names))
+    history = queries.file_history(names[file_name], days=days)
+    st.bar_chart(history.set_index("day")["nrevision"])
@@ -26,31 +26,66 @@ How to run:
 from __future__ import print_function
 
 import logging
+from datetime import datetime
 from typing import Any, Dict, List, Optional
 
 import pandas as pd
 import psycopg2  # type: ignore[import]
 from googleapiclient.errors import HttpError  # type: ignore[import]
+from psycopg2.extras import execute_values  # type: ignore[import]
 from rarc_utils.log import setup_logger
 from tqdm import tqdm  # type: ignore[import]
 
+from .core.metrics import CYCLE_ITEMS, CYCLE_PAGES, FORBIDDEN_FILES, api_call
 from .core.utils import create_gdrive, unnest_col
-from .db.helpers import get_or_update_page_token, update_is_forbidden
+from .db.arrow_export import read_arrow
+from .db.fetch_failures import (
+    RATE_LIMITED,
+    FetchFailure,
+    get_failures,
+    record_failures,
+)
+from .db.helpers import cached_query, psession
+from .db.instrument import instrument_from_env
+from .db.methods import CHANGE_COLUMNS, CHANGE_NATURAL_KEY
+from .db.methods import methods as db_methods
 from .db.models import psql
-from .settings import GOOGLE_DOCUMENT_FILETYPE, PDF_FILETYPE, REVISIONS_FILE
+from .db.scheduler import RevisionScheduler
+from .db.rollups import (
+    ACTIVITY_BY_FILE,
+    ACTIVITY_BY_MIME_TYPE,
+    GRANULARITIES,
+    pick_granularity,
+)
+from .settings import (
+    ARROW_DIR,
+    ARROW_SFX,
+    GOOGLE_DOCUMENT_FILETYPE,
+    PDF_FILETYPE,
+    REVISION_DAILY_BUDGET,
+    REVISIONS_FILE,
+    UNNAMED,
+)
 
 log_fmt = "%(asctime)s - %(module)-16s - %(lineno)-4s - %(funcName)-16s - %(levelname)-7s - %(message)s"  # name
 logger = setup_logger(
     cmdLevel=logging.INFO, saveFile=0, savePandas=0, jsonLogger=0, color=1, fmt=log_fmt
 )
 
-UNNAMED = "Naamloos document"
 FILE_ID = "id"
+FAILURE_BATCH_SIZE = 100
+
+# size and modifiedTime let resolve_paths.py find files on the mount
+CHANGE_FIELDS = (
+    "nextPageToken, newStartPageToken, changes(kind, type, changeType, time, removed, "
+    "fileId, driveId, file(kind, id, name, mimeType, size, modifiedTime, parents, trashed))"
+)
 
 # connect to postgresql
 con = psycopg2.connect(
     database=psql.db, user=psql.user, password=psql.passwd, host=psql.host, port="5432"
 )
+instrument_from_env(con)
 
 #### google drive api
 DRIVE = create_gdrive()
@@ -64,17 +99,50 @@ class data_methods:
     def changes_to_pandas(items: List[Dict[str, Any]]) -> pd.DataFrame:
 
         df = pd.DataFrame(items)
-        df = df.dropna(subset="file").reset_index()
+        if "fileId" not in df.columns:
+            return pd.DataFrame()
+
+        if "file" not in df.columns:
+            df["file"] = None
+        # removed files come without `file`, projection.py marks them removed
+        removed = df["removed"].fillna(False).astype(bool)
+        df = df[df["file"].notna() | removed].reset_index()
+        if df.empty:
+            return df
+
         df["page_token"] = df["page_token"].astype(int)
-        df = df.pipe(unnest_col, pfxCol="file")
+        if df["file"].notna().any():
+            df["file"] = df["file"].where(df["file"].notna(), None)
+            df = df.pipe(unnest_col, pfxCol="file")
+        else:
+            df = df.drop(columns="file")
         df["id"] = df["fileId"]
 
         return df
 
     @staticmethod
-    def changes_to_sql(df: pd.DataFrame, table="change") -> None:
+    def changes_to_sql(df: pd.DataFrame, table="change") -> int:
+        """Insert changes, skipping changes that are already stored."""
+        recs = db_methods._make_change_recs(df)
+        cols = ", ".join(f'"{c}"' for c in CHANGE_COLUMNS)
+        query = """
+        INSERT INTO {} ({}) VALUES %s
+        ON CONFLICT ON CONSTRAINT {} DO NOTHING RETURNING 1
+        """.format(
+            table, cols, CHANGE_NATURAL_KEY
+        )
+        values = [
+            tuple(str(r[c]) if c == "id" else r[c] for c in CHANGE_COLUMNS)
+            for r in recs
+        ]
+        with con, con.cursor() as cur:
+            ninserted = len(
+                execute_values(cur, query, values, page_size=1_000, fetch=True)
+            )
 
-        df.to_sql(table, con, if_exists="append", index=False, index_label=False)
+        logger.info(f"inserted {ninserted:,} of {len(recs):,} changes")
+
+        return ninserted
 
     @staticmethod
     def revisions_to_sql(df: pd.DataFrame, table="revision") -> None:
@@ -82,11 +150,18 @@ class data_methods:
         df.to_sql(table, con, if_exists="append", index=False, index_label=False)
 
     @staticmethod
-    def files_from_sql(n: Optional[int] = None, dropForbiddenRows=True) -> pd.DataFrame:
-        q = "SELECT * FROM file"
+    @cached_query(tables=("file",))
+    def files_from_sql(
+        n: Optional[int] = None, dropForbiddenRows=True, dropRemovedRows=True
+    ) -> pd.DataFrame:
+        q = "SELECT * FROM file WHERE true"
 
         if dropForbiddenRows:
-            q += " WHERE NOT is_forbidden"
+            q += " AND NOT is_forbidden"
+
+        # removed and trashed files, see db/projection.py
+        if dropRemovedRows:
+            q += " AND NOT is_removed"
 
         if n is not None:
             q += " LIMIT {}".format(n)
@@ -118,6 +193,9 @@ class data_methods:
         items: List[Dict[str, Any]], localize=False
     ) -> pd.DataFrame:
         df = pd.DataFrame(items)
+        if df.empty:
+            return df
+
         df["modifiedTime_iso"] = df["modifiedTime"]
 
         df["modifiedTime"] = pd.to_datetime(df.modifiedTime)
@@ -138,6 +216,38 @@ class data_methods:
 
         return df
 
+    @staticmethod
+    @cached_query(tables=("revision_rollup", "mime_rollup"))
+    def activity_from_sql(
+        start: datetime,
+        end: datetime,
+        by="file",
+        file_ids: Optional[List[str]] = None,
+        mime_type: Optional[str] = None,
+        granularities=GRANULARITIES,
+    ) -> pd.DataFrame:
+        """Get revisions per bucket in [start, end), from the coarsest rollup that fits.
+
+        by          'file' or 'mime_type'
+        The range is widened to whole hours when it does not fall on bucket boundaries
+        """
+        granularity, start, end = pick_granularity(start, end, granularities)
+        params = dict(granularity=granularity, start=start, end=end)
+        if by == "file":
+            query = ACTIVITY_BY_FILE
+            params["file_ids"] = file_ids
+        elif by == "mime_type":
+            query = ACTIVITY_BY_MIME_TYPE
+            params["mime_type"] = mime_type
+        else:
+            raise ValueError(f"cannot group activity {by=}")
+
+        logger.debug(f"{granularity=} {start=} {end=}")
+        df: pd.DataFrame = pd.read_sql_query(query, con, params=params)
+        df["granularity"] = granularity
+
+        return df
+
     @staticmethod
     def set_file_is_forbidden_df(df: pd.DataFrame, file_id: str) -> pd.DataFrame:
         df = df.copy()
@@ -198,39 +308,75 @@ class data_methods:
         """Retrieve the list of revisions for file_id."""
         assert file_id is not None
         logger.debug(f"{file_id=}")
-        response = DRIVE.revisions().list(fileId=file_id).execute()
+        response = api_call("revisions.list", DRIVE.revisions().list(fileId=file_id))
         revisions: List[Dict[str, Any]] = response["revisions"]
 
         return revisions
 
     @classmethod
     def fetch_revisions_over_files(
-        cls, df: pd.DataFrame, use_sql_cache=True, progress=True
+        cls,
+        df: pd.DataFrame,
+        use_sql_cache=True,
+        progress=True,
+        batch_size=FAILURE_BATCH_SIZE,
+        daily_budget=REVISION_DAILY_BUDGET,
     ) -> pd.DataFrame:
+        """Fetch revisions of files in df, most valuable first, within today's budget.
 
+        Files that failed recently are skipped, and files left when the budget is
+        spent are fetched another day, see db/scheduler.py
+        batch_size:     write progress and failures of this many files at once
+        daily_budget:   revisions.list calls per day
+        """
         logger.info(f"fetching revisions")
         # if use_sql_cache:
         #     existing_ids: pd.DataFrame = pd.read_sql_query(
         #         "SELECT id FROM revision; ", con
         #     )
 
+        file_ids = list(df[FILE_ID].values)
+        failed_before = get_failures(psession, file_ids)
+        if nwaiting := sum(failed_before.values()):
+            logger.info(f"skipping {nwaiting:,} files until their retry time")
+
         forbidden_ids = set()
+        failures: List[FetchFailure] = []
+        ok_ids: List[str] = []
+        fetched: List[str] = []
         file_id_to_revisions = {}
-        for file_id in tqdm(df[FILE_ID].values, disable=not progress):
+        scheduler = RevisionScheduler.from_db(
+            psession,
+            [f for f in file_ids if not failed_before.get(f, False)],
+            daily_budget=daily_budget,
+        )
+        ntodo = min(len(scheduler), scheduler.budget)
+        for i, file_id in enumerate(tqdm(scheduler, total=ntodo, disable=not progress)):
             try:
-                rev = cls.fetch_revisions(file_id)
+                file_id_to_revisions[file_id] = cls.fetch_revisions(file_id)
+                fetched.append(file_id)
+                if file_id in failed_before:
+                    ok_ids.append(file_id)
 
             except Exception as e:
-                df = cls.set_file_is_forbidden_df(df, file_id)
-                logger.warning(f"should set {file_id=} to is_forbidden")
-                forbidden_ids.add(file_id)
-
-                update_is_forbidden(file_id)
-                logger.info(f"{forbidden_ids=}")
-
-                continue
-
-            file_id_to_revisions[file_id] = rev
+                failure = FetchFailure.from_error(file_id, e)
+                logger.warning(f"{file_id=} failed: {failure.error_class}")
+                failures.append(failure)
+                if failure.is_permanent:
+                    forbidden_ids.add(file_id)
+                    FORBIDDEN_FILES.inc()
+                elif failure.error_class == RATE_LIMITED:
+                    scheduler.stop()
+
+            if (i + 1) % batch_size == 0:
+                record_failures(psession, failures, ok_ids)
+                scheduler.commit(psession, fetched)
+                failures, ok_ids, fetched = [], [], []
+
+        record_failures(psession, failures, ok_ids)
+        scheduler.commit(psession, fetched)
+        if scheduler.left_over:
+            logger.info(f"{len(scheduler.left_over):,} files left for the next run")
 
         # add fileId to records
         aa = [
@@ -291,6 +437,7 @@ class data_methods:
             saved start page token.
         """
         files = []
+        npage = 0
 
         try:
 
@@ -299,9 +446,11 @@ class data_methods:
 
             nfetch = 0
             while page_token is not None:
-                response = (
-                    DRIVE.files().list(pageToken=page_token, spaces="drive").execute()
+                response = api_call(
+                    "files.list",
+                    DRIVE.files().list(pageToken=page_token, spaces="drive"),
                 )
+                npage += 1
                 for file in response.get("files"):
                     # print(F'Change found for file: {change.get("fileId")}')
                     file["page_token"] = page_token
@@ -322,16 +471,35 @@ class data_methods:
             print(f"An error occurred: {error}")
             saved_start_page_token = None
 
+        CYCLE_PAGES.set(npage, stream="file")
+        CYCLE_ITEMS.set(len(files), stream="file")
+
         return files
 
     @staticmethod
-    def fetch_changes(saved_start_page_token, max_fetch=None) -> List[dict]:
+    def fetch_changes(
+        saved_start_page_token,
+        max_fetch=None,
+        on_batch=None,
+        batch_pages=10,
+        drive=None,
+        drive_id: Optional[str] = None,
+        limiter=None,
+        stream="change",
+    ) -> List[dict]:
         """Retrieve the list of changes for the currently authenticated user.
 
             prints changed file's ID
         Args:
             saved_start_page_token : StartPageToken for the current state of the
             account.
+            on_batch : optional callback(changes, next_page_token), called every
+            `batch_pages` pages and after the last page. Store the changes and the
+            token in one transaction to resume exactly after a crash.
+            drive : Drive API connector of another account, defaults to DRIVE
+            drive_id : fetch changes of this shared drive instead of My Drive
+            limiter : optional `RateLimiter`, acquired before every API call
+            stream : name of the changes stream, used as metrics label
         Returns:
             saved start page token.
 
@@ -340,6 +508,14 @@ class data_methods:
         for guides on implementing OAuth2 for the application.
         """
         changes = []
+        batch: List[dict] = []
+        npage = 0
+        drive = drive or DRIVE
+        list_kwargs: Dict[str, Any] = {"spaces": "drive", "fields": CHANGE_FIELDS}
+        if drive_id is not None:
+            list_kwargs.update(
+                driveId=drive_id, includeItemsFromAllDrives=True, supportsAllDrives=True
+            )
 
         try:
 
@@ -350,26 +526,37 @@ class data_methods:
 
             nfetch = 0
             while page_token is not None:
-                response = (
-                    DRIVE.changes().list(pageToken=page_token, spaces="drive").execute()
+                if limiter is not None:
+                    limiter.acquire()
+                response = api_call(
+                    "changes.list",
+                    drive.changes().list(pageToken=page_token, **list_kwargs),
                 )
+                npage += 1
                 for change in response.get("changes"):
                     # print(F'Change found for file: {change.get("fileId")}')
                     change["page_token"] = page_token
 
                 changes += response.get("changes")
-                print(f"{page_token=} {changes[-1]['time']=}")
+                batch += response.get("changes")
+                if changes:
+                    print(f"{page_token=} {changes[-1]['time']=}")
                 if "newStartPageToken" in response:
                     # Last page, save this token for the next polling interval
                     saved_start_page_token = response.get("newStartPageToken")
 
                 page_token = response.get("nextPageToken")
+                stop = max_fetch is not None and nfetch >= max_fetch
 
-                # submit page_token to postgres
-                if page_token is not None:
-                    get_or_update_page_token("change", page_token)
+                # checkpoint the token to continue from
+                next_token = page_token or response.get("newStartPageToken")
+                if on_batch is not None and (
+                    npage % batch_pages == 0 or page_token is None or stop
+                ):
+                    on_batch(batch, next_token)
+                    batch = []
 
-                if max_fetch is not None and nfetch >= max_fetch:
+                if stop:
                     break
 
                 nfetch += 1
@@ -378,13 +565,39 @@ class data_methods:
             print(f"An error occurred: {error}")
             saved_start_page_token = None
 
+        CYCLE_PAGES.set(npage, stream=stream)
+        CYCLE_ITEMS.set(len(changes), stream=stream)
+
         return changes
 
+    @staticmethod
+    def fetch_start_page_token(drive=None, drive_id: Optional[str] = None) -> str:
+        """Get the token of the current state of My Drive, or of a shared drive."""
+        kwargs: Dict[str, Any] = {}
+        if drive_id is not None:
+            kwargs.update(driveId=drive_id, supportsAllDrives=True)
+
+        response = api_call(
+            "changes.getStartPageToken",
+            (drive or DRIVE).changes().getStartPageToken(**kwargs),
+        )
+        start_page_token: str = response["startPageToken"]
+
+        return start_page_token
+
     @staticmethod
     def revisions_from_feather() -> pd.DataFrame:
         df: pd.DataFrame = pd.read_feather(REVISIONS_FILE)
         return df
 
+    @staticmethod
+    def table_from_arrow(
+        table="revision", columns: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        """Load a table exported by db/arrow_export.py, much faster than *_from_sql."""
+        path = (ARROW_DIR / table).with_suffix(ARROW_SFX)
+        return read_arrow(path, columns=columns).to_pandas()
+
     @staticmethod
     def revisions_data_analysis(
         changes_df: pd.DataFrame, rev_df: pd.DataFrame
@@ -1,15 +1,25 @@
 from logging.config import fileConfig
+from urllib.parse import quote_plus
 
 from alembic import context
 # add your model's MetaData object here
 # for 'autogenerate' support
-from models import Base
+from models import Base, psql
 from sqlalchemy import engine_from_config, pool
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
+# use the credentials from postgres.cfg, unless alembic.ini sets a url
+if not config.get_main_option("sqlalchemy.url"):
+    config.set_main_option(
+        "sqlalchemy.url",
+        "postgresql://{}:{}@{}:5432/{}".format(
+            psql.user, quote_plus(psql.passwd), psql.host, psql.db
+        ).replace("%", "%%"),
+    )
+
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 fileConfig(config.config_file_name)
@@ -0,0 +1,33 @@
+"""file_activity.score, decayed activity score per file
+
+Scores of existing rows are computed by `ipy db/rollups.py -i -- --backfill`
+
+Revision ID: 0bdaba662d6a
+Revises: 719ef28aa97f
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0bdaba662d6a'
+down_revision = '719ef28aa97f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "file_activity",
+        sa.Column("score", sa.Float(), nullable=False, server_default="0"),
+    )
+    op.create_index(
+        "ix_file_activity_score", "file_activity", [sa.text("score DESC")]
+    )
+
+
+def downgrade():
+    op.drop_index("ix_file_activity_score", table_name="file_activity")
+    op.drop_column("file_activity", "score")
@@ -0,0 +1,67 @@
+"""job table for revision and path workers, supersedes revision_outbox
+
+Revision ID: 124985ee9cbf
+Revises: be3a40457319
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '124985ee9cbf'
+down_revision = 'be3a40457319'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "job",
+        sa.Column("id", sa.BigInteger(), primary_key=True),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("file_id", sa.String(), sa.ForeignKey("file.id"), nullable=False),
+        sa.Column("status", sa.String(), nullable=False, server_default="queued"),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("worker", sa.String()),
+        sa.Column("lease_until", sa.DateTime()),
+        sa.Column("run_after", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column("last_error", sa.String()),
+        sa.Column("queued", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column("created", sa.DateTime(), server_default=sa.func.now()),
+        sa.Column("updated", sa.DateTime(), server_default=sa.func.now()),
+        sa.UniqueConstraint("kind", "file_id", name="uq_job_kind_file_id"),
+    )
+    op.create_index(
+        "ix_job_claim",
+        "job",
+        ["kind", "queued"],
+        postgresql_where=sa.text("status <> 'dead'"),
+    )
+    op.execute(
+        """
+        INSERT INTO job (kind, file_id, queued)
+        SELECT 'revisions', file_id, queued FROM revision_outbox;
+        """
+    )
+    op.drop_index("ix_revision_outbox_queued", table_name="revision_outbox")
+    op.drop_table("revision_outbox")
+
+
+def downgrade():
+    op.create_table(
+        "revision_outbox",
+        sa.Column("file_id", sa.String(), sa.ForeignKey("file.id"), primary_key=True),
+        sa.Column("queued", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column("created", sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.create_index("ix_revision_outbox_queued", "revision_outbox", ["queued"])
+    op.execute(
+        """
+        INSERT INTO revision_outbox (file_id, queued)
+        SELECT file_id, queued FROM job WHERE kind = 'revisions' AND status <> 'dead';
+        """
+    )
+    op.drop_index("ix_job_claim", table_name="job")
+    op.drop_table("job")
@@ -0,0 +1,71 @@
+"""file state projected from the change stream, and file_snapshot
+
+change gains the file after the change, file gains parent_id, is_removed and
+change_time, written by db/projection.py. Changes stored before this migration have
+no file state, `python projection.py` marks files removed from new changes on
+
+Revision ID: 1c0289808b34
+Revises: c054577d91d7
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1c0289808b34'
+down_revision = 'c054577d91d7'
+branch_labels = None
+depends_on = None
+
+PDF_NOT_FORBIDDEN = sa.text("\"mimeType\" = 'application/pdf' AND NOT is_forbidden")
+PDF_CURRENT = sa.text(
+    "\"mimeType\" = 'application/pdf' AND NOT is_forbidden AND NOT is_removed"
+)
+
+
+def upgrade():
+    op.add_column("change", sa.Column("name", sa.String()))
+    op.add_column("change", sa.Column("mimeType", sa.String()))
+    op.add_column("change", sa.Column("parent_id", sa.String()))
+    op.add_column("change", sa.Column("trashed", sa.Boolean()))
+    # partitioned, cannot be built concurrently
+    op.create_index("ix_change_created", "change", ["created"])
+
+    op.add_column("file", sa.Column("parent_id", sa.String()))
+    op.add_column(
+        "file",
+        sa.Column("is_removed", sa.Boolean(), nullable=False, server_default="false"),
+    )
+    op.add_column("file", sa.Column("change_time", sa.DateTime()))
+    op.drop_index("ix_file_pdf", table_name="file")
+    op.create_index("ix_file_pdf", "file", ["id"], postgresql_where=PDF_CURRENT)
+
+    op.create_table(
+        "file_snapshot",
+        sa.Column("taken", sa.DateTime(), primary_key=True),
+        sa.Column("file_id", sa.String(), primary_key=True),
+        sa.Column("name", sa.String()),
+        sa.Column("mimeType", sa.String()),
+        sa.Column("parent_id", sa.String()),
+        sa.Column("is_removed", sa.Boolean(), nullable=False),
+        sa.Column("change_time", sa.DateTime()),
+    )
+
+
+def downgrade():
+    op.drop_table("file_snapshot")
+
+    op.drop_index("ix_file_pdf", table_name="file")
+    op.create_index("ix_file_pdf", "file", ["id"], postgresql_where=PDF_NOT_FORBIDDEN)
+    op.drop_column("file", "change_time")
+    op.drop_column("file", "is_removed")
+    op.drop_column("file", "parent_id")
+
+    op.drop_index("ix_change_created", table_name="change")
+    op.drop_column("change", "trashed")
+    op.drop_column("change", "parent_id")
+    op.drop_column("change", "mimeType")
+    op.drop_column("change", "name")
+    op.execute("DELETE FROM page_checkpoint WHERE stream = 'projection';")
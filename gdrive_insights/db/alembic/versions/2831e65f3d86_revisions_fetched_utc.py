@@ -0,0 +1,35 @@
+"""file.revisions_fetched in UTC
+
+It was written with the server-local now(), while scheduler.py compares it with
+change.time, which is UTC. Existing times are converted from the server time zone
+
+Revision ID: 2831e65f3d86
+Revises: 29d4038ec744
+Create Date: 2026-10-20 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2831e65f3d86'
+down_revision = '29d4038ec744'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "UPDATE file SET revisions_fetched = revisions_fetched "
+        "AT TIME ZONE current_setting('TimeZone') AT TIME ZONE 'utc' "
+        "WHERE revisions_fetched IS NOT NULL;"
+    )
+
+
+def downgrade():
+    op.execute(
+        "UPDATE file SET revisions_fetched = revisions_fetched "
+        "AT TIME ZONE 'utc' AT TIME ZONE current_setting('TimeZone') "
+        "WHERE revisions_fetched IS NOT NULL;"
+    )
@@ -0,0 +1,36 @@
+"""revision_rollup.created, the first time a file was seen in a bucket
+
+co_usage.py counts days from the rows created since its last update, so revisions
+fetched after their day has closed are counted too. Existing rows get their bucket,
+saved co-usage matrices have counted up to their last day
+
+Revision ID: 29d4038ec744
+Revises: 74bce3bcad5c
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '29d4038ec744'
+down_revision = '74bce3bcad5c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "revision_rollup",
+        sa.Column("created", sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.execute("UPDATE revision_rollup SET created = bucket;")
+    op.create_index(
+        "ix_revision_rollup_created", "revision_rollup", ["granularity", "created"]
+    )
+
+
+def downgrade():
+    op.drop_index("ix_revision_rollup_created", table_name="revision_rollup")
+    op.drop_column("revision_rollup", "created")
@@ -0,0 +1,35 @@
+"""table_version.updated in UTC
+
+BUMP_VERSION writes it as UTC, the API serves it as Last-Modified. Times written
+before with the server-local now() are converted from the server time zone
+
+Revision ID: 3a73179a1bba
+Revises: 2831e65f3d86
+Create Date: 2026-10-20 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a73179a1bba'
+down_revision = '2831e65f3d86'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "UPDATE table_version SET updated = updated "
+        "AT TIME ZONE current_setting('TimeZone') AT TIME ZONE 'utc' "
+        "WHERE updated IS NOT NULL;"
+    )
+
+
+def downgrade():
+    op.execute(
+        "UPDATE table_version SET updated = updated "
+        "AT TIME ZONE 'utc' AT TIME ZONE current_setting('TimeZone') "
+        "WHERE updated IS NOT NULL;"
+    )
@@ -0,0 +1,43 @@
+"""page_checkpoint table, with an integer token per changes stream
+
+Seeded with the highest token in page_token, which is where fetch_new_files
+used to resume from
+
+Revision ID: 4b98c660b4e5
+Revises: 90eedd15052a
+Create Date: 2026-10-19 13:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b98c660b4e5'
+down_revision = '90eedd15052a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "page_checkpoint",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("stream", sa.String(), nullable=False, unique=True),
+        sa.Column("token", sa.BigInteger(), nullable=False),
+        sa.Column("created", sa.DateTime(), server_default=sa.func.now()),
+        sa.Column("updated", sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.create_index("ix_page_checkpoint_token", "page_checkpoint", ["token"])
+    op.execute(
+        """
+        INSERT INTO page_checkpoint (stream, token)
+        SELECT 'change', max(value::bigint) FROM page_token WHERE "table" = 'change'
+        HAVING max(value::bigint) IS NOT NULL;
+        """
+    )
+
+
+def downgrade():
+    op.drop_index("ix_page_checkpoint_token", table_name="page_checkpoint")
+    op.drop_table("page_checkpoint")
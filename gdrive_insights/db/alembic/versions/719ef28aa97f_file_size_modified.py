@@ -0,0 +1,28 @@
+"""file.size and file."modifiedTime", to find files on the rclone mount
+
+Filled by fetch_new_files for files that change from now on
+
+Revision ID: 719ef28aa97f
+Revises: 124985ee9cbf
+Create Date: 2026-10-19 15:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '719ef28aa97f'
+down_revision = '124985ee9cbf'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("file", sa.Column("size", sa.BigInteger()))
+    op.add_column("file", sa.Column("modifiedTime", sa.DateTime()))
+
+
+def downgrade():
+    op.drop_column("file", "modifiedTime")
+    op.drop_column("file", "size")
@@ -0,0 +1,81 @@
+"""monthly range partitioning of revision and change
+
+`revision` is partitioned on "modifiedTime" and `change` on "time". The partition
+key becomes part of the primary key, as Postgres requires. New months are created
+ahead of time by `db.partitions.ensure_partitions`, called every fetch cycle
+
+Revision ID: 730682e4b9ac
+Revises: f1c79da198b8
+Create Date: 2026-10-19 12:30:00.000000
+
+"""
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+from gdrive_insights.db.partitions import (MONTHS_AHEAD, PARTITIONED_TABLES,
+                                           create_default_partition_sql,
+                                           create_partition_sql, month_ranges,
+                                           month_start, next_month)
+
+
+# revision identifiers, used by Alembic.
+revision = '730682e4b9ac'
+down_revision = 'f1c79da198b8'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    "revision": [
+        ("ix_revision_file_id_modified", ["file_id", "modifiedTime"]),
+        ("ix_revision_updated", ["updated"]),
+    ],
+    "change": [
+        ("ix_change_file_id_time", ["file_id", "time"]),
+        ("ix_change_time", ["time"]),
+    ],
+}
+
+
+def _add_keys(table: str, pk_columns: str) -> None:
+    op.execute(f'ALTER TABLE "{table}" ADD PRIMARY KEY ({pk_columns})')
+    op.create_foreign_key(None, table, "file", ["file_id"], ["id"])
+    for name, columns in INDEXES[table]:
+        op.create_index(name, table, columns)
+
+
+def upgrade():
+    conn = op.get_bind()
+    op.execute('UPDATE change SET "time" = created WHERE "time" IS NULL')
+
+    for table, column in PARTITIONED_TABLES.items():
+        old = f"{table}_unpartitioned"
+        first = conn.execute(sa.text(f'SELECT min("{column}") FROM "{table}"')).scalar()
+        start: date = (first or datetime.utcnow()).date()
+        end = month_start(datetime.utcnow().date())
+        for _ in range(MONTHS_AHEAD):
+            end = next_month(end)
+
+        op.execute(f'ALTER TABLE "{table}" RENAME TO {old}')
+        op.execute(
+            f'CREATE TABLE "{table}" (LIKE {old} INCLUDING DEFAULTS) '
+            f'PARTITION BY RANGE ("{column}")'
+        )
+        op.execute(create_default_partition_sql(table))
+        for lower, upper in month_ranges(start, end):
+            op.execute(create_partition_sql(table, lower, upper))
+
+        op.execute(f'INSERT INTO "{table}" SELECT * FROM {old}')
+        op.execute(f"DROP TABLE {old}")
+        _add_keys(table, f'id, "{column}"')
+
+
+def downgrade():
+    for table in PARTITIONED_TABLES:
+        old = f"{table}_partitioned"
+        op.execute(f'ALTER TABLE "{table}" RENAME TO {old}')
+        op.execute(f'CREATE TABLE "{table}" (LIKE {old} INCLUDING DEFAULTS)')
+        op.execute(f'INSERT INTO "{table}" SELECT * FROM {old}')
+        op.execute(f"DROP TABLE {old} CASCADE")
+        _add_keys(table, "id")
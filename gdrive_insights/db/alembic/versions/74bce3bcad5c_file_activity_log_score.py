@@ -0,0 +1,51 @@
+"""file_activity.log_score replaces score
+
+The score grows by a factor 2 every half-life since SCORE_EPOCH and overflows
+float8 after about 1024 half-lives, its log2 does not. Existing scores are converted,
+files without a score get NULL
+
+Revision ID: 74bce3bcad5c
+Revises: 997f62709d47
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '74bce3bcad5c'
+down_revision = '997f62709d47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("file_activity", sa.Column("log_score", sa.Float()))
+    op.execute(
+        "UPDATE file_activity SET log_score = ln(score) / ln(2) WHERE score > 0;"
+    )
+    op.drop_index("ix_file_activity_score", table_name="file_activity")
+    op.drop_column("file_activity", "score")
+    op.create_index(
+        "ix_file_activity_log_score",
+        "file_activity",
+        [sa.text("log_score DESC NULLS LAST")],
+    )
+
+
+def downgrade():
+    op.add_column(
+        "file_activity",
+        sa.Column("score", sa.Float(), nullable=False, server_default="0"),
+    )
+    # scores past the float range cannot be converted back, run the backfill
+    op.execute(
+        "UPDATE file_activity SET score = power(2, greatest(log_score, -1000)) "
+        "WHERE log_score IS NOT NULL AND log_score < 1000;"
+    )
+    op.drop_index("ix_file_activity_log_score", table_name="file_activity")
+    op.drop_column("file_activity", "log_score")
+    op.create_index(
+        "ix_file_activity_score", "file_activity", [sa.text("score DESC")]
+    )
@@ -0,0 +1,42 @@
+"""natural key (file_id, time, changeType) for change
+
+Run `compact_changes.py` first on large tables, it removes the existing duplicates
+in batches. The delete below only catches what is left
+
+Revision ID: 90eedd15052a
+Revises: 730682e4b9ac
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '90eedd15052a'
+down_revision = '730682e4b9ac'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        """
+        DELETE FROM change USING (
+            SELECT id, "time" FROM (
+                SELECT id, "time", row_number() OVER (
+                    PARTITION BY file_id, "time", "changeType" ORDER BY created, id
+                ) AS rn
+                FROM change
+            ) ranked WHERE rn > 1
+        ) dup
+        WHERE change.id = dup.id AND change."time" = dup."time";
+        """
+    )
+    op.create_unique_constraint(
+        "uq_change_natural_key", "change", ["file_id", "time", "changeType"]
+    )
+
+
+def downgrade():
+    op.drop_constraint("uq_change_natural_key", "change", type_="unique")
@@ -0,0 +1,35 @@
+"""revision fetch priority and daily budget
+
+file gains revisions_fetched, fetch_budget keeps the revisions.list calls spent per
+day, both written by db/scheduler.py
+
+Revision ID: 997f62709d47
+Revises: d58da4f10a91
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '997f62709d47'
+down_revision = 'd58da4f10a91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("file", sa.Column("revisions_fetched", sa.DateTime()))
+
+    op.create_table(
+        "fetch_budget",
+        sa.Column("day", sa.Date(), primary_key=True),
+        sa.Column("spent", sa.Integer(), nullable=False),
+        sa.Column("updated", sa.DateTime(), server_default=sa.func.now()),
+    )
+
+
+def downgrade():
+    op.drop_table("fetch_budget")
+    op.drop_column("file", "revisions_fetched")
@@ -0,0 +1,31 @@
+"""revision_outbox table, files queued for fetching revisions
+
+Revision ID: be3a40457319
+Revises: dd26c5f37940
+Create Date: 2026-10-19 14:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'be3a40457319'
+down_revision = 'dd26c5f37940'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "revision_outbox",
+        sa.Column("file_id", sa.String(), sa.ForeignKey("file.id"), primary_key=True),
+        sa.Column("queued", sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        sa.Column("created", sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.create_index("ix_revision_outbox_queued", "revision_outbox", ["queued"])
+
+
+def downgrade():
+    op.drop_index("ix_revision_outbox_queued", table_name="revision_outbox")
+    op.drop_table("revision_outbox")
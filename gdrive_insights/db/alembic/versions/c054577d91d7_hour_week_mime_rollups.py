@@ -0,0 +1,35 @@
+"""mime_rollup, revisions per mime type per bucket. revision_rollup gains hour and week
+
+Buckets of existing revisions are computed by `ipy db/rollups.py -i -- --backfill`
+
+Revision ID: c054577d91d7
+Revises: d289223f7eb1
+Create Date: 2026-10-19 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c054577d91d7'
+down_revision = 'd289223f7eb1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "mime_rollup",
+        sa.Column("granularity", sa.String(), primary_key=True),
+        sa.Column("bucket", sa.DateTime(), primary_key=True),
+        sa.Column("mime_type", sa.String(), primary_key=True),
+        sa.Column("nrevision", sa.Integer(), nullable=False),
+        sa.Column("nfile", sa.Integer(), nullable=False),
+        sa.Column("updated", sa.DateTime(), server_default=sa.func.now()),
+    )
+
+
+def downgrade():
+    op.drop_table("mime_rollup")
+    op.execute("DELETE FROM revision_rollup WHERE granularity <> 'day';")
@@ -0,0 +1,33 @@
+"""file_session.is_candidate, started and ended, for sessions detected by sessionize.py
+
+Revision ID: d289223f7eb1
+Revises: 0bdaba662d6a
+Create Date: 2026-10-19 16:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd289223f7eb1'
+down_revision = '0bdaba662d6a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "file_session",
+        sa.Column(
+            "is_candidate", sa.Boolean(), nullable=False, server_default="false"
+        ),
+    )
+    op.add_column("file_session", sa.Column("started", sa.DateTime()))
+    op.add_column("file_session", sa.Column("ended", sa.DateTime()))
+
+
+def downgrade():
+    op.drop_column("file_session", "ended")
+    op.drop_column("file_session", "started")
+    op.drop_column("file_session", "is_candidate")
@@ -0,0 +1,35 @@
+"""fetch_failure, negative cache of failed Drive API calls per file
+
+Revision ID: d58da4f10a91
+Revises: 1c0289808b34
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd58da4f10a91'
+down_revision = '1c0289808b34'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "fetch_failure",
+        sa.Column("file_id", sa.String(), sa.ForeignKey("file.id"), primary_key=True),
+        sa.Column("error_class", sa.String(), nullable=False),
+        sa.Column("last_error", sa.String()),
+        sa.Column("nfailure", sa.Integer(), nullable=False),
+        sa.Column("next_retry", sa.DateTime(), nullable=False),
+        sa.Column("created", sa.DateTime(), server_default=sa.func.now()),
+        sa.Column("updated", sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.create_index("ix_fetch_failure_next_retry", "fetch_failure", ["next_retry"])
+
+
+def downgrade():
+    op.drop_index("ix_fetch_failure_next_retry", table_name="fetch_failure")
+    op.drop_table("fetch_failure")
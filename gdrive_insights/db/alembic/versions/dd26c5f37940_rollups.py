@@ -0,0 +1,69 @@
+"""file_activity and revision_rollup tables, and table_version counters
+
+Fill them afterwards with `python rollups.py --backfill`
+
+Revision ID: dd26c5f37940
+Revises: 4b98c660b4e5
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'dd26c5f37940'
+down_revision = '4b98c660b4e5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "file_activity",
+        sa.Column("file_id", sa.String(), sa.ForeignKey("file.id"), primary_key=True),
+        sa.Column("nrevision", sa.Integer(), nullable=False),
+        sa.Column("first_modified", sa.DateTime()),
+        sa.Column("last_modified", sa.DateTime()),
+        sa.Column("updated", sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.create_index(
+        "ix_file_activity_nrevision", "file_activity", [sa.text("nrevision DESC")]
+    )
+    op.create_index(
+        "ix_file_activity_last_modified",
+        "file_activity",
+        [sa.text("last_modified DESC")],
+    )
+    op.create_table(
+        "revision_rollup",
+        sa.Column("granularity", sa.String(), primary_key=True),
+        sa.Column("bucket", sa.DateTime(), primary_key=True),
+        sa.Column("file_id", sa.String(), sa.ForeignKey("file.id"), primary_key=True),
+        sa.Column("nrevision", sa.Integer(), nullable=False),
+        sa.Column("updated", sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.create_index(
+        "ix_revision_rollup_bucket", "revision_rollup", ["granularity", "bucket"]
+    )
+    op.create_index(
+        "ix_revision_rollup_file_id",
+        "revision_rollup",
+        ["file_id", "granularity", "bucket"],
+    )
+    op.create_table(
+        "table_version",
+        sa.Column("name", sa.String(), primary_key=True),
+        sa.Column("version", sa.BigInteger(), nullable=False),
+        sa.Column("updated", sa.DateTime(), server_default=sa.func.now()),
+    )
+
+
+def downgrade():
+    op.drop_table("table_version")
+    op.drop_index("ix_revision_rollup_file_id", table_name="revision_rollup")
+    op.drop_index("ix_revision_rollup_bucket", table_name="revision_rollup")
+    op.drop_table("revision_rollup")
+    op.drop_index("ix_file_activity_last_modified", table_name="file_activity")
+    op.drop_index("ix_file_activity_nrevision", table_name="file_activity")
+    op.drop_table("file_activity")
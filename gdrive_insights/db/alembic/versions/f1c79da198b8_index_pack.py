@@ -0,0 +1,92 @@
+"""index pack for revision, change, file and association tables
+
+Indexes match the filters used by `get_pdfs`, `files_from_sql`,
+`get_session_by_file_ids`, `get_page_tokens` and the materialized views.
+Built concurrently, so the ingestion daemon can keep running
+
+Revision ID: f1c79da198b8
+Revises:
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c79da198b8'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+NOT_FORBIDDEN = sa.text("NOT is_forbidden")
+PDF_NOT_FORBIDDEN = sa.text("\"mimeType\" = 'application/pdf' AND NOT is_forbidden")
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_revision_file_id_modified",
+            "revision",
+            ["file_id", "modifiedTime"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_revision_updated",
+            "revision",
+            ["updated"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_change_file_id_time",
+            "change",
+            ["file_id", "time"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_change_time",
+            "change",
+            ["time"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_file_mimetype",
+            "file",
+            ["mimeType"],
+            postgresql_where=NOT_FORBIDDEN,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_file_pdf",
+            "file",
+            ["id"],
+            postgresql_where=PDF_NOT_FORBIDDEN,
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_page_token_value_int",
+            "page_token",
+            [sa.text("CAST(value AS INTEGER) DESC")],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_file_session_association_file_id",
+            "file_session_association",
+            ["file_id"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table in (
+            ("ix_file_session_association_file_id", "file_session_association"),
+            ("ix_page_token_value_int", "page_token"),
+            ("ix_file_pdf", "file"),
+            ("ix_file_mimetype", "file"),
+            ("ix_change_time", "change"),
+            ("ix_change_file_id_time", "change"),
+            ("ix_revision_updated", "revision"),
+            ("ix_revision_file_id_modified", "revision"),
+        ):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,269 @@
+"""arrow_export.py, streams file, change and revision rows into Arrow IPC files.
+
+Rows are copied out of postgres with COPY ... TO STDOUT as CSV, and parsed by
+pyarrow's streaming CSV reader into record batches, with the schema taken from the
+models. No Python object is created per row, and memory stays at about one batch.
+The IPC file can be memory-mapped by `read_arrow`, without copying
+
+Usage:
+    # revisions of the last year, without the bookkeeping columns
+    python arrow_export.py revision --since 2025-10-01 --columns id file_id modifiedTime
+
+    table = read_arrow(ARROW_DIR / "revision.arrow")
+    df = table.to_pandas()
+"""
+import argparse
+import logging
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import pyarrow as pa  # type: ignore[import]
+import pyarrow.csv as pa_csv  # type: ignore[import]
+from gdrive_insights.db.models import Change, File, Revision
+from gdrive_insights.settings import ARROW_DIR, ARROW_SFX
+from sqlalchemy import BigInteger, Boolean, DateTime, Float, Integer
+
+logger = logging.getLogger(__name__)
+
+TMP_SFX = ".part"
+# bytes of CSV parsed per record batch
+BLOCK_SIZE = 16 * 2**20
+
+# table -> (model, time column used by since and until)
+EXPORT_TABLES = {
+    "file": (File, "modifiedTime"),
+    "change": (Change, "time"),
+    "revision": (Revision, "modifiedTime"),
+}
+
+
+def arrow_type(column) -> pa.DataType:
+    """Arrow type of a model column, strings for everything not listed."""
+    if isinstance(column.type, BigInteger):
+        return pa.int64()
+    if isinstance(column.type, Integer):
+        return pa.int32()
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, Boolean):
+        return pa.bool_()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us")
+
+    return pa.string()
+
+
+def export_schema(table: str, columns: Optional[Sequence[str]] = None) -> pa.Schema:
+    """Arrow schema of `columns` of a table, in the order given."""
+    model_columns = EXPORT_TABLES[table][0].__table__.columns
+    columns = list(columns or model_columns.keys())
+    if unknown := set(columns) - set(model_columns.keys()):
+        raise ValueError(f"{table} has no columns {sorted(unknown)}")
+
+    return pa.schema([(c, arrow_type(model_columns[c])) for c in columns])
+
+
+def export_query(
+    cur,
+    table: str,
+    schema: pa.Schema,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    file_ids: Optional[List[str]] = None,
+) -> str:
+    """COPY statement for a table. COPY takes no parameters, `cur` binds them."""
+    time_col = EXPORT_TABLES[table][1]
+    file_col = "id" if table == "file" else "file_id"
+    # column names are checked against the model by export_schema
+    select = ", ".join(f'"{name}"' for name in schema.names)
+    query = cur.mogrify(
+        f"""
+        SELECT {select} FROM "{table}"
+        WHERE (%(since)s IS NULL OR "{time_col}" >= %(since)s)
+            AND (%(until)s IS NULL OR "{time_col}" < %(until)s)
+            AND (CAST(%(file_ids)s AS varchar[]) IS NULL OR "{file_col}" = ANY(%(file_ids)s))
+        """,
+        {"since": since, "until": until, "file_ids": file_ids},
+    ).decode()
+
+    return f"COPY ({query}) TO STDOUT WITH (FORMAT csv)"
+
+
+def _copy_to_pipe(con, query: str, fd: int, errors: List[Exception]) -> None:
+    with os.fdopen(fd, "wb") as f:
+        try:
+            con.cursor().copy_expert(query, f)
+        except Exception as e:
+            errors.append(e)
+
+
+def export_table(
+    con,
+    table: str,
+    path: Path,
+    columns: Optional[Sequence[str]] = None,
+    stream=False,
+    **filters,
+) -> int:
+    """Stream rows of a table into an Arrow IPC file, return number of rows.
+
+    stream:     write the IPC stream format instead of the random access file format
+    filters:    since, until and file_ids, see `export_query`
+    """
+    schema = export_schema(table, columns)
+    query = export_query(con.cursor(), table, schema, **filters)
+    logger.debug(f"{query=}")
+
+    # COPY writes into one end of a pipe in a thread, pyarrow parses the other end
+    rfd, wfd = os.pipe()
+    errors: List[Exception] = []
+    copy_thread = threading.Thread(
+        target=_copy_to_pipe, args=(con, query, wfd, errors), daemon=True
+    )
+    copy_thread.start()
+
+    tmp = Path(str(path) + TMP_SFX)
+    source = os.fdopen(rfd, "rb")
+    try:
+        nrow = _write_batches(source, schema, tmp, stream)
+    except Exception:
+        tmp.unlink(missing_ok=True)
+        raise
+    finally:
+        # a copy still writing gets a broken pipe, instead of blocking forever
+        source.close()
+        copy_thread.join()
+
+    if errors:
+        tmp.unlink(missing_ok=True)
+        raise errors[0]
+
+    tmp.replace(path)
+    logger.info(f"exported {nrow:,} rows of {table} to {path}")
+
+    return nrow
+
+
+def _write_batches(source, schema: pa.Schema, tmp: Path, stream: bool) -> int:
+    reader = pa_csv.open_csv(
+        source,
+        read_options=pa_csv.ReadOptions(
+            column_names=schema.names, block_size=BLOCK_SIZE
+        ),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=schema,
+            true_values=["t"],
+            false_values=["f"],
+            # COPY writes NULL as an empty unquoted field and empty strings quoted,
+            # names like "NA" or "null" are strings
+            null_values=[""],
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False,
+        ),
+    )
+
+    new_writer = pa.ipc.new_stream if stream else pa.ipc.new_file
+    nrow = 0
+    with pa.OSFile(str(tmp), "wb") as sink, new_writer(sink, schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
+            nrow += batch.num_rows
+
+    return nrow
+
+
+def read_arrow(path: Path, columns: Optional[Sequence[str]] = None) -> pa.Table:
+    """Memory-map an exported IPC file, buffers are not copied."""
+    source = pa.memory_map(str(path), "r")
+    try:
+        table = pa.ipc.open_file(source).read_all()
+    except pa.ArrowInvalid:
+        # written with stream=True
+        source.seek(0)
+        table = pa.ipc.open_stream(source).read_all()
+
+    return table.select(list(columns)) if columns else table
+
+
+if __name__ == "__main__":
+    import psycopg2  # type: ignore[import]
+    from gdrive_insights import config as config_dir
+    from gdrive_insights.db.instrument import instrument_from_env
+    from rarc_utils.log import LOG_FMT, setup_logger
+    from rarc_utils.sqlalchemy_base import load_config
+
+    logger = setup_logger(
+        cmdLevel=logging.INFO,
+        saveFile=0,
+        savePandas=0,
+        jsonLogger=0,
+        color=1,
+        fmt=LOG_FMT,
+    )
+
+    parser = argparse.ArgumentParser(description="arrow_export.py cli parameters")
+    parser.add_argument(
+        "table",
+        nargs="*",
+        help=f"tables to export, of {list(EXPORT_TABLES)}, all by default",
+    )
+    parser.add_argument(
+        "--columns",
+        nargs="+",
+        default=None,
+        help="columns to export, all by default, needs a single table",
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.fromisoformat,
+        default=None,
+        help="only rows modified on or after this date",
+    )
+    parser.add_argument(
+        "--until",
+        type=datetime.fromisoformat,
+        default=None,
+        help="only rows modified before this date",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        default=False,
+        help="write the IPC stream format, e.g. to pipe into another process",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_dir",
+        type=Path,
+        default=ARROW_DIR,
+        help="directory to write <table>.arrow to",
+    )
+    args = parser.parse_args()
+    tables = args.table or list(EXPORT_TABLES)
+    assert set(tables) <= set(EXPORT_TABLES), f"unknown table in {tables}"
+    assert args.columns is None or len(tables) == 1, "--columns needs one table"
+
+    psql = load_config(db_name="gdrive", cfg_file="postgres.cfg", config_dir=config_dir)
+    con = psycopg2.connect(
+        database=psql.db,
+        user=psql.user,
+        password=psql.passwd,
+        host=psql.host,
+        port="5432",
+    )
+    instrument_from_env(con)
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    for table in tables:
+        export_table(
+            con,
+            table,
+            (args.output_dir / table).with_suffix(ARROW_SFX),
+            columns=args.columns,
+            stream=args.stream,
+            since=args.since,
+            until=args.until,
+        )
@@ -0,0 +1,268 @@
+"""async_helpers.py, async versions of helpers.py on the async engine.
+
+Every helper takes the async sessionmaker (`get_async_session(psql)`) as first
+argument and opens its own short session, so many can run at once on one event loop.
+The sync helpers in helpers.py stay available for the command line tools
+
+Usage:
+    async_session = get_async_session(psql)
+    df = await aget_pdfs(async_session, n=10)
+"""
+import logging
+import re
+from datetime import datetime
+from typing import List, Optional
+
+import pandas as pd
+from sqlalchemy import and_, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.future import select  # type: ignore[import]
+from sqlalchemy.orm import selectinload
+
+from ..settings import PDF_FILETYPE
+from .helpers import CHANGE_STREAM, cached_query
+from .models import (File, file_session_association, fileSession,
+                     pageCheckpoint, pageToken)
+from .notify import anotify
+from .rollups import CURRENT_SCORE, FILE_HISTORY, TOP_FILES, score_shift
+
+logger = logging.getLogger(__name__)
+
+PDFS = """
+    SELECT file.name AS file_name, file."mimeType" AS file_type,
+        fa.last_modified AS last_update, coalesce(fa.nrevision, 0) AS nrevision,
+        {} AS score, file.id AS file_id,
+        file.path AS file_path
+    FROM {{}}
+    WHERE file."mimeType" = :file_type AND NOT file.is_removed {{}}
+    ORDER BY fa.log_score DESC NULLS LAST
+    LIMIT :n;
+""".format(
+    CURRENT_SCORE.format(":shift")
+)
+PDFS_TOP = PDFS.format("file_activity AS fa JOIN file ON file.id = fa.file_id", "")
+PDFS_BY_FILE_IDS = PDFS.format(
+    "file LEFT JOIN file_activity AS fa ON fa.file_id = file.id",
+    "AND file.id = ANY(:file_ids)",
+)
+
+SESSION_BY_FILE_IDS = """
+    SELECT file_session_id FROM file_session_association
+    WHERE file_id = ANY(:file_ids)
+    GROUP BY file_session_id
+    HAVING count(*) = :nfile
+    ORDER BY file_session_id
+    LIMIT 1;
+"""
+
+UPDATE_FILE_PATHS = """
+    UPDATE file SET path = p.path, updated = now()
+    FROM unnest(CAST(:ids AS varchar[]), CAST(:paths AS varchar[])) AS p(id, path)
+    WHERE file.id = p.id AND file.path IS DISTINCT FROM p.path;
+"""
+
+# name contains the search text, escaped for LIKE
+SEARCH_FILES = r"""
+    SELECT file.name AS file_name, file."mimeType" AS file_type,
+        {} AS score, fa.last_modified,
+        file.id AS file_id, file.path AS file_path
+    FROM file
+    LEFT JOIN file_activity AS fa ON fa.file_id = file.id
+    WHERE NOT file.is_removed AND file.name ILIKE :pattern ESCAPE '\'
+    ORDER BY fa.log_score DESC NULLS LAST, file.name
+    LIMIT :n;
+""".format(
+    CURRENT_SCORE.format(":shift")
+)
+
+RECENT_SESSIONS = """
+    SELECT fs.id AS session_id, fs.name, fs.nused, fs.is_candidate, fs.started,
+        fs.ended, fs.updated,
+        array_remove(array_agg(fsa.file_id ORDER BY fsa.file_id), NULL) AS file_ids
+    FROM file_session AS fs
+    LEFT JOIN file_session_association AS fsa ON fsa.file_session_id = fs.id
+    GROUP BY fs.id
+    ORDER BY fs.updated DESC NULLS LAST
+    LIMIT :n;
+"""
+
+PAGE_TOKENS = """
+    SELECT id, "table", value::int AS val_int, created, updated
+    FROM page_token ORDER BY val_int DESC LIMIT :n;
+"""
+
+
+async def aread_sql(async_session, query: str, **params) -> pd.DataFrame:
+    """Run a query and return the rows as a dataframe, like `pd.read_sql`."""
+    async with async_session() as session:
+        res = await session.execute(text(query), params)
+        return pd.DataFrame(res.fetchall(), columns=list(res.keys()))
+
+
+@cached_query(tables=("file", "file_activity"))
+async def aget_pdfs(
+    async_session, file_ids: Optional[List[str]] = None, n=5
+) -> pd.DataFrame:
+    """Get pdf files with the highest decayed activity score."""
+    query = PDFS_TOP if file_ids is None else PDFS_BY_FILE_IDS
+    return await aread_sql(
+        async_session,
+        query,
+        shift=score_shift(),
+        file_type=PDF_FILETYPE,
+        file_ids=file_ids,
+        n=n,
+    )
+
+
+@cached_query(tables=("file_session",))
+async def aget_sessions(async_session, n=8) -> pd.DataFrame:
+    """Get fileSessions from db."""
+    return await aread_sql(async_session, "SELECT * FROM file_session LIMIT :n;", n=n)
+
+
+@cached_query(tables=("file_session_association",))
+async def aget_file_ids_of_session(async_session, fs_id: int) -> List[str]:
+    """Get file ids of a file_session."""
+    async with async_session() as session:
+        res = await session.execute(
+            select(file_session_association.c.file_id).where(
+                file_session_association.c.file_session_id == fs_id
+            )
+        )
+        return list(res.scalars().all())
+
+
+async def aget_session_by_file_ids(
+    async_session, file_ids: List[str]
+) -> Optional[fileSession]:
+    """Find the session that contains all `file_ids`, with its files loaded."""
+    async with async_session() as session:
+        res = await session.execute(
+            text(SESSION_BY_FILE_IDS),
+            {"file_ids": list(file_ids), "nfile": len(set(file_ids))},
+        )
+        fs_id: Optional[int] = res.scalar_one_or_none()
+        if fs_id is None:
+            return None
+
+        fs = (
+            await session.execute(
+                select(fileSession)
+                .options(selectinload(fileSession.files))
+                .where(fileSession.id == fs_id)
+            )
+        ).scalar_one_or_none()
+
+    if fs is not None:
+        logger.info(f"found a session match, {fs=}")
+
+    return fs
+
+
+async def aadd_file_to_session(async_session, fs_id: int, file_id: str) -> bool:
+    """Add file to session. Return whether it was added."""
+    async with async_session() as session, session.begin():
+        file: Optional[File] = (
+            await session.execute(select(File).where(File.id == file_id))
+        ).scalar_one_or_none()
+        if file is None:
+            logger.warning("file_id does not exist in database")
+            return False
+
+        if file.path is None:
+            logger.warning("file path is none, please add a file path first")
+            return False
+
+        res = await session.execute(
+            insert(file_session_association)
+            .values(file_session_id=fs_id, file_id=file_id)
+            .on_conflict_do_nothing()
+        )
+        if res.rowcount == 0:
+            logger.warning("file already in session")
+            return False
+
+        await anotify(session, ["file_session_association"])
+
+    return True
+
+
+async def aupdate_file_paths(async_session, df: pd.DataFrame) -> int:
+    """Update file paths in db for a dataframe of files, in one statement."""
+    assert "id" in df.columns
+    assert "path" in df.columns
+
+    async with async_session() as session, session.begin():
+        res = await session.execute(
+            text(UPDATE_FILE_PATHS),
+            {"ids": df["id"].tolist(), "paths": df["path"].tolist()},
+        )
+        nupdated: int = res.rowcount
+        if nupdated:
+            await anotify(session, ["file"])
+
+    logger.info(f"{nupdated=:,}")
+
+    return nupdated
+
+
+async def aget_top_files(
+    async_session, n=25, mime_type: Optional[str] = None
+) -> pd.DataFrame:
+    """Most active files by decayed score, optionally of one mime type."""
+    return await aread_sql(
+        async_session, TOP_FILES, n=n, mime_type=mime_type, shift=score_shift()
+    )
+
+
+async def asearch_files(async_session, search: str, n=25) -> pd.DataFrame:
+    """Files whose name contains `search`, most active first."""
+    pattern = "%{}%".format(re.sub(r"([\\%_])", r"\\\1", search))
+    return await aread_sql(
+        async_session, SEARCH_FILES, pattern=pattern, n=n, shift=score_shift()
+    )
+
+
+async def aget_recent_sessions(async_session, n=25) -> pd.DataFrame:
+    """Last updated fileSessions, with the ids of their files."""
+    return await aread_sql(async_session, RECENT_SESSIONS, n=n)
+
+
+async def aget_file_history(
+    async_session, file_id: str, since: datetime
+) -> pd.DataFrame:
+    """Number of revisions per day of one file."""
+    return await aread_sql(async_session, FILE_HISTORY, file_id=file_id, since=since)
+
+
+async def aget_checkpoint(async_session, stream: str = CHANGE_STREAM) -> Optional[int]:
+    """Get next page token to fetch for a changes stream, if checkpointed."""
+    async with async_session() as session:
+        res = await session.execute(
+            select(pageCheckpoint.token).where(pageCheckpoint.stream == stream)
+        )
+        return res.scalar_one_or_none()
+
+
+async def aget_page_tokens(async_session, n=2) -> pd.DataFrame:
+    """Get page_token from db."""
+    return await aread_sql(async_session, PAGE_TOKENS, n=n)
+
+
+async def aget_or_update_page_token(async_session, table: str, value: str) -> None:
+    """Get or update pageToken from db."""
+    assert value is not None
+    async with async_session() as session, session.begin():
+        pt = (
+            await session.execute(
+                select(pageToken).where(
+                    and_(pageToken.table == table, pageToken.value == value)
+                )
+            )
+        ).scalar_one_or_none()
+        if pt is None:
+            pt = pageToken(table=table, value=value)
+            session.add(pt)
+
+        pt.updated = datetime.utcnow()
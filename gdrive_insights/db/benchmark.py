@@ -0,0 +1,113 @@
+"""benchmark.py, time the most used database helpers.
+
+Run before and after a migration, and compare the two result files:
+    cd ~/repos/gdrive-insights/gdrive_insights/db
+    python benchmark.py --label before
+    alembic upgrade head
+    python benchmark.py --label after
+    python benchmark.py --compare before after
+"""
+import argparse
+import logging
+import statistics
+import time
+from typing import Callable, Dict, List
+
+import pandas as pd
+import psycopg2  # type: ignore[import]
+from gdrive_insights import config as config_dir
+from gdrive_insights.data_methods import data_methods as dm
+from gdrive_insights.db.helpers import (get_file_ids_of_session, get_pdfs,
+                                        get_session_by_file_ids, psession)
+from gdrive_insights.settings import DATA_DIR
+from rarc_utils.log import LOG_FMT, setup_logger
+from rarc_utils.sqlalchemy_base import load_config
+
+logger = setup_logger(
+    cmdLevel=logging.INFO, saveFile=0, savePandas=0, jsonLogger=0, color=1, fmt=LOG_FMT
+)
+
+psql = load_config(db_name="gdrive", cfg_file="postgres.cfg", config_dir=config_dir)
+
+con = psycopg2.connect(
+    database=psql.db, user=psql.user, password=psql.passwd, host=psql.host, port="5432"
+)
+
+parser = argparse.ArgumentParser(description="benchmark.py cli parameters")
+parser.add_argument("--label", type=str, default="run", help="name of this run")
+parser.add_argument("-r", "--repeat", type=int, default=10, help="repeats per query")
+parser.add_argument(
+    "--compare",
+    nargs=2,
+    metavar=("BEFORE", "AFTER"),
+    default=None,
+    help="compare the results of two labels",
+)
+
+
+def result_file(label: str):
+    return (DATA_DIR / f"benchmark_{label}").with_suffix(".csv")
+
+
+def most_used_session_file_ids() -> List[str]:
+    query = """
+    SELECT file_session_id FROM file_session_association
+    GROUP BY file_session_id ORDER BY count(*) DESC LIMIT 1;
+    """
+    fs_id = psession.execute(query).scalar()
+    if fs_id is None:
+        return []
+
+    return get_file_ids_of_session(fs_id)
+
+
+def time_it(func: Callable, repeat: int) -> Dict[str, float]:
+    """Return min and median duration in ms."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+
+    return {"min_ms": min(durations), "median_ms": statistics.median(durations)}
+
+
+def run(label: str, repeat: int) -> pd.DataFrame:
+    file_ids = most_used_session_file_ids()
+    cases: Dict[str, Callable] = {
+        "get_pdfs": lambda: get_pdfs(con, n=25),
+        "get_pdfs_of_session": lambda: get_pdfs(con, file_ids=file_ids or None),
+        "files_from_sql": lambda: dm.files_from_sql(),
+        "get_session_by_file_ids": lambda: get_session_by_file_ids(file_ids),
+    }
+    rows = []
+    for name, func in cases.items():
+        res = time_it(func, repeat)
+        logger.info(f"{name:<28} {res['min_ms']:>9.1f}ms {res['median_ms']:>9.1f}ms")
+        rows.append({"query": name, **res})
+
+    df = pd.DataFrame(rows).set_index("query")
+    df.to_csv(result_file(label))
+
+    return df
+
+
+def compare(before: str, after: str) -> pd.DataFrame:
+    df = pd.read_csv(result_file(before), index_col="query").join(
+        pd.read_csv(result_file(after), index_col="query"),
+        lsuffix=f"_{before}",
+        rsuffix=f"_{after}",
+    )
+    df["speedup"] = df[f"median_ms_{before}"] / df[f"median_ms_{after}"]
+    print(df.round(2).to_string())
+
+    return df
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(*args.compare)
+    else:
+        run(args.label, args.repeat)
@@ -0,0 +1,106 @@
+"""compact_changes.py, remove duplicate changes in batches.
+
+Before `uq_change_natural_key` existed, every replay of `fetch_changes` from an
+older page token inserted the same changes again. This one-off job keeps the
+first stored copy of each (file_id, time, changeType) and deletes the rest,
+one month (partition) and `--batch_size` rows at a time, committing per batch
+
+Usage:
+    cd ~/repos/gdrive-insights/gdrive_insights/db
+    python compact_changes.py --dryrun
+    python compact_changes.py --batch_size 10000
+    alembic upgrade head
+"""
+import argparse
+import logging
+from datetime import datetime
+
+import psycopg2  # type: ignore[import]
+from gdrive_insights import config as config_dir
+from gdrive_insights.db.partitions import month_ranges
+from rarc_utils.log import LOG_FMT, setup_logger
+from rarc_utils.sqlalchemy_base import load_config
+
+logger = setup_logger(
+    cmdLevel=logging.INFO, saveFile=0, savePandas=0, jsonLogger=0, color=1, fmt=LOG_FMT
+)
+
+psql = load_config(db_name="gdrive", cfg_file="postgres.cfg", config_dir=config_dir)
+
+DUPLICATES = """
+    SELECT id, "time" FROM (
+        SELECT id, "time", row_number() OVER (
+            PARTITION BY file_id, "time", "changeType" ORDER BY created, id
+        ) AS rn
+        FROM change WHERE "time" >= %(lower)s AND "time" < %(upper)s
+    ) ranked WHERE rn > 1
+"""
+
+COUNT_DUPLICATES = "SELECT count(*) FROM ({}) dup;".format(DUPLICATES)
+
+DELETE_DUPLICATES = """
+    DELETE FROM change USING ({} LIMIT %(limit)s) dup
+    WHERE change.id = dup.id AND change."time" = dup."time";
+""".format(
+    DUPLICATES
+)
+
+parser = argparse.ArgumentParser(description="compact_changes.py cli parameters")
+parser.add_argument(
+    "--batch_size", type=int, default=10_000, help="rows to delete per commit"
+)
+parser.add_argument(
+    "--dryrun", action="store_true", default=False, help="only count duplicates"
+)
+
+
+def compact_changes(con, batch_size=10_000, dryrun=False) -> int:
+    """Delete duplicate changes month by month, return number of rows (to be) deleted."""
+    with con.cursor() as cur:
+        cur.execute('SELECT min("time"), max("time") FROM change;')
+        first, last = cur.fetchone()
+
+    if first is None:
+        return 0
+
+    total = 0
+    for lower, upper in month_ranges(first.date(), last.date()):
+        params = {"lower": lower, "upper": upper, "limit": batch_size}
+        with con.cursor() as cur:
+            if dryrun:
+                cur.execute(COUNT_DUPLICATES, params)
+                ndup: int = cur.fetchone()[0]
+                total += ndup
+                logger.info(f"{lower:%Y-%m}: {ndup:,} duplicates")
+                continue
+
+            while True:
+                cur.execute(DELETE_DUPLICATES, params)
+                ndeleted: int = cur.rowcount
+                con.commit()
+                total += ndeleted
+                if ndeleted < batch_size:
+                    break
+
+        logger.info(f"{lower:%Y-%m}: {total=:,}")
+
+    return total
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    con = psycopg2.connect(
+        database=psql.db,
+        user=psql.user,
+        password=psql.passwd,
+        host=psql.host,
+        port="5432",
+    )
+
+    start = datetime.utcnow()
+    total = compact_changes(con, batch_size=args.batch_size, dryrun=args.dryrun)
+    elapsed = datetime.utcnow() - start
+    logger.info(
+        f"{'found' if args.dryrun else 'deleted'} {total:,} duplicates in {elapsed}"
+    )
@@ -0,0 +1,199 @@
+"""fetch_failures.py, negative cache of Drive API calls that failed per file.
+
+A failed fetch is recorded in `fetch_failure` with its error class, number of
+failures and the time it may be retried. Files are skipped until then, so runs stop
+spending quota on files that will fail again. The delay starts at the first delay of
+the error class and doubles with every failure, up to its maximum. Forbidden and
+missing files are also marked `file.is_forbidden`.
+
+Failures are collected while fetching, and written per batch in a few statements,
+instead of a SELECT and a commit per file. A successful fetch clears the failure
+
+Usage:
+    blocked = {f for f, waiting in get_failures(psession, file_ids).items() if waiting}
+    failures.append(FetchFailure.from_error(file_id, e))
+    record_failures(psession, failures, ok_ids)
+"""
+import logging
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Dict, Iterable, List
+
+from sqlalchemy import text
+
+from .notify import anotify, notify
+
+logger = logging.getLogger(__name__)
+
+FORBIDDEN = "forbidden"
+NOT_FOUND = "not_found"
+RATE_LIMITED = "rate_limited"
+SERVER = "server"
+OTHER = "other"
+
+# reasons Google Drive API gives for files we will never be able to read
+FORBIDDEN_REASONS = ("insufficientFilePermissions", "appNotAuthorizedToFile")
+RATE_LIMIT_REASONS = (
+    "rateLimitExceeded",
+    "userRateLimitExceeded",
+    "dailyLimitExceeded",
+    "quotaExceeded",
+)
+
+# error class -> (first delay, max delay), the delay doubles on every failure
+BACKOFF = {
+    FORBIDDEN: (timedelta(days=7), timedelta(days=180)),
+    NOT_FOUND: (timedelta(days=7), timedelta(days=180)),
+    RATE_LIMITED: (timedelta(minutes=5), timedelta(hours=1)),
+    SERVER: (timedelta(minutes=30), timedelta(days=1)),
+    OTHER: (timedelta(hours=1), timedelta(days=7)),
+}
+# also set file.is_forbidden
+PERMANENT = (FORBIDDEN, NOT_FOUND)
+
+GET_FAILURES = text(
+    """
+    SELECT file_id, next_retry > now() AS waiting
+    FROM fetch_failure
+    WHERE file_id = ANY(:file_ids);
+    """
+)
+
+UPSERT_FAILURES = text(
+    """
+    WITH f AS (
+        SELECT * FROM unnest(
+            CAST(:file_ids AS varchar[]),
+            CAST(:error_classes AS varchar[]),
+            CAST(:errors AS varchar[]),
+            CAST(:first_secs AS float8[]),
+            CAST(:max_secs AS float8[])
+        ) AS f(file_id, error_class, last_error, first_secs, max_secs)
+    ), prev AS (
+        SELECT file_id, nfailure FROM fetch_failure WHERE file_id = ANY(:file_ids)
+    )
+    INSERT INTO fetch_failure (file_id, error_class, last_error, nfailure, next_retry)
+    SELECT f.file_id, f.error_class, f.last_error, coalesce(prev.nfailure, 0) + 1,
+        now() + make_interval(secs => least(
+            f.max_secs, f.first_secs * power(2, coalesce(prev.nfailure, 0))
+        ))
+    FROM f LEFT JOIN prev USING (file_id)
+    ON CONFLICT (file_id) DO UPDATE SET
+        error_class = excluded.error_class,
+        last_error = excluded.last_error,
+        nfailure = excluded.nfailure,
+        next_retry = excluded.next_retry,
+        updated = now();
+    """
+)
+
+SET_FORBIDDEN = text(
+    """
+    UPDATE file SET is_forbidden = true, updated = now()
+    WHERE id = ANY(:file_ids) AND NOT is_forbidden;
+    """
+)
+
+CLEAR_FAILURES = text("DELETE FROM fetch_failure WHERE file_id = ANY(:file_ids);")
+
+
+def classify(error: Exception) -> str:
+    """Error class of an exception raised by a Drive API call."""
+    status = getattr(getattr(error, "resp", None), "status", None)
+    status = int(status) if str(status).isdigit() else None
+    msg = str(error)
+    if status == 404 or "notFound" in msg:
+        return NOT_FOUND
+    if status == 429 or any(reason in msg for reason in RATE_LIMIT_REASONS):
+        return RATE_LIMITED
+    if any(reason in msg for reason in FORBIDDEN_REASONS):
+        return FORBIDDEN
+    if status is not None and status >= 500:
+        return SERVER
+
+    return OTHER
+
+
+def retry_delay(error_class: str, nfailure: int) -> timedelta:
+    """Delay before the retry after the `nfailure`th failure, as in UPSERT_FAILURES."""
+    first, max_ = BACKOFF[error_class]
+    return min(max_, first * 2 ** (nfailure - 1))
+
+
+@dataclass
+class FetchFailure:
+    """A failed fetch of one file, recorded by `record_failures`."""
+
+    file_id: str
+    error_class: str
+    error: str
+
+    @classmethod
+    def from_error(cls, file_id: str, error: Exception) -> "FetchFailure":
+        return cls(file_id, classify(error), repr(error)[:1000])
+
+    @property
+    def is_permanent(self) -> bool:
+        return self.error_class in PERMANENT
+
+
+def _params(failures: Iterable[FetchFailure]) -> dict:
+    # one row per file, a file listed twice in a statement cannot be upserted
+    last = list({f.file_id: f for f in failures}.values())
+    backoff = [BACKOFF[f.error_class] for f in last]
+    return {
+        "file_ids": [f.file_id for f in last],
+        "error_classes": [f.error_class for f in last],
+        "errors": [f.error for f in last],
+        "first_secs": [first.total_seconds() for first, _ in backoff],
+        "max_secs": [max_.total_seconds() for _, max_ in backoff],
+    }
+
+
+def _forbidden_ids(failures: Iterable[FetchFailure]) -> List[str]:
+    return sorted({f.file_id for f in failures if f.is_permanent})
+
+
+def get_failures(session, file_ids: Iterable[str]) -> Dict[str, bool]:
+    """Get file id -> still waiting for its retry time, of files that failed before."""
+    res = session.execute(GET_FAILURES, {"file_ids": list(file_ids)})
+    return {file_id: waiting for file_id, waiting in res.fetchall()}
+
+
+def record_failures(
+    session, failures: List[FetchFailure], ok_ids: Iterable[str] = ()
+) -> None:
+    """Write a batch of failures, and clear the ones of `ok_ids`, in one commit."""
+    ok_ids = list(ok_ids)
+    if not failures and not ok_ids:
+        return
+
+    if failures:
+        session.execute(UPSERT_FAILURES, _params(failures))
+    if forbidden_ids := _forbidden_ids(failures):
+        session.execute(SET_FORBIDDEN, {"file_ids": forbidden_ids})
+        notify(session, ["file"])
+    if ok_ids:
+        session.execute(CLEAR_FAILURES, {"file_ids": ok_ids})
+    session.commit()
+
+    logger.info(f"{len(failures):,} failures, {len(forbidden_ids):,} forbidden")
+
+
+async def aget_failures(session, file_ids: Iterable[str]) -> Dict[str, bool]:
+    res = await session.execute(GET_FAILURES, {"file_ids": list(file_ids)})
+    return {file_id: waiting for file_id, waiting in res.fetchall()}
+
+
+async def arecord_failures(
+    session, failures: List[FetchFailure], ok_ids: Iterable[str] = ()
+) -> None:
+    """Write a batch of failures, inside the caller's transaction."""
+    ok_ids = list(ok_ids)
+    if failures:
+        await session.execute(UPSERT_FAILURES, _params(failures))
+    if forbidden_ids := _forbidden_ids(failures):
+        await session.execute(SET_FORBIDDEN, {"file_ids": forbidden_ids})
+        await anotify(session, ["file"])
+    if ok_ids:
+        await session.execute(CLEAR_FAILURES, {"file_ids": ok_ids})
@@ -1,9 +1,12 @@
 """helpers.py, helper methods for SQLAlchemy models, listed in models.py."""
 
+import functools
+import inspect
 import logging
 import sys
 from datetime import datetime
 from multiprocessing import Pool
+from pathlib import Path
 from subprocess import Popen
 from typing import Any, Dict, List, Optional, Tuple
 
@@ -16,18 +19,63 @@ from sqlalchemy import and_
 from sqlalchemy.future import select  # type: ignore[import]
 from tqdm import tqdm  # type: ignore[import]
 
+from ..core.cache import cached
+from ..core.metrics import api_call
+from ..core.pdf_cache import PdfCache
 from ..core.utils import create_gdrive, is_not_none
-from .models import File, fileSession, pageToken
+from ..settings import PDF_FILETYPE
+from .instrument import instrument_from_env
+from .models import File, fileSession, pageCheckpoint, pageToken
+from .notify import notify, start_listener
+from .rollups import CURRENT_SCORE, score_shift
 
 psql = load_config(db_name="gdrive", cfg_file="postgres.cfg", config_dir=config_dir)
 psession = get_session(psql)()
+instrument_from_env(psession)
 
 logger = logging.getLogger(__name__)
 
+CHANGE_STREAM = "change"
+
+# upper bound on staleness when notifications are missed
+QUERY_TTL = 600
+
+PDF_CACHE = PdfCache()
+
 # use tqdm with df.progress_map()
 tqdm.pandas()
 
 
+def cached_query(tables: Tuple[str, ...], ttl=QUERY_TTL):
+    """Cache a read of `tables` per arguments, connections are not part of the key.
+
+    Entries are dropped as soon as a push notifies one of `tables`
+    """
+
+    def decorator(func):
+        cached_func = cached(
+            tables=tables, ttl=ttl, ignore=("con", "async_session"), copy=True
+        )(func)
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def awrapper(*args, **kwargs):
+                start_listener(psql)
+                return await cached_func(*args, **kwargs)
+
+            return awrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start_listener(psql)
+            return cached_func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
 async def create_many_items(asession, *args, **kwargs):
     """Create many SQLAlchemy model items in db."""
     async with asession() as session:
@@ -45,6 +93,7 @@ def update_is_forbidden(file_id: str) -> None:
     file = psession.query(File).filter(File.id == file_id).one_or_none()
     assert file is not None, "create file first"
     file.is_forbidden = True
+    notify(psession, ["file"])
     psession.commit()
 
 
@@ -65,8 +114,10 @@ def construct_file_path(
     if drive is None:
         drive = create_gdrive()
 
-    parent = drive.files().get(fileId=fileId, fields="parents").execute()
-    name = drive.files().get(fileId=fileId, fields="name").execute().get("name", None)
+    parent = api_call("files.get", drive.files().get(fileId=fileId, fields="parents"))
+    name = api_call(
+        "files.get", drive.files().get(fileId=fileId, fields="name")
+    ).get("name", None)
     parent_id: Optional[str] = parent.get("parents", None)
     parent_id = parent_id[0] if parent_id is not None else None
 
@@ -168,6 +219,7 @@ def update_file_paths(df: pd.DataFrame) -> pd.DataFrame:
     nupdated: int = len(file_and_path)
     logger.info(f"{nupdated=:,}")
 
+    notify(psession, ["file"])
     psession.commit()
 
     return df
@@ -206,6 +258,16 @@ def get_or_update_page_token(table: str, value: str) -> None:
     psession.commit()
 
 
+def get_checkpoint(stream: str = CHANGE_STREAM) -> Optional[int]:
+    """Get next page token to fetch for a changes stream, if checkpointed."""
+    token: Optional[int] = psession.execute(
+        select(pageCheckpoint.token).where(pageCheckpoint.stream == stream)
+    ).scalar_one_or_none()
+
+    return token
+
+
+@cached_query(tables=("file_session",))
 def get_sessions(con, n=8) -> pd.DataFrame:
     """Get fileSessions from db."""
     query = """
@@ -278,24 +340,37 @@ def get_session_by_file_ids(file_ids: List[str]) -> Optional[fileSession]:
     return fs
 
 
+PDFS = """
+    SELECT file.name AS file_name, file."mimeType" AS file_type,
+        fa.last_modified AS last_update, coalesce(fa.nrevision, 0) AS nrevision,
+        {} AS score, file.id AS file_id,
+        file.path AS file_path
+    FROM {{}}
+    WHERE file."mimeType" = %(file_type)s AND NOT file.is_removed {{}}
+    ORDER BY fa.log_score DESC NULLS LAST
+    LIMIT %(n)s;
+""".format(
+    CURRENT_SCORE.format("%(shift)s")
+)
+# top-K walks the score index of file_activity, files of a session may lack activity
+PDFS_TOP = PDFS.format("file_activity AS fa JOIN file ON file.id = fa.file_id", "")
+PDFS_BY_FILE_IDS = PDFS.format(
+    "file LEFT JOIN file_activity AS fa ON fa.file_id = file.id",
+    "AND file.id = ANY(%(file_ids)s)",
+)
+
+
+@cached_query(tables=("file", "file_activity"))
 def get_pdfs(con, file_ids: Optional[List[str]] = None, n=5) -> pd.DataFrame:
-    """Open frequently opened pdf files."""
-    con.cursor().execute("REFRESH MATERIALIZED VIEW revisions_by_file;")
-    query = """
-    SELECT * from revisions_by_file where file_type = 'application/pdf'
-    """
-    if file_ids is not None:
-        fmt_ids: str = "'{0}'".format("', '".join(file_ids))
-        query += """ AND file_id IN ({}) """.format(fmt_ids)
-
-    query += """LIMIT {}""".format(n)
-    logger.debug(f"{query=}")
-
-    df: pd.DataFrame = pd.read_sql(query, con)
+    """Get pdf files with the highest decayed activity score."""
+    query = PDFS_TOP if file_ids is None else PDFS_BY_FILE_IDS
+    params = dict(shift=score_shift(), file_type=PDF_FILETYPE, file_ids=file_ids, n=n)
+    df: pd.DataFrame = pd.read_sql(query, con, params=params)
 
     return df
 
 
+@cached_query(tables=("file_session_association",))
 def get_file_ids_of_session(fs_id: int) -> List[str]:
     """Get pdfs by file_session."""
     query = """SELECT file_id FROM file_session_association WHERE file_session_id = {};""".format(
@@ -310,7 +385,7 @@ def get_pdfs_manual(con, n=30) -> pd.DataFrame:
     """Get pdfs by manually selecting which items to keep."""
     df = get_pdfs(con, n=n)
 
-    view = df[["file_name", "last_update", "nrevision", "file_id"]].copy()
+    view = df[["file_name", "last_update", "nrevision", "score", "file_id"]].copy()
     input_ = input(
         f"{view.to_string()}\n\nselect indices of rows to keep, separated by spaces: "
     )
@@ -346,6 +421,7 @@ def add_file_to_session(fs: fileSession, file_id: str) -> None:
 
     # add file to session
     fs.files.append(file)
+    notify(psession, ["file_session_association"])
 
     psession.commit()
 
@@ -371,6 +447,8 @@ def open_pdfs(df: pd.DataFrame, fs=None, pfx=None, ctxmgr=False) -> None:
 
     Manually through command line is also available:
         gsettings set org.mate.Atril.Default continuous false
+
+    Local copies in the pdf cache are opened instead of the mount, see prefetch.py
     """
     assert pfx is not None
     df["file_path"] = pfx + df["file_path"]
@@ -379,7 +457,12 @@ def open_pdfs(df: pd.DataFrame, fs=None, pfx=None, ctxmgr=False) -> None:
     # base_command = "atril"
     base_command = "evince"
 
-    paths = df["file_path"].to_list()
+    paths = [
+        str(PDF_CACHE.resolve(file_id, Path(path)))
+        for file_id, path in zip(df["file_id"], df["file_path"])
+    ]
+    ncached = sum(not p.startswith(pfx) for p in paths)
+    logger.info(f"opening {ncached}/{len(paths)} files from the pdf cache")
     # print(f"{paths[:2]=}")
 
     # fetch file metadata
@@ -394,9 +477,12 @@ def open_pdfs(df: pd.DataFrame, fs=None, pfx=None, ctxmgr=False) -> None:
         logger.info(f"creating new fileSession")
         fs = fileSession(files=df.file.to_list())
         psession.add(fs)
+        notify(psession, ["file_session_association"])
         psession.commit()
 
     fs.nused += 1
+    fs.is_candidate = False
+    notify(psession, ["file_session"])
     psession.commit()
     psession.close()
 
@@ -0,0 +1,236 @@
+"""instrument.py, opt-in timing of SQL statements.
+
+Records fingerprint, duration, rows and call site of every statement that passes
+through an instrumented SQLAlchemy engine or psycopg2 connection, and logs the
+slowest statements at exit
+
+Enable with environment variables:
+    GDRIVE_INSIGHTS_SQL_TIMING=1        time all statements
+    GDRIVE_INSIGHTS_SLOW_QUERY_MS=200   log statements slower than this
+    GDRIVE_INSIGHTS_EXPLAIN_MS=1000     log EXPLAIN of SELECTs slower than this
+
+Or from code:
+    instrument(psession)
+    instrument_connection(con)
+"""
+import atexit
+import logging
+import os
+import re
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+import psycopg2.extensions  # type: ignore[import]
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+SQL_TIMING = os.environ.get("GDRIVE_INSIGHTS_SQL_TIMING", "0") not in ("", "0")
+SLOW_QUERY_MS = float(os.environ.get("GDRIVE_INSIGHTS_SLOW_QUERY_MS", 200))
+EXPLAIN_MS = os.environ.get("GDRIVE_INSIGHTS_EXPLAIN_MS", None)
+
+_PKG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_PARAM = re.compile(r"%\(\w+\)s|%s|(?<!:):(?!:)\w+|\$\d+")
+_RE_LIST = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+_RE_SPACE = re.compile(r"\s+")
+
+
+@dataclass
+class StatementStats:
+    """Aggregated timings of one statement fingerprint."""
+
+    fingerprint: str
+    call_site: str
+    ncall: int = 0
+    nrow: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.ncall if self.ncall else 0.0
+
+
+_stats: Dict[str, StatementStats] = {}
+_explained: set = set()
+_instrumented_engines: set = set()
+
+
+def fingerprint(statement: str) -> str:
+    """Replace literals by `?` so that the same query with other values groups together."""
+    fp = _RE_STRING.sub("?", statement)
+    fp = _RE_PARAM.sub("?", fp)
+    fp = _RE_NUMBER.sub("?", fp)
+    fp = _RE_LIST.sub("(...)", fp)
+    return _RE_SPACE.sub(" ", fp).strip()
+
+
+def _call_site() -> str:
+    """Return first frame inside this package, outside this module."""
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if frame.filename.startswith(_PKG_DIR) and frame.filename != __file__:
+            relpath = os.path.relpath(frame.filename, _PKG_DIR)
+            return f"{relpath}:{frame.lineno}:{frame.name}"
+
+    return "?"
+
+
+def record(statement: str, duration_ms: float, rows: int, explain=None) -> None:
+    """Record one statement execution.
+
+    explain:    optional callable returning the query plan, used when the
+                statement is slower than GDRIVE_INSIGHTS_EXPLAIN_MS
+    """
+    fp = fingerprint(statement)
+    stats = _stats.get(fp)
+    if stats is None:
+        stats = _stats[fp] = StatementStats(fingerprint=fp, call_site=_call_site())
+
+    stats.ncall += 1
+    stats.nrow += max(rows, 0)
+    stats.total_ms += duration_ms
+    stats.max_ms = max(stats.max_ms, duration_ms)
+
+    if duration_ms >= SLOW_QUERY_MS:
+        logger.warning(
+            f"slow query {duration_ms:.1f}ms {rows=} at {stats.call_site}: {fp[:200]}"
+        )
+
+    if (
+        explain is not None
+        and EXPLAIN_MS is not None
+        and duration_ms >= float(EXPLAIN_MS)
+        and fp not in _explained
+        and statement.lstrip().upper().startswith(("SELECT", "WITH"))
+    ):
+        _explained.add(fp)
+        try:
+            plan = explain()
+            logger.warning(f"EXPLAIN {fp[:200]}\n{plan}")
+        except Exception as e:
+            logger.debug(f"cannot explain statement: {e}")
+
+
+def slowest(n=10) -> List[StatementStats]:
+    """Return statements sorted by total time spent."""
+    return sorted(_stats.values(), key=lambda s: s.total_ms, reverse=True)[:n]
+
+
+def report(n=10) -> None:
+    """Log the slowest statements of this run."""
+    if not _stats:
+        return
+
+    lines = [
+        f"{s.total_ms:>10.1f}ms {s.ncall:>6,} calls {s.mean_ms:>8.1f}ms/call "
+        f"{s.nrow:>8,} rows  {s.call_site:<40} {s.fingerprint[:120]}"
+        for s in slowest(n)
+    ]
+    logger.info("slowest statements:\n" + "\n".join(lines))
+
+
+def _explain_with(dbapi_con, statement: str, parameters: Any):
+    def explain() -> str:
+        cur = dbapi_con.cursor()
+        try:
+            cur.execute("EXPLAIN " + statement, parameters)
+            return "\n".join(row[0] for row in cur.fetchall())
+        finally:
+            cur.close()
+
+    return explain
+
+
+def instrument_engine(engine) -> None:
+    """Time all statements of a (sync or async) SQLAlchemy engine."""
+    engine = getattr(engine, "sync_engine", engine)
+    if id(engine) in _instrumented_engines:
+        return
+    _instrumented_engines.add(id(engine))
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        duration_ms = (time.perf_counter() - start) * 1000
+        explain = None
+        if not executemany:
+            explain = _explain_with(conn.connection, statement, parameters)
+        record(statement, duration_ms, cursor.rowcount, explain=explain)
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """psycopg2 cursor that records every execute."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            statement = query.decode() if isinstance(query, bytes) else str(query)
+            duration_ms = (time.perf_counter() - start) * 1000
+            record(
+                statement,
+                duration_ms,
+                self.rowcount,
+                explain=_explain_with(
+                    _PlainConnection(self.connection), statement, vars
+                ),
+            )
+
+
+class _PlainConnection:
+    """Make EXPLAIN use a plain cursor, so it is not recorded itself."""
+
+    def __init__(self, con):
+        self.con = con
+
+    def cursor(self):
+        return self.con.cursor(cursor_factory=psycopg2.extensions.cursor)
+
+
+def instrument_connection(con) -> None:
+    """Time all statements executed on cursors of a psycopg2 connection."""
+    con.cursor_factory = TimedCursor
+
+
+def instrument(obj) -> None:
+    """Instrument a Session, sessionmaker, engine or psycopg2 connection."""
+    if isinstance(obj, psycopg2.extensions.connection):
+        instrument_connection(obj)
+        return
+
+    if hasattr(obj, "get_bind"):
+        engine = obj.get_bind()
+    elif hasattr(obj, "kw"):
+        engine = obj.kw["bind"]
+    else:
+        engine = obj
+
+    instrument_engine(engine)
+
+
+def instrument_from_env(*objs) -> bool:
+    """Instrument objects when GDRIVE_INSIGHTS_SQL_TIMING is set."""
+    if not SQL_TIMING:
+        return False
+
+    for obj in objs:
+        instrument(obj)
+
+    return True
+
+
+@atexit.register
+def _report_at_exit() -> None:
+    report()
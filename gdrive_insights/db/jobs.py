@@ -0,0 +1,308 @@
+"""jobs.py, Postgres backed work queue for revision and path workers.
+
+One row per (kind, file_id). Workers on any machine claim batches with
+`FOR UPDATE SKIP LOCKED` and hold a lease on them: a job whose worker died is
+claimed again once its lease expires. Failed jobs are retried with exponential
+backoff, and dead-lettered (status 'dead') after `max_attempts`, or right away
+when the file is forbidden. Dead jobs stay in the table for inspection and are
+not queued again
+
+A job queued again while it runs is not removed by `acomplete`, but runs once more.
+Path jobs are claimed in queue order, revision jobs in the order of scheduler.py,
+by file id
+"""
+import logging
+import os
+import socket
+from datetime import datetime
+from typing import Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import text
+
+from ..settings import GOOGLE_DOCUMENT_FILETYPE, PDF_FILETYPE
+from .notify import anotify
+
+logger = logging.getLogger(__name__)
+
+JOB_TABLE = "job"
+
+REVISIONS = "revisions"
+PATH = "path"
+JOB_KINDS = (REVISIONS, PATH)
+
+QUEUED = "queued"
+RUNNING = "running"
+DEAD = "dead"
+
+REVISION_MIME_TYPES = [PDF_FILETYPE, GOOGLE_DOCUMENT_FILETYPE]
+PATH_MIME_TYPES = [PDF_FILETYPE]
+
+LEASE_SECONDS = 600
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 60
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+ENQUEUE = text(
+    """
+    INSERT INTO job (kind, file_id)
+    SELECT :kind, id FROM file
+    WHERE id = ANY(:file_ids)
+        AND "mimeType" = ANY(:mime_types)
+        AND is_forbidden IS NOT TRUE AND NOT is_removed
+        AND NOT EXISTS (
+            SELECT 1 FROM fetch_failure AS ff
+            WHERE ff.file_id = file.id AND ff.next_retry > now()
+        )
+        AND (NOT :missing_path OR path IS NULL)
+    ON CONFLICT (kind, file_id) DO UPDATE SET queued = now(), updated = now()
+    WHERE job.status <> 'dead'
+    RETURNING file_id;
+    """
+)
+
+RUNNABLE = """
+    run_after <= now()
+    AND (status = 'queued' OR (status = 'running' AND lease_until < now()))
+"""
+
+CLAIM = text(
+    """
+    UPDATE job
+    SET status = 'running',
+        attempts = attempts + 1,
+        worker = :worker,
+        lease_until = now() + make_interval(secs => :lease),
+        updated = now()
+    WHERE id IN (
+        SELECT id FROM job
+        WHERE kind = :kind AND {}
+            AND (CAST(:file_ids AS varchar[]) IS NULL OR file_id = ANY(:file_ids))
+        ORDER BY queued
+        LIMIT :n
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, file_id, queued, attempts;
+    """.format(
+        RUNNABLE
+    )
+)
+
+RUNNABLE_FILE_IDS = text(
+    "SELECT file_id FROM job WHERE kind = :kind AND {};".format(RUNNABLE)
+)
+
+# only the worker holding the lease may complete or fail a job
+COMPLETE = text(
+    """
+    DELETE FROM job AS j
+    USING unnest(CAST(:ids AS bigint[]), CAST(:queued AS timestamp[])) AS a(id, queued)
+    WHERE j.id = a.id AND j.queued = a.queued
+        AND j.worker = :worker AND j.status = 'running'
+    RETURNING j.id;
+    """
+)
+
+REQUEUE = text(
+    """
+    UPDATE job
+    SET status = 'queued', lease_until = NULL, updated = now()
+    WHERE id = ANY(:ids) AND worker = :worker AND status = 'running';
+    """
+)
+
+FAIL = text(
+    """
+    UPDATE job
+    SET status = CASE WHEN :dead OR attempts >= :max_attempts
+            THEN 'dead' ELSE 'queued' END,
+        run_after = now() + make_interval(
+            secs => :backoff * power(2, greatest(attempts - 1, 0))
+        ),
+        lease_until = NULL,
+        last_error = :error,
+        updated = now()
+    WHERE id = :id AND worker = :worker AND status = 'running'
+    RETURNING status;
+    """
+)
+
+# psycopg2 style, for sync callers
+CANCEL_JOBS = """
+    DELETE FROM job
+    WHERE kind = %(kind)s AND status = 'queued' AND file_id = ANY(%(file_ids)s);
+"""
+ACANCEL_JOBS = text(
+    """
+    DELETE FROM job
+    WHERE kind = :kind AND status = 'queued' AND file_id = ANY(:file_ids);
+    """
+)
+
+COUNT_JOBS = text(
+    """
+    SELECT kind, status, count(*) AS njob FROM job GROUP BY kind, status ORDER BY 1, 2;
+    """
+)
+
+
+class ClaimedJob(NamedTuple):
+    id: int
+    file_id: str
+    queued: datetime
+    attempts: int
+
+
+async def aenqueue_jobs(
+    session,
+    kind: str,
+    file_ids: Iterable[str],
+    mime_types: List[str],
+    missing_path=False,
+) -> int:
+    """Queue jobs of `kind` for matching files, inside the caller's transaction.
+
+    missing_path:   only queue files without a path
+    """
+    assert kind in JOB_KINDS, f"unknown {kind=}"
+    file_ids = sorted(set(file_ids))
+    if not file_ids:
+        return 0
+
+    res = await session.execute(
+        ENQUEUE,
+        {
+            "kind": kind,
+            "file_ids": file_ids,
+            "mime_types": mime_types,
+            "missing_path": missing_path,
+        },
+    )
+    nqueued = len(res.fetchall())
+    if nqueued:
+        await anotify(session, [JOB_TABLE])
+    logger.debug(f"queued {nqueued:,} of {len(file_ids):,} files for {kind=}")
+
+    return nqueued
+
+
+async def aenqueue_changed_files(session, file_ids: Iterable[str]) -> int:
+    """Queue revision and path jobs for changed files."""
+    file_ids = list(file_ids)
+    nqueued = await aenqueue_jobs(session, REVISIONS, file_ids, REVISION_MIME_TYPES)
+    nqueued += await aenqueue_jobs(
+        session, PATH, file_ids, PATH_MIME_TYPES, missing_path=True
+    )
+
+    return nqueued
+
+
+async def arunnable_file_ids(session, kind: str) -> List[str]:
+    """File ids of jobs of `kind` that can be claimed now."""
+    res = await session.execute(RUNNABLE_FILE_IDS, {"kind": kind})
+    return list(res.scalars().all())
+
+
+async def aclaim(
+    async_session,
+    kind: str,
+    n: int,
+    lease=LEASE_SECONDS,
+    worker=WORKER_ID,
+    file_ids: Optional[List[str]] = None,
+) -> List[ClaimedJob]:
+    """Claim up to `n` jobs of `kind`, skipping jobs claimed by other workers.
+
+    file_ids:   only claim jobs of these files
+    """
+    async with async_session() as session, session.begin():
+        res = await session.execute(
+            CLAIM,
+            {
+                "kind": kind,
+                "n": n,
+                "lease": lease,
+                "worker": worker,
+                "file_ids": file_ids,
+            },
+        )
+        jobs = [ClaimedJob(*row) for row in res.fetchall()]
+
+    return jobs
+
+
+async def acomplete(async_session, jobs: List[ClaimedJob], worker=WORKER_ID) -> int:
+    """Remove finished jobs. Jobs queued again while running are queued once more."""
+    if not jobs:
+        return 0
+
+    ids = [job.id for job in jobs]
+    async with async_session() as session, session.begin():
+        res = await session.execute(
+            COMPLETE,
+            {"ids": ids, "queued": [job.queued for job in jobs], "worker": worker},
+        )
+        done = set(res.scalars().all())
+        requeue = [i for i in ids if i not in done]
+        if requeue:
+            await session.execute(REQUEUE, {"ids": requeue, "worker": worker})
+
+    return len(done)
+
+
+async def afail(
+    async_session,
+    job: ClaimedJob,
+    error: str,
+    dead=False,
+    max_attempts=MAX_ATTEMPTS,
+    backoff=BACKOFF_SECONDS,
+    worker=WORKER_ID,
+) -> Optional[str]:
+    """Retry a failed job later, or dead-letter it. Return its new status."""
+    async with async_session() as session, session.begin():
+        res = await session.execute(
+            FAIL,
+            {
+                "id": job.id,
+                "dead": dead,
+                "max_attempts": max_attempts,
+                "backoff": backoff,
+                "error": error[:1000],
+                "worker": worker,
+            },
+        )
+        status = res.scalar_one_or_none()
+
+    if status == DEAD:
+        logger.warning(f"dead-lettered {job=}: {error}")
+
+    return status
+
+
+def cancel_jobs(con, kind: str, file_ids: List[str]) -> int:
+    """Drop queued jobs that became unnecessary, e.g. paths resolved offline."""
+    with con, con.cursor() as cur:
+        cur.execute(CANCEL_JOBS, {"kind": kind, "file_ids": list(file_ids)})
+        return cur.rowcount
+
+
+async def acancel_jobs(async_session, kind: str, file_ids: List[str]) -> int:
+    """Drop queued jobs that became unnecessary, e.g. files without new changes."""
+    if not file_ids:
+        return 0
+
+    async with async_session() as session, session.begin():
+        res = await session.execute(
+            ACANCEL_JOBS, {"kind": kind, "file_ids": list(file_ids)}
+        )
+
+    return res.rowcount
+
+
+async def acount_jobs(async_session) -> List[tuple]:
+    """Number of jobs per kind and status."""
+    async with async_session() as session:
+        res = await session.execute(COUNT_JOBS)
+
+    return [tuple(row) for row in res.fetchall()]
@@ -1,11 +1,37 @@
 """methods.py, implements database methods."""
-from typing import Dict
+import uuid
+from typing import Dict, Iterable, Iterator, List
 
 import pandas as pd
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
 
-from ..core.types import FileId, FileRec, TableTypes
+from ..core.metrics import ROWS_UPSERTED
+from ..core.types import ChangeRec, FileId, FileRec, TableTypes
 from .helpers import create_many_items
-from .models import File, Revision
+from .models import Change, File, Revision, pageCheckpoint
+from .notify import anotify, apublish
+from .jobs import aenqueue_changed_files
+from .rollups import refresh_rollups
+
+CHANGE_COLUMNS = (
+    "id",
+    "removed",
+    "time",
+    "type",
+    "changeType",
+    "page_token",
+    "file_id",
+    "is_forbidden",
+    "name",
+    "mimeType",
+    "parent_id",
+    "trashed",
+)
+CHANGE_NATURAL_KEY = "uq_change_natural_key"
+
+# stay below the 32767 bind parameters postgres accepts per statement
+INSERT_CHUNK_SIZE = 2_000
 
 
 class methods:
@@ -15,7 +41,7 @@ class methods:
     async def push_files(
         cls, df: pd.DataFrame, async_session, autobulk=True, returnExisting=False
     ) -> Dict[str, Dict[str, TableTypes]]:
-        """Push files to db."""
+        """Push files to db, and queue revision and path jobs for them."""
         df = df.copy()
         records_dict = {}
 
@@ -30,6 +56,10 @@ class methods:
             autobulk=autobulk,
             commit=True,
         )
+        ROWS_UPSERTED.inc(len(recs), table="file")
+        async with async_session() as session, session.begin():
+            await anotify(session, ["file"])
+            await aenqueue_changed_files(session, [r["id"] for r in recs.values()])
 
         return records_dict
 
@@ -37,7 +67,7 @@ class methods:
     async def push_revisions(
         cls, df: pd.DataFrame, async_session, autobulk=True, returnExisting=False
     ) -> Dict[str, Dict[str, TableTypes]]:
-        """Push revisions to db."""
+        """Push revisions to db, and refresh rollups of their files."""
         df = df.copy()
         records_dict = {}
 
@@ -52,25 +82,205 @@ class methods:
             autobulk=autobulk,
             commit=True,
         )
+        ROWS_UPSERTED.inc(len(recs), table="revision")
+        await apublish(async_session, ["revision"])
+
+        await refresh_rollups(async_session, df)
 
         return records_dict
 
+    @classmethod
+    async def push_changes(cls, df: pd.DataFrame, async_session) -> int:
+        """Push changes to db, skipping changes that are already stored.
+
+        Changes are identified by their natural key (file_id, time, changeType),
+        so replaying an old page token does not insert them again
+        """
+        ninserted = 0
+        async with async_session() as session:
+            recs = await cls._drop_unknown_files(session, cls._make_change_recs(df))
+            for chunk in cls._chunks(recs):
+                res = await session.execute(cls._insert_changes_stmt(chunk))
+                ninserted += res.rowcount
+            if ninserted:
+                await anotify(session, ["change"])
+            await session.commit()
+
+        ROWS_UPSERTED.inc(ninserted, table="change")
+
+        return ninserted
+
+    @classmethod
+    async def push_change_batch(
+        cls, df: pd.DataFrame, async_session, stream: str, token: int
+    ) -> int:
+        """Push files and changes of a batch of pages, and checkpoint the next token.
+
+        All in one transaction: after a crash the checkpoint points exactly at the
+        first page whose changes were not stored. Revision and path jobs are
+        queued for files with new changes, name and removal are applied to `file` by
+        projection.py
+        """
+        ninserted = 0
+        async with async_session() as session, session.begin():
+            if not df.empty:
+                file_recs = cls._batch_file_recs(df)
+                for chunk in cls._chunks(file_recs):
+                    await session.execute(cls._upsert_files_stmt(chunk))
+
+                change_recs = await cls._drop_unknown_files(
+                    session,
+                    cls._make_change_recs(df),
+                    known={r["id"] for r in file_recs},
+                )
+                changed_ids = set()
+                for chunk in cls._chunks(change_recs):
+                    res = await session.execute(
+                        cls._insert_changes_stmt(chunk).returning(
+                            Change.file_id, Change.removed
+                        )
+                    )
+                    rows = res.fetchall()
+                    ninserted += len(rows)
+                    changed_ids.update(
+                        file_id for file_id, removed in rows if not removed
+                    )
+
+                ROWS_UPSERTED.inc(len(file_recs), table="file")
+                ROWS_UPSERTED.inc(ninserted, table="change")
+                await anotify(session, ["file", "change"])
+                await aenqueue_changed_files(session, changed_ids)
+
+            await session.execute(cls._upsert_checkpoint_stmt(stream, token))
+
+        return ninserted
+
+    @classmethod
+    def _batch_file_recs(cls, df: pd.DataFrame) -> List[FileRec]:
+        """File records of the changes that carry the file.
+
+        Removed files come without name and mimeType, a page of only removals has
+        no file columns at all
+        """
+        if "file_name" not in df:
+            return []
+        with_file = df[df["file_name"].notna()]
+        if with_file.empty:
+            return []
+
+        return list(cls._make_file_recs(with_file).values())
+
+    @staticmethod
+    def _upsert_files_stmt(recs: List[FileRec]):
+        stmt = insert(File).values(recs)
+        return stmt.on_conflict_do_update(
+            index_elements=[File.id],
+            set_={
+                "size": func.coalesce(stmt.excluded.size, File.size),
+                "modifiedTime": func.coalesce(
+                    stmt.excluded.modifiedTime, File.modifiedTime
+                ),
+                "updated": func.now(),
+            },
+        )
+
+    @staticmethod
+    def _upsert_checkpoint_stmt(stream: str, token: int):
+        stmt = insert(pageCheckpoint).values(stream=stream, token=token)
+        return stmt.on_conflict_do_update(
+            index_elements=[pageCheckpoint.stream],
+            set_={"token": stmt.excluded.token, "updated": func.now()},
+        )
+
+    @staticmethod
+    def _insert_changes_stmt(recs: List[ChangeRec]):
+        return (
+            insert(Change)
+            .values(recs)
+            .on_conflict_do_nothing(constraint=CHANGE_NATURAL_KEY)
+        )
+
+    @staticmethod
+    async def _drop_unknown_files(
+        session, recs: List[ChangeRec], known: Iterable[str] = ()
+    ) -> List[ChangeRec]:
+        """Drop changes of files not in `file`, removals of files never seen."""
+        known = set(known)
+        unknown = {r["file_id"] for r in recs} - known
+        if unknown:
+            res = await session.execute(select(File.id).where(File.id.in_(unknown)))
+            known.update(res.scalars().all())
+
+        return [r for r in recs if r["file_id"] in known]
+
+    @staticmethod
+    def _chunks(recs: List, size=INSERT_CHUNK_SIZE) -> Iterator[List]:
+        for i in range(0, len(recs), size):
+            yield recs[i : i + size]
+
+    @staticmethod
+    def _make_change_recs(df: pd.DataFrame, columns=CHANGE_COLUMNS) -> List[ChangeRec]:
+        """Make Change records from dataframe returned by `changes_to_pandas`."""
+        # the file after the change, missing for removed files
+        state = df.reindex(
+            columns=["file_name", "file_mimeType", "file_parents", "file_trashed"]
+        )
+        df = df.assign(
+            name=state["file_name"],
+            mimeType=state["file_mimeType"],
+            parent_id=state["file_parents"].map(
+                lambda p: p[0] if isinstance(p, list) and p else None
+            ),
+            trashed=state["file_trashed"],
+        )
+        df = (
+            df.assign(file_id=df["fileId"])
+            .drop_duplicates(["file_id", "time", "changeType"])
+            .assign(
+                id=lambda x: [uuid.uuid4() for _ in range(len(x))],
+                time=lambda x: pd.to_datetime(x["time"], utc=True).dt.tz_convert(None),
+                is_forbidden=False,
+            )
+        )
+        recs = (
+            df.reindex(columns=list(columns))
+            .astype(object)
+            .where(lambda x: x.notna(), None)
+            .to_dict("records")
+        )
+
+        return recs
+
     @staticmethod
     def _make_file_recs(
-        df: pd.DataFrame, columns=("id", "mimeType", "name")
+        df: pd.DataFrame,
+        columns=("id", "mimeType", "name"),
+        optional=("size", "modifiedTime"),
     ) -> Dict[FileId, FileRec]:
-        """Make File records from dataframe."""
+        """Make File records from dataframe, with `optional` columns when present."""
+        df = df.rename(
+            columns={
+                "file_id": "id",
+                "file_mimeType": "mimeType",
+                "file_name": "name",
+                "file_size": "size",
+                "file_modifiedTime": "modifiedTime",
+            }
+        )
+        # changes have both `id` and `file_id`, the file id
+        df = df.loc[:, ~df.columns.duplicated()]
+        columns = list(columns) + [c for c in optional if c in df.columns]
+        view = df[columns].assign(index=df["id"]).set_index("index")
+        if "size" in view.columns:
+            view["size"] = pd.to_numeric(view["size"]).astype("Int64")
+        if "modifiedTime" in view.columns:
+            view["modifiedTime"] = pd.to_datetime(
+                view["modifiedTime"], utc=True
+            ).dt.tz_convert(None)
         recs = (
-            df.rename(
-                columns={
-                    "file_id": "id",
-                    "file_mimeType": "mimeType",
-                    "file_name": "name",
-                }
-            )[list(columns)]
-            .assign(index=df["id"])
-            .set_index("index")
-            .drop_duplicates("id")
+            view.drop_duplicates("id")
+            .astype(object)
+            .where(lambda x: x.notna(), None)
             .to_dict("index")
         )
 
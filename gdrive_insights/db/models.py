@@ -25,23 +25,60 @@ from typing import Optional
 
 import timeago  # type: ignore[import]
 from gdrive_insights import config as config_dir
+from gdrive_insights.db.instrument import instrument_from_env
+from gdrive_insights.db.partitions import ensure_partitions
+from gdrive_insights.db.sqlite import create_schema, get_sqlite_session
+from gdrive_insights.settings import DB_BACKEND, PDF_FILETYPE
 from rarc_utils.log import loggingLevelNames, set_log_level, setup_logger
 from rarc_utils.sqlalchemy_base import (async_main, get_async_session,
                                         get_session, load_config)
-from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Integer, String,
-                        UniqueConstraint, func)
+from sqlalchemy import (CHAR, BigInteger, Boolean, Column, Date, DateTime,
+                        Float, ForeignKey, Index, Integer, String,
+                        UniqueConstraint, cast, false, func, text)
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.schema import Table
+from sqlalchemy.types import TypeDecorator
+
 
 LOG_FMT = "%(asctime)s - %(module)-16s - %(lineno)-4s - %(funcName)-16s - %(levelname)-7s - %(message)s"  # title
 
 Base = declarative_base()
 
 
-psql = load_config(db_name="gdrive", cfg_file="postgres.cfg", config_dir=config_dir)
-psession = get_session(psql)()
+if DB_BACKEND == "sqlite":
+    psql = None
+    psession = get_sqlite_session()()
+else:
+    psql = load_config(db_name="gdrive", cfg_file="postgres.cfg", config_dir=config_dir)
+    psession = get_session(psql)()
+instrument_from_env(psession)
+
+# BIGINT keys do not autoincrement in SQLite, only INTEGER PRIMARY KEY does
+BigIntegerKey = BigInteger().with_variant(Integer, "sqlite")
+
+
+class GUID(TypeDecorator):
+    """Native UUID in postgres, 36 character string elsewhere."""
+
+    impl = CHAR(36)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(UUID(as_uuid=True))
+        return dialect.type_descriptor(CHAR(36))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name == "postgresql":
+            return value
+        return str(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, uuid.UUID):
+            return value
+        return uuid.UUID(value)
 
 
 file_session_association = Table(
@@ -50,6 +87,7 @@ file_session_association = Table(
     Column("file_session_id", Integer, ForeignKey("file_session.id")),
     Column("file_id", String, ForeignKey("file.id")),
     UniqueConstraint("file_session_id", "file_id"),
+    Index("ix_file_session_association_file_id", "file_id"),
 )
 
 
@@ -66,6 +104,11 @@ class fileSession(Base):
 
     nused = Column(Integer, nullable=False, default=0)
 
+    # detected from a burst of revisions by sessionize.py, not opened yet
+    is_candidate = Column(Boolean, nullable=False, server_default=false())
+    started = Column(DateTime)
+    ended = Column(DateTime)
+
     created = Column(DateTime, server_default=func.now())  # current_timestamp()
     updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
@@ -108,6 +151,36 @@ class pageToken(Base):
         )
 
 
+Index("ix_page_token_value_int", cast(pageToken.value, Integer).desc())
+
+
+class pageCheckpoint(Base):
+    """Represent the next pageToken to fetch for a changes stream.
+
+    Written in the same transaction as the changes fetched before it,
+    so fetching can resume exactly from `token` after a crash
+    """
+
+    __tablename__ = "page_checkpoint"
+    id = Column(Integer, primary_key=True)
+    stream = Column(String, nullable=False, unique=True)
+    token = Column(BigInteger, nullable=False, index=True)
+
+    created = Column(DateTime, server_default=func.now())  # current_timestamp()
+    updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    # add this so that it can be accessed
+    __mapper_args__ = {"eager_defaults": True}
+
+    def as_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+    def __repr__(self):
+        return "pageCheckpoint(stream={}, token={}, updated={})".format(
+            self.stream, self.token, self.updated
+        )
+
+
 class Revision(Base):
     """Represent a revision for a user or shared drive.
 
@@ -116,8 +189,14 @@ class Revision(Base):
     """
 
     __tablename__ = "revision"
+    __table_args__ = (
+        Index("ix_revision_file_id_modified", "file_id", "modifiedTime"),
+        Index("ix_revision_updated", "updated"),
+        {"postgresql_partition_by": 'RANGE ("modifiedTime")'},
+    )
     id = Column(String, primary_key=True)
-    modifiedTime = Column(DateTime, nullable=False)
+    # partition key, see partitions.py
+    modifiedTime = Column(DateTime, primary_key=True, nullable=False)
     mimeType = Column(String, nullable=False)
 
     file_id = Column(String, ForeignKey("file.id"), nullable=False)
@@ -153,6 +232,18 @@ class File(Base):
     """
 
     __tablename__ = "file"
+    __table_args__ = (
+        Index("ix_file_mimetype", "mimeType", postgresql_where=text("NOT is_forbidden")),
+        Index(
+            "ix_file_pdf",
+            "id",
+            postgresql_where=text(
+                "\"mimeType\" = '{}' AND NOT is_forbidden AND NOT is_removed".format(
+                    PDF_FILETYPE
+                )
+            ),
+        ),
+    )
     id = Column(String, primary_key=True)
     name = Column(String, nullable=False)
     mimeType = Column(String, nullable=False)
@@ -161,12 +252,23 @@ class File(Base):
     created = Column(DateTime, server_default=func.now())  # current_timestamp()
     updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
     path = Column(String)
+    # as reported by Drive, used to find the file on the mount. google docs have no size
+    size = Column(BigInteger)
+    modifiedTime = Column(DateTime)
 
     did_inspect = Column(Boolean, default=False, nullable=False)
     book_id = Column(Integer, nullable=True)
 
     is_forbidden = Column(Boolean, default=False, nullable=False)
 
+    # current state, projected from the change stream by projection.py
+    parent_id = Column(String)
+    is_removed = Column(Boolean, nullable=False, server_default=false())
+    change_time = Column(DateTime)
+
+    # last successful revisions.list call, see scheduler.py
+    revisions_fetched = Column(DateTime)
+
     # add this so that it can be accessed
     __mapper_args__ = {"eager_defaults": True}
 
@@ -207,20 +309,35 @@ class Change(Base):
     """
 
     __tablename__ = "change"
+    __table_args__ = (
+        Index("ix_change_file_id_time", "file_id", "time"),
+        Index("ix_change_time", "time"),
+        # projection.py reads changes stored after its checkpoint
+        Index("ix_change_created", "created"),
+        # natural key, replaying old page tokens should not insert changes twice
+        UniqueConstraint("file_id", "time", "changeType", name="uq_change_natural_key"),
+        {"postgresql_partition_by": 'RANGE ("time")'},
+    )
     id = Column(
-        UUID(as_uuid=True),
+        GUID(),
         primary_key=True,
-        unique=True,
         nullable=False,
         default=uuid.uuid4,
     )
 
     removed = Column(Boolean)
-    time = Column(DateTime)
+    # partition key, see partitions.py
+    time = Column(DateTime, primary_key=True, nullable=False)
     type = Column(String)
     changeType = Column(String)
     page_token = Column(Integer)
 
+    # the file after this change, empty for removed files
+    name = Column(String)
+    mimeType = Column(String)
+    parent_id = Column(String)
+    trashed = Column(Boolean)
+
     file_id = Column(String, ForeignKey("file.id"), nullable=False)
     file = relationship("File", uselist=False, lazy="selectin")
 
@@ -247,6 +364,221 @@ class Change(Base):
         )
 
 
+class fetchFailure(Base):
+    """Failed Drive API calls of a file, retried after `next_retry`.
+
+    Negative cache, see fetch_failures.py
+    """
+
+    __tablename__ = "fetch_failure"
+    file_id = Column(String, ForeignKey("file.id"), primary_key=True)
+    error_class = Column(String, nullable=False)
+    last_error = Column(String)
+    nfailure = Column(Integer, nullable=False, default=1)
+    next_retry = Column(DateTime, nullable=False, index=True)
+
+    created = Column(DateTime, server_default=func.now())  # current_timestamp()
+    updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    def as_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+    def __repr__(self):
+        return (
+            "fetchFailure(file_id={}, error_class={}, nfailure={}, next_retry={})".format(
+                self.file_id, self.error_class, self.nfailure, self.next_retry
+            )
+        )
+
+
+class fetchBudget(Base):
+    """revisions.list calls spent per day, see scheduler.py."""
+
+    __tablename__ = "fetch_budget"
+    day = Column(Date, primary_key=True)
+    spent = Column(Integer, nullable=False, default=0)
+
+    updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    def as_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+    def __repr__(self):
+        return "fetchBudget(day={}, spent={})".format(self.day, self.spent)
+
+
+class fileSnapshot(Base):
+    """Projected state of all files, a rebuild of the projection starts from here.
+
+    `taken` is the checkpoint of projection.py: every change stored before it is
+    applied to the snapshot
+    """
+
+    __tablename__ = "file_snapshot"
+    taken = Column(DateTime, primary_key=True)
+    file_id = Column(String, primary_key=True)
+    name = Column(String)
+    mimeType = Column(String)
+    parent_id = Column(String)
+    is_removed = Column(Boolean, nullable=False)
+    change_time = Column(DateTime)
+
+    def as_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+    def __repr__(self):
+        return "fileSnapshot(taken={}, file_id={}, is_removed={})".format(
+            self.taken, self.file_id, self.is_removed
+        )
+
+
+class fileActivity(Base):
+    """Revision statistics per file, maintained from `revision` by rollups.py."""
+
+    __tablename__ = "file_activity"
+    file_id = Column(String, ForeignKey("file.id"), primary_key=True)
+    nrevision = Column(Integer, nullable=False, default=0)
+    first_modified = Column(DateTime)
+    last_modified = Column(DateTime)
+    # log2 of the sum of 2^((modifiedTime - SCORE_EPOCH) / half-life), see
+    # rollups.score_shift
+    log_score = Column(Float)
+
+    updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    def as_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+    def __repr__(self):
+        return "fileActivity(file_id={}, nrevision={}, last_modified={})".format(
+            self.file_id, self.nrevision, self.last_modified
+        )
+
+
+Index("ix_file_activity_nrevision", fileActivity.nrevision.desc())
+Index("ix_file_activity_last_modified", fileActivity.last_modified.desc())
+# NULLS LAST is postgres only, SQLite scans the plain index backwards
+Index(
+    "ix_file_activity_log_score",
+    fileActivity.log_score,
+    postgresql_ops={"log_score": "DESC NULLS LAST"},
+)
+
+
+class revisionRollup(Base):
+    """Number of revisions per file per time bucket, maintained by rollups.py."""
+
+    __tablename__ = "revision_rollup"
+    __table_args__ = (
+        Index("ix_revision_rollup_bucket", "granularity", "bucket"),
+        Index("ix_revision_rollup_file_id", "file_id", "granularity", "bucket"),
+        Index("ix_revision_rollup_created", "granularity", "created"),
+    )
+    granularity = Column(String, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    file_id = Column(String, ForeignKey("file.id"), primary_key=True)
+    nrevision = Column(Integer, nullable=False, default=0)
+
+    # first time the file was seen in the bucket, in UTC, written by rollups.py
+    created = Column(DateTime, server_default=func.now())
+
+    updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    def as_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+    def __repr__(self):
+        return (
+            "revisionRollup(granularity={}, bucket={}, file_id={}, nrevision={})".format(
+                self.granularity, self.bucket, self.file_id, self.nrevision
+            )
+        )
+
+
+class mimeRollup(Base):
+    """Number of revisions and revised files per mime type per time bucket.
+
+    Aggregated from `revision_rollup` by rollups.py
+    """
+
+    __tablename__ = "mime_rollup"
+    granularity = Column(String, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    mime_type = Column(String, primary_key=True)
+    nrevision = Column(Integer, nullable=False, default=0)
+    nfile = Column(Integer, nullable=False, default=0)
+
+    updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    def as_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+    def __repr__(self):
+        return (
+            "mimeRollup(granularity={}, bucket={}, mime_type={}, nrevision={})".format(
+                self.granularity, self.bucket, self.mime_type, self.nrevision
+            )
+        )
+
+
+class tableVersion(Base):
+    """Change counter per table, bumped on every push.
+
+    Lets readers in other processes find out cheaply whether cached results are stale
+    """
+
+    __tablename__ = "table_version"
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+    updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return "tableVersion(name={}, version={})".format(self.name, self.version)
+
+
+class Job(Base):
+    """Work queue entry: fetch revisions of, or resolve the path of a file.
+
+    Claimed by workers with FOR UPDATE SKIP LOCKED, see jobs.py
+    """
+
+    __tablename__ = "job"
+    __table_args__ = (
+        UniqueConstraint("kind", "file_id", name="uq_job_kind_file_id"),
+        Index(
+            "ix_job_claim",
+            "kind",
+            "queued",
+            postgresql_where=text("status <> 'dead'"),
+        ),
+    )
+    id = Column(BigIntegerKey, primary_key=True)
+    kind = Column(String, nullable=False)
+    file_id = Column(String, ForeignKey("file.id"), nullable=False)
+    status = Column(String, nullable=False, server_default="queued")
+    attempts = Column(Integer, nullable=False, server_default="0")
+    worker = Column(String)
+    lease_until = Column(DateTime)
+    run_after = Column(DateTime, nullable=False, server_default=func.now())
+    last_error = Column(String)
+    queued = Column(DateTime, nullable=False, server_default=func.now())
+
+    created = Column(DateTime, server_default=func.now())  # current_timestamp()
+    updated = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    # add this so that it can be accessed
+    __mapper_args__ = {"eager_defaults": True}
+
+    def as_dict(self):
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+    def __repr__(self):
+        return "Job(kind={}, file_id={}, status={}, attempts={})".format(
+            self.kind, self.file_id, self.status, self.attempts
+        )
+
+
 CLI = argparse.ArgumentParser()
 CLI.add_argument(
     "-v",
@@ -274,7 +606,7 @@ if __name__ == "__main__":
 
     args = CLI.parse_args()
 
-    async_session = get_async_session(psql)
+    async_session = None if psql is None else get_async_session(psql)
     # async_db = get_async_db(psql)()
 
     loop = asyncio.new_event_loop()
@@ -288,9 +620,13 @@ if __name__ == "__main__":
 
     if args.create:
         print("create models")
-        loop.run_until_complete(
-            async_main(psql, base=Base, force=args.force, dropFirst=True)
-        )
+        if DB_BACKEND == "sqlite":
+            create_schema(psession.get_bind(), Base.metadata)
+        else:
+            loop.run_until_complete(
+                async_main(psql, base=Base, force=args.force, dropFirst=True)
+            )
+            ensure_partitions(psession.connection().connection)
 
         # print('create data')
         # items = loop.run_until_complete(create_initial_items(async_session))
@@ -0,0 +1,135 @@
+"""notify.py, NOTIFY on writes and LISTEN to invalidate cached reads.
+
+Every push bumps the table_version counter of the tables it wrote to and sends
+`NOTIFY gdrive_insights, '<table>'`. Postgres delivers the notification only when
+the transaction commits. Processes that cache reads run one listener thread
+that drops the cached entries of every notified table
+"""
+import logging
+import select
+import threading
+import time
+from typing import Iterable, Optional
+
+import psycopg2  # type: ignore[import]
+from sqlalchemy import text
+
+from ..core.cache import invalidate
+from .table_versions import BUMP_VERSION
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "gdrive_insights"
+NOTIFY = text("SELECT pg_notify(:channel, :table);")
+
+# seconds between polls of the listening connection, and before reconnecting
+POLL_TIMEOUT = 5.0
+RECONNECT_DELAY = 10.0
+
+
+async def anotify(session, tables: Iterable[str], channel=CHANNEL) -> None:
+    """Bump versions and notify `tables` inside the caller's transaction."""
+    for table in sorted(set(tables)):
+        await session.execute(BUMP_VERSION, {"name": table})
+        await session.execute(NOTIFY, {"channel": channel, "table": table})
+        invalidate(table)
+
+
+async def apublish(async_session, tables: Iterable[str], channel=CHANNEL) -> None:
+    """Notify `tables` in a transaction of its own, after committing elsewhere."""
+    async with async_session() as session, session.begin():
+        await anotify(session, tables, channel=channel)
+
+
+def notify(session, tables: Iterable[str], channel=CHANNEL) -> None:
+    """Bump versions and notify `tables`, sent when `session` commits."""
+    for table in sorted(set(tables)):
+        session.execute(BUMP_VERSION, {"name": table})
+        session.execute(NOTIFY, {"channel": channel, "table": table})
+        invalidate(table)
+
+
+def connect_listener(psql, channel=CHANNEL):
+    """Open a connection listening on `channel`."""
+    con = psycopg2.connect(
+        database=psql.db,
+        user=psql.user,
+        password=psql.passwd,
+        host=psql.host,
+        port="5432",
+    )
+    con.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    with con.cursor() as cur:
+        cur.execute(f"LISTEN {channel};")
+
+    return con
+
+
+def wait_for(con, table: str, timeout: float) -> bool:
+    """Block until `table` is notified on a listening connection, or timeout."""
+    deadline = time.monotonic() + timeout
+    while (remaining := deadline - time.monotonic()) > 0:
+        if select.select([con], [], [], remaining) == ([], [], []):
+            break
+        con.poll()
+        payloads = [n.payload for n in con.notifies]
+        con.notifies.clear()
+        if table in payloads:
+            return True
+
+    return False
+
+
+class Listener(threading.Thread):
+    """Daemon thread invalidating the cache for every notified table.
+
+    While disconnected all entries are dropped, since notifications may be missed
+    """
+
+    def __init__(self, psql, channel=CHANNEL):
+        super().__init__(name="gdrive-insights-listener", daemon=True)
+        self.psql = psql
+        self.channel = channel
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                con = connect_listener(self.psql, self.channel)
+                logger.debug(f"listening on {self.channel=}")
+                # entries cached before LISTEN could have missed notifications
+                invalidate()
+                self.listen(con)
+            except psycopg2.Error as e:
+                logger.warning(f"listener disconnected: {e!r}")
+                invalidate()
+                self.stopped.wait(RECONNECT_DELAY)
+
+    def listen(self, con) -> None:
+        while not self.stopped.is_set():
+            if select.select([con], [], [], POLL_TIMEOUT) == ([], [], []):
+                continue
+            con.poll()
+            while con.notifies:
+                table = con.notifies.pop(0).payload
+                invalidate(table)
+
+        con.close()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+
+_listener: Optional[Listener] = None
+_listener_lock = threading.Lock()
+
+
+def start_listener(psql, channel=CHANNEL) -> Listener:
+    """Start the listener thread of this process, once."""
+    global _listener
+    with _listener_lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = Listener(psql, channel=channel)
+            _listener.start()
+
+    return _listener
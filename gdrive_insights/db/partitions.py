@@ -0,0 +1,163 @@
+"""partitions.py, monthly range partitions for the revision and change tables.
+
+`revision` is partitioned on `modifiedTime` and `change` on `time`. Rows outside
+the existing partitions land in a default partition, so inserts never fail. A month
+partition created later takes over its rows from the default partition.
+
+Usage:
+    ensure_partitions(con)                      # create this and the next 3 months
+    detach_partitions_before(con, "revision", datetime(2022, 1, 1))
+"""
+import logging
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES: Dict[str, str] = {"revision": "modifiedTime", "change": "time"}
+
+MONTHS_AHEAD = 3
+
+
+def month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def next_month(d: date) -> date:
+    return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+
+def month_ranges(start: date, end: date) -> Iterator[Tuple[date, date]]:
+    """Yield (lower, upper) bounds of all months from start up to and including end."""
+    lower = month_start(start)
+    while lower <= end:
+        upper = next_month(lower)
+        yield lower, upper
+        lower = upper
+
+
+def partition_name(table: str, lower: date) -> str:
+    return f"{table}_y{lower.year}m{lower.month:02d}"
+
+
+def create_partition_sql(table: str, lower: date, upper: date) -> str:
+    return """CREATE TABLE IF NOT EXISTS {} PARTITION OF "{}"
+    FOR VALUES FROM ('{}') TO ('{}');""".format(
+        partition_name(table, lower), table, lower.isoformat(), upper.isoformat()
+    )
+
+
+def create_default_partition_sql(table: str) -> str:
+    return 'CREATE TABLE IF NOT EXISTS {}_default PARTITION OF "{}" DEFAULT;'.format(
+        table, table
+    )
+
+
+def default_rows_sql(table: str) -> str:
+    return """SELECT EXISTS (
+        SELECT 1 FROM {}_default WHERE "{}" >= %s AND "{}" < %s
+    );""".format(
+        table, PARTITIONED_TABLES[table], PARTITIONED_TABLES[table]
+    )
+
+
+def move_default_rows_sql(table: str) -> str:
+    # the default partition would violate the new partition's bounds, hold its rows
+    # of that month aside until the partition exists
+    return """CREATE TEMP TABLE moved_rows ON COMMIT DROP AS
+    WITH moved AS (
+        DELETE FROM {}_default WHERE "{}" >= %s AND "{}" < %s RETURNING *
+    )
+    SELECT * FROM moved;""".format(
+        table, PARTITIONED_TABLES[table], PARTITIONED_TABLES[table]
+    )
+
+
+def create_month_partition(cur, table: str, lower: date, upper: date) -> bool:
+    """Create a month partition, moving its rows out of the default partition.
+
+    Return whether it was created
+    """
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (partition_name(table, lower),))
+    if cur.fetchone()[0]:
+        return False
+
+    cur.execute(default_rows_sql(table), (lower, upper))
+    has_rows = cur.fetchone()[0]
+    if has_rows:
+        cur.execute(move_default_rows_sql(table), (lower, upper))
+    cur.execute(create_partition_sql(table, lower, upper))
+    if has_rows:
+        cur.execute(f'INSERT INTO "{table}" SELECT * FROM moved_rows;')
+        cur.execute("DROP TABLE moved_rows;")
+        logger.info(f"moved rows of {partition_name(table, lower)} out of the default")
+
+    return True
+
+
+def ensure_partitions(con, start=None, months_ahead=MONTHS_AHEAD) -> List[str]:
+    """Create default partitions, and monthly ones from start till months_ahead.
+
+    start defaults to this month. Runs every fetch cycle, so new months always exist
+    before their rows arrive and the default partition stays empty. Rows of earlier
+    months, e.g. older revisions on a fresh install, stay in the default partition
+    until `ensure_partitions(con, start=...)` creates their months.
+    """
+    today = datetime.utcnow().date()
+    start = start or today
+    end = month_start(today)
+    for _ in range(months_ahead):
+        end = next_month(end)
+
+    created = []
+    with con.cursor() as cur:
+        for table in PARTITIONED_TABLES:
+            cur.execute(create_default_partition_sql(table))
+            for lower, upper in month_ranges(start, end):
+                create_month_partition(cur, table, lower, upper)
+                created.append(partition_name(table, lower))
+    con.commit()
+    logger.debug(f"ensured {len(created)} partitions")
+
+    return created
+
+
+def list_partitions(con, table: str) -> List[str]:
+    query = """
+    SELECT child.relname FROM pg_inherits
+    JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+    JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+    WHERE parent.relname = %s ORDER BY child.relname;
+    """
+    with con.cursor() as cur:
+        cur.execute(query, (table,))
+        return [row[0] for row in cur.fetchall()]
+
+
+def detach_partitions_before(
+    con, table: str, before: date, archive_schema=None
+) -> List[str]:
+    """Detach monthly partitions that end before `before`.
+
+    Detached partitions stay as regular tables, optionally moved to `archive_schema`,
+    so old history can be dumped and dropped without touching the live table.
+    """
+    assert table in PARTITIONED_TABLES, f"{table=} is not partitioned"
+    detached = []
+    with con.cursor() as cur:
+        if archive_schema is not None:
+            cur.execute(f"CREATE SCHEMA IF NOT EXISTS {archive_schema};")
+        for name in list_partitions(con, table):
+            if not name.startswith(f"{table}_y"):
+                continue
+            lower = datetime.strptime(name[len(table) + 2 :], "%Ym%m").date()
+            if next_month(lower) > before:
+                continue
+            cur.execute(f'ALTER TABLE "{table}" DETACH PARTITION {name};')
+            if archive_schema is not None:
+                cur.execute(f"ALTER TABLE {name} SET SCHEMA {archive_schema};")
+            detached.append(name)
+    con.commit()
+    logger.info(f"detached {len(detached)} partitions of {table}: {detached}")
+
+    return detached
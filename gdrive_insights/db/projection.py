@@ -0,0 +1,237 @@
+"""projection.py, applies the change stream to the current state of `file`.
+
+Every change stores the file as it was after the change: name, mimeType, parent and
+trashed, or nothing when the file was removed. The newest change of every file is
+applied to its `file` row: renames, moves (`parent_id`), and deletions (`is_removed`,
+for removed and trashed files). A rename or move clears `path`, and queues a path job
+to resolve it again. Queries for current files filter on `file.is_removed`, instead
+of scanning `change`.
+
+Runs incrementally from a checkpoint in page_checkpoint: only changes stored after
+it are read, using the index on `change.created`. Changes are applied when they are
+newer than `file.change_time`, so applying one twice changes nothing, and changes
+stored late, e.g. by another account, cannot overwrite a newer state. The checkpoint
+lags OVERLAP behind, for transactions that committed after others started later.
+
+Every SNAPSHOT_INTERVAL the projected state is copied to `file_snapshot`. A rebuild
+restores the last snapshot and replays only the changes stored after it
+
+Usage:
+    # apply new changes
+    python projection.py
+    # restore the last snapshot and replay the changes after it
+    python projection.py --rebuild
+    # replay the whole change log
+    python projection.py --rebuild --full
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from gdrive_insights.db.jobs import PATH, PATH_MIME_TYPES, aenqueue_jobs
+from gdrive_insights.db.notify import anotify
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_STREAM = "projection"
+EPOCH = datetime(1970, 1, 1)
+OVERLAP = timedelta(minutes=10)
+SNAPSHOT_INTERVAL = timedelta(days=1)
+KEEP_SNAPSHOTS = 2
+
+SELECT_CHECKPOINT = text("SELECT token FROM page_checkpoint WHERE stream = :stream;")
+
+UPSERT_CHECKPOINT = text(
+    """
+    INSERT INTO page_checkpoint (stream, token) VALUES (:stream, :token)
+    ON CONFLICT (stream) DO UPDATE SET token = excluded.token, updated = now();
+    """
+)
+
+# the newest change of every file stored after the checkpoint
+APPLY_CHANGES = text(
+    """
+    WITH latest AS (
+        SELECT DISTINCT ON (file_id) file_id, time, removed, trashed, name,
+            "mimeType", parent_id
+        FROM change
+        WHERE created > :after
+        ORDER BY file_id, time DESC
+    )
+    UPDATE file SET
+        name = coalesce(latest.name, file.name),
+        "mimeType" = coalesce(latest."mimeType", file."mimeType"),
+        parent_id = CASE WHEN latest.name IS NULL THEN file.parent_id
+            ELSE latest.parent_id END,
+        path = CASE WHEN file.change_time IS NOT NULL AND latest.name IS NOT NULL
+            AND (latest.name <> file.name
+                OR latest.parent_id IS DISTINCT FROM file.parent_id)
+            THEN NULL ELSE file.path END,
+        is_removed = coalesce(latest.removed, false)
+            OR coalesce(latest.trashed, false),
+        change_time = latest.time,
+        updated = now()
+    FROM latest
+    WHERE file.id = latest.file_id
+        AND (file.change_time IS NULL OR latest.time > file.change_time)
+    RETURNING file.id, file.is_removed;
+    """
+)
+
+MAX_CREATED = text("SELECT max(created) FROM change WHERE created > :after;")
+
+LAST_SNAPSHOT = text("SELECT max(taken) FROM file_snapshot;")
+
+TAKE_SNAPSHOT = [
+    text(
+        """
+        INSERT INTO file_snapshot
+            (taken, file_id, name, "mimeType", parent_id, is_removed, change_time)
+        SELECT :taken, id, name, "mimeType", parent_id, is_removed, change_time
+        FROM file
+        WHERE change_time IS NOT NULL;
+        """
+    ),
+    text(
+        """
+        DELETE FROM file_snapshot WHERE taken < (
+            SELECT min(taken) FROM (
+                SELECT DISTINCT taken FROM file_snapshot
+                ORDER BY taken DESC LIMIT :keep
+            ) AS kept
+        );
+        """
+    ),
+]
+
+RESET_FILES = text("UPDATE file SET change_time = NULL WHERE change_time IS NOT NULL;")
+
+# name, mimeType and parent of files without a change since are kept as they are
+RESTORE_SNAPSHOT = text(
+    """
+    UPDATE file SET
+        name = coalesce(s.name, file.name),
+        "mimeType" = coalesce(s."mimeType", file."mimeType"),
+        parent_id = s.parent_id,
+        is_removed = s.is_removed,
+        change_time = s.change_time,
+        updated = now()
+    FROM file_snapshot AS s
+    WHERE s.taken = :taken AND s.file_id = file.id;
+    """
+)
+
+
+def to_token(dt: datetime) -> int:
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def from_token(token: Optional[int]) -> datetime:
+    return EPOCH + timedelta(microseconds=token or 0)
+
+
+async def _set_checkpoint(session, after: datetime) -> None:
+    await session.execute(
+        UPSERT_CHECKPOINT, {"stream": CHECKPOINT_STREAM, "token": to_token(after)}
+    )
+
+
+async def project(async_session, snapshot_interval=SNAPSHOT_INTERVAL) -> int:
+    """Apply changes stored after the checkpoint to `file`. Return files updated."""
+    async with async_session() as session, session.begin():
+        token = (
+            await session.execute(SELECT_CHECKPOINT, {"stream": CHECKPOINT_STREAM})
+        ).scalar_one_or_none()
+        after = from_token(token)
+        newest = (await session.execute(MAX_CREATED, {"after": after})).scalar()
+        if newest is None:
+            return 0
+
+        rows = (await session.execute(APPLY_CHANGES, {"after": after})).fetchall()
+        removed = {file_id for file_id, is_removed in rows if is_removed}
+        if rows:
+            await anotify(session, ["file"])
+            # renamed and moved files lost their path
+            await aenqueue_jobs(
+                session,
+                PATH,
+                [file_id for file_id, _ in rows if file_id not in removed],
+                PATH_MIME_TYPES,
+                missing_path=True,
+            )
+
+        checkpoint = max(after, newest - OVERLAP)
+        await _set_checkpoint(session, checkpoint)
+
+        last_snapshot = (await session.execute(LAST_SNAPSHOT)).scalar()
+        if last_snapshot is None or checkpoint - last_snapshot >= snapshot_interval:
+            await _take_snapshot(session, checkpoint)
+
+    logger.info(
+        f"applied changes up to {newest}: {len(rows):,} files updated, "
+        f"{len(removed):,} removed"
+    )
+
+    return len(rows)
+
+
+async def _take_snapshot(session, taken: datetime) -> None:
+    """Copy the projected state, all changes stored before `taken` are in it."""
+    await session.execute(TAKE_SNAPSHOT[0], {"taken": taken})
+    await session.execute(TAKE_SNAPSHOT[1], {"keep": KEEP_SNAPSHOTS})
+    logger.info(f"took snapshot at {taken}")
+
+
+async def rebuild(async_session, full=False, **kwargs) -> int:
+    """Restore the last snapshot, or reset all files with `full`, and replay."""
+    async with async_session() as session, session.begin():
+        taken = None if full else (await session.execute(LAST_SNAPSHOT)).scalar()
+        await session.execute(RESET_FILES)
+        if taken is not None:
+            await session.execute(RESTORE_SNAPSHOT, {"taken": taken})
+        await _set_checkpoint(session, taken or EPOCH)
+
+    logger.info(f"replaying changes stored after {taken or EPOCH}")
+
+    return await project(async_session, **kwargs)
+
+
+if __name__ == "__main__":
+    from gdrive_insights import config as config_dir
+    from rarc_utils.log import LOG_FMT, setup_logger
+    from rarc_utils.sqlalchemy_base import get_async_session, load_config
+
+    logger = setup_logger(
+        cmdLevel=logging.INFO,
+        saveFile=0,
+        savePandas=0,
+        jsonLogger=0,
+        color=1,
+        fmt=LOG_FMT,
+    )
+
+    parser = argparse.ArgumentParser(description="projection.py cli parameters")
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        default=False,
+        help="restore the last snapshot and replay the changes stored after it",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        default=False,
+        help="with --rebuild: ignore snapshots, replay all changes",
+    )
+    args = parser.parse_args()
+
+    psql = load_config(db_name="gdrive", cfg_file="postgres.cfg", config_dir=config_dir)
+    async_session = get_async_session(psql)
+
+    if args.rebuild:
+        asyncio.run(rebuild(async_session, full=args.full))
+    else:
+        asyncio.run(project(async_session))
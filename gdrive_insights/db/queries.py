@@ -0,0 +1,135 @@
+"""queries.py, read-only queries for the dashboard.
+
+All queries read the rollup tables maintained by rollups.py, never `revision`,
+and are cached in-process. Cache keys include the table versions, so pushes by
+other processes (fetch_new_files.py) are picked up within `VERSIONS_TTL` seconds,
+or right away when the listener receives their NOTIFY
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+import gdrive_insights.config as config_dir
+import pandas as pd
+from rarc_utils.sqlalchemy_base import get_session, load_config
+from sqlalchemy import text
+
+from ..core.cache import cached
+from .instrument import instrument_from_env
+from .notify import start_listener
+from .rollups import (
+    ACTIVITY_BY_MIME_TYPE,
+    FILE_HISTORY,
+    ROLLUP_TABLES,
+    TOP_FILES,
+    pick_granularity,
+    score_shift,
+)
+from .table_versions import get_table_versions
+
+psql = load_config(db_name="gdrive", cfg_file="postgres.cfg", config_dir=config_dir)
+engine = get_session(psql)().get_bind()
+instrument_from_env(engine)
+start_listener(psql)
+
+logger = logging.getLogger(__name__)
+
+QUERY_TTL = 300
+
+RECENT_FILES = """
+    SELECT file.name AS file_name, file."mimeType" AS file_type, fa.nrevision,
+        fa.last_modified, fa.file_id
+    FROM file_activity AS fa
+    JOIN file ON file.id = fa.file_id
+    WHERE NOT file.is_removed
+    ORDER BY fa.last_modified DESC NULLS LAST
+    LIMIT :n;
+"""
+
+DAILY_ACTIVITY = """
+    SELECT bucket AS day, sum(nrevision) AS nrevision, count(*) AS nfile
+    FROM revision_rollup
+    WHERE granularity = 'day' AND bucket >= :since
+    GROUP BY bucket
+    ORDER BY bucket;
+"""
+
+
+def rollup_versions() -> Tuple[int, ...]:
+    """Versions of the rollup tables, part of every cache key."""
+    versions = get_table_versions(engine)
+    return tuple(versions.get(table, 0) for table in ROLLUP_TABLES)
+
+
+def _read(query: str, **params) -> pd.DataFrame:
+    with engine.connect() as conn:
+        return pd.read_sql(text(query), conn, params=params)
+
+
+def _read_pyformat(query: str, **params) -> pd.DataFrame:
+    # queries shared with data_methods use psycopg2 placeholders
+    with engine.connect() as conn:
+        return pd.read_sql(query, conn, params=params)
+
+
+def _since(days: int) -> datetime:
+    # truncate to the day, so the cache key stays the same all day
+    return datetime.combine(
+        datetime.utcnow().date() - timedelta(days=days), datetime.min.time()
+    )
+
+
+@cached(tables=ROLLUP_TABLES, ttl=QUERY_TTL, version=rollup_versions)
+def top_files(n=25, mime_type: Optional[str] = None) -> pd.DataFrame:
+    """Most active files by decayed score, optionally of one mime type."""
+    return _read(TOP_FILES, n=n, mime_type=mime_type, shift=score_shift())
+
+
+@cached(tables=ROLLUP_TABLES, ttl=QUERY_TTL, version=rollup_versions)
+def recent_files(n=25) -> pd.DataFrame:
+    """Last revised files."""
+    return _read(RECENT_FILES, n=n)
+
+
+@cached(tables=ROLLUP_TABLES, ttl=QUERY_TTL, version=rollup_versions)
+def daily_activity(days=30) -> pd.DataFrame:
+    """Number of revisions and revised files per day."""
+    return _read(DAILY_ACTIVITY, since=_since(days))
+
+
+@cached(tables=ROLLUP_TABLES, ttl=QUERY_TTL, version=rollup_versions)
+def mime_activity(days=30) -> pd.DataFrame:
+    """Number of revisions per mime type, from the coarsest fitting rollup."""
+    end = _since(-1)
+    granularity, start, end = pick_granularity(end - timedelta(days=days), end)
+    return _read_pyformat(
+        ACTIVITY_BY_MIME_TYPE,
+        granularity=granularity,
+        start=start,
+        end=end,
+        mime_type=None,
+    )
+
+
+@cached(tables=ROLLUP_TABLES, ttl=QUERY_TTL, version=rollup_versions)
+def hourly_activity(days=30) -> pd.DataFrame:
+    """Number of revisions per weekday and hour of day, from the hour rollup."""
+    end = _since(-1)
+    df = _read_pyformat(
+        ACTIVITY_BY_MIME_TYPE,
+        granularity="hour",
+        start=end - timedelta(days=days),
+        end=end,
+        mime_type=None,
+    )
+    return (
+        df.assign(weekday=df.bucket.dt.day_name().str[:3], hour=df.bucket.dt.hour)
+        .pivot_table(index="hour", columns="weekday", values="nrevision", aggfunc="sum")
+        .fillna(0)
+    )
+
+
+@cached(tables=ROLLUP_TABLES, ttl=QUERY_TTL, version=rollup_versions)
+def file_history(file_id: str, days=90) -> pd.DataFrame:
+    """Number of revisions per day of one file."""
+    return _read(FILE_HISTORY, file_id=file_id, since=_since(days))
@@ -0,0 +1,462 @@
+"""rollups.py, maintains precomputed revision statistics.
+
+file_activity       one row per file: number of revisions, first and last modified,
+                    and a decayed activity score
+revision_rollup     number of revisions per file per hour, day and week
+mime_rollup         number of revisions and revised files per mime type per bucket
+
+file_activity is updated from the revisions newer than its `last_modified`, so an
+update costs O(new revisions) and pushing the same revisions twice changes nothing.
+The same revisions decide which buckets are recomputed from `revision`: per file,
+from the bucket of its oldest new revision on. mime_rollup is aggregated from
+revision_rollup for only the buckets that were recomputed. The dashboard and `data_methods.activity_from_sql`
+read only these tables, never scan `revision` itself. `pick_granularity` picks the
+coarsest granularity that answers a time range
+
+The score of a file is the sum of 2^((t - SCORE_EPOCH) / half-life) over its
+revisions. Scaling it by 2^(-(now - SCORE_EPOCH) / half-life), see `score_shift`,
+gives every revision weight 1 when it is new, halving every half-life. The
+scale factor is the same for all files, so the stored score can be sorted on
+directly. It is stored as its log2, `log_score`: the score itself passes the float
+range after about 1024 half-lives since SCORE_EPOCH. Sums are taken with the largest
+term factored out, so power() is only ever applied to exponents <= 0. After changing
+the half-life, run the backfill
+
+Usage:
+    # backfill rollups of all files
+    python rollups.py --backfill
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import pandas as pd
+from gdrive_insights.db.notify import anotify
+from gdrive_insights.settings import SCORE_EPOCH, SCORE_HALFLIFE_DAYS
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# finest first, names as accepted by date_trunc
+GRANULARITIES = ("hour", "day", "week")
+BUCKET_SIZES = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+}
+ROLLUP_TABLES = ("file_activity", "revision_rollup", "mime_rollup")
+
+# files refreshed per statement
+REFRESH_CHUNK_SIZE = 1_000
+
+# 2^x is taken as 0 below this, postgres raises on float underflow
+MIN_EXPONENT = -1000
+
+# log2 of the stored score of one revision
+LOG_WEIGHT = """
+    CAST(extract(epoch FROM r."modifiedTime" - CAST(:epoch AS timestamp))
+        / :halflife AS double precision)
+"""
+
+# statistics per file of the revisions in `{}`, with log2 of the sum of their scores
+LOG_SUM_REVISIONS = """
+    SELECT file_id, count(*), min(t), max(t),
+        max(m) + ln(sum(power(2, greatest(x - m, {min_exp})))) / ln(2)
+    FROM (
+        SELECT r.file_id, r."modifiedTime" AS t, {weight} AS x,
+            max({weight}) OVER (PARTITION BY r.file_id) AS m
+        {{}}
+    ) AS r
+    GROUP BY file_id
+""".format(
+    weight=LOG_WEIGHT, min_exp=MIN_EXPONENT
+)
+
+# log2(2^a + 2^b)
+LOG_ADD = """
+    greatest({a}, {b})
+        + ln(1 + power(2, greatest(-abs({a} - {b}), {min_exp}))) / ln(2)
+"""
+
+# current score of a stored log_score, 0 without revisions, score_shift() goes in {}
+CURRENT_SCORE = "coalesce(power(2, greatest(fa.log_score - {{}}, {})), 0)".format(
+    MIN_EXPONENT
+)
+
+# add revisions newer than last_modified, a range scan of ix_revision_file_id_modified
+# per file. Drive only appends revisions, older ones arriving late need a backfill
+UPDATE_FILE_ACTIVITY = text(
+    """
+    INSERT INTO file_activity
+        (file_id, nrevision, first_modified, last_modified, log_score)
+    {}
+    ON CONFLICT (file_id) DO UPDATE
+    SET nrevision = file_activity.nrevision + excluded.nrevision,
+        first_modified = least(file_activity.first_modified, excluded.first_modified),
+        last_modified = greatest(file_activity.last_modified, excluded.last_modified),
+        log_score = CASE WHEN file_activity.log_score IS NULL THEN excluded.log_score
+            ELSE {} END,
+        updated = now();
+    """.format(
+        LOG_SUM_REVISIONS.format(
+            """
+            FROM revision AS r
+            LEFT JOIN file_activity AS fa ON fa.file_id = r.file_id
+            WHERE r.file_id = ANY(:file_ids)
+                AND (fa.last_modified IS NULL OR r."modifiedTime" > fa.last_modified)
+            """
+        ),
+        LOG_ADD.format(
+            a="file_activity.log_score", b="excluded.log_score", min_exp=MIN_EXPONENT
+        ),
+    )
+)
+
+# recompute from all revisions, for backfills and a changed half-life
+REBUILD_FILE_ACTIVITY = text(
+    """
+    INSERT INTO file_activity
+        (file_id, nrevision, first_modified, last_modified, log_score)
+    {}
+    ON CONFLICT (file_id) DO UPDATE
+    SET nrevision = excluded.nrevision,
+        first_modified = excluded.first_modified,
+        last_modified = excluded.last_modified,
+        log_score = excluded.log_score,
+        updated = now();
+    """.format(
+        LOG_SUM_REVISIONS.format("FROM revision AS r WHERE r.file_id = ANY(:file_ids)")
+    )
+)
+
+# per file the oldest revision that file_activity has not counted yet, run before
+# UPDATE_FILE_ACTIVITY
+SELECT_NEW_SINCE = text(
+    """
+    SELECT r.file_id, min(r."modifiedTime")
+    FROM revision AS r
+    LEFT JOIN file_activity AS fa ON fa.file_id = r.file_id
+    WHERE r.file_id = ANY(:file_ids)
+        AND (fa.last_modified IS NULL OR r."modifiedTime" > fa.last_modified)
+    GROUP BY r.file_id;
+    """
+)
+
+# files with the time from which their buckets are recomputed
+FILE_SINCE = """
+    unnest(CAST(:file_ids AS varchar[]), CAST(:sinces AS timestamp[]))
+        AS s(file_id, since)
+"""
+
+# rows are upserted, so `created` keeps the time a file was first seen in a bucket,
+# in UTC. co_usage.py counts new rows from it
+UPSERT_ROLLUP = """
+    INSERT INTO revision_rollup (granularity, bucket, file_id, nrevision, created)
+    {}
+    ON CONFLICT (granularity, bucket, file_id) DO UPDATE
+    SET nrevision = excluded.nrevision, updated = now()
+"""
+
+INSERT_ROLLUP = text(
+    UPSERT_ROLLUP.format(
+        """
+        SELECT CAST(:granularity AS varchar), date_trunc(:granularity, "modifiedTime"),
+            file_id, count(*), now() AT TIME ZONE 'utc'
+        FROM revision
+        WHERE file_id = ANY(:file_ids)
+        GROUP BY 2, file_id
+        """
+    )
+    + ";"
+)
+
+# after INSERT_ROLLUP, rows it did not write are buckets of deleted revisions
+DELETE_STALE_ROLLUP = text(
+    """
+    DELETE FROM revision_rollup
+    WHERE granularity = :granularity AND file_id = ANY(:file_ids)
+        AND (updated IS NULL OR updated < now());
+    """
+)
+
+# upsert buckets of the files from the one of their `since` on, none disappear since
+# Drive only appends revisions. Returns the buckets, for the mime_rollup refresh
+INSERT_NEW_ROLLUP = text(
+    UPSERT_ROLLUP.format(
+        """
+        SELECT CAST(:granularity AS varchar), date_trunc(:granularity, r."modifiedTime"),
+            r.file_id, count(*), now() AT TIME ZONE 'utc'
+        FROM revision AS r
+        JOIN {} ON s.file_id = r.file_id
+        WHERE r."modifiedTime" >= date_trunc(:granularity, s.since)
+        GROUP BY 2, r.file_id
+        """.format(
+            FILE_SINCE
+        )
+    )
+    + "RETURNING bucket;"
+)
+
+# all buckets, or only those in :buckets
+MIME_BUCKETS = "(CAST(:buckets AS timestamp[]) IS NULL OR {} = ANY(:buckets))"
+
+DELETE_MIME_ROLLUP = text(
+    """
+    DELETE FROM mime_rollup WHERE granularity = :granularity AND {};
+    """.format(
+        MIME_BUCKETS.format("bucket")
+    )
+)
+
+# upsert, other pushes may aggregate the same buckets at the same time
+INSERT_MIME_ROLLUP = text(
+    """
+    INSERT INTO mime_rollup (granularity, bucket, mime_type, nrevision, nfile)
+    SELECT rr.granularity, rr.bucket, coalesce(file."mimeType", ''),
+        sum(rr.nrevision), count(*)
+    FROM revision_rollup AS rr
+    JOIN file ON file.id = rr.file_id
+    WHERE rr.granularity = :granularity AND {}
+    GROUP BY 1, 2, 3
+    ON CONFLICT (granularity, bucket, mime_type) DO UPDATE
+    SET nrevision = excluded.nrevision, nfile = excluded.nfile, updated = now();
+    """.format(
+        MIME_BUCKETS.format("rr.bucket")
+    )
+)
+
+# psycopg2 style, read by data_methods and queries.py with pandas
+ACTIVITY_BY_FILE = """
+    SELECT rr.bucket, rr.file_id, file.name AS file_name, file."mimeType" AS file_type,
+        rr.nrevision
+    FROM revision_rollup AS rr
+    JOIN file ON file.id = rr.file_id
+    WHERE rr.granularity = %(granularity)s
+        AND rr.bucket >= %(start)s AND rr.bucket < %(end)s
+        AND (CAST(%(file_ids)s AS varchar[]) IS NULL OR rr.file_id = ANY(%(file_ids)s))
+    ORDER BY rr.bucket, rr.nrevision DESC;
+"""
+
+ACTIVITY_BY_MIME_TYPE = """
+    SELECT bucket, mime_type, nrevision, nfile
+    FROM mime_rollup
+    WHERE granularity = %(granularity)s
+        AND bucket >= %(start)s AND bucket < %(end)s
+        AND (CAST(%(mime_type)s AS varchar) IS NULL OR mime_type = %(mime_type)s)
+    ORDER BY bucket, mime_type;
+"""
+
+# read by queries.py and async_helpers.py
+TOP_FILES = """
+    SELECT file.name AS file_name, file."mimeType" AS file_type,
+        {} AS score, fa.nrevision, fa.first_modified,
+        fa.last_modified, fa.file_id
+    FROM file_activity AS fa
+    JOIN file ON file.id = fa.file_id
+    WHERE NOT file.is_removed
+        AND (CAST(:mime_type AS varchar) IS NULL OR file."mimeType" = :mime_type)
+    ORDER BY fa.log_score DESC NULLS LAST
+    LIMIT :n;
+""".format(
+    CURRENT_SCORE.format(":shift")
+)
+
+FILE_HISTORY = """
+    SELECT bucket AS day, nrevision
+    FROM revision_rollup
+    WHERE file_id = :file_id AND granularity = 'day' AND bucket >= :since
+    ORDER BY bucket;
+"""
+
+SELECT_FILE_IDS = text("SELECT DISTINCT file_id FROM revision;")
+
+
+def score_shift(
+    now: Optional[datetime] = None, halflife_days=SCORE_HALFLIFE_DAYS
+) -> float:
+    """Half-lives since SCORE_EPOCH, log_score minus this is the current log2 score."""
+    now = now or datetime.utcnow()
+    return (now - SCORE_EPOCH).total_seconds() / (halflife_days * 86_400)
+
+
+def truncate(ts: datetime, granularity: str) -> datetime:
+    """Start of the bucket of `ts`, like date_trunc in postgres."""
+    ts = ts.replace(minute=0, second=0, microsecond=0)
+    if granularity == "hour":
+        return ts
+    ts = ts.replace(hour=0)
+    if granularity == "day":
+        return ts
+    if granularity == "week":
+        return ts - timedelta(days=ts.weekday())
+    raise ValueError(f"unknown {granularity=}")
+
+
+def pick_granularity(
+    start: datetime, end: datetime, granularities=GRANULARITIES
+) -> Tuple[str, datetime, datetime]:
+    """Get the coarsest granularity with buckets exactly covering [start, end).
+
+    Falls back to the finest granularity, with start and end widened to its buckets.
+    Return granularity, start, end
+    """
+    granularities = [g for g in GRANULARITIES if g in granularities]
+    for granularity in reversed(granularities):
+        if truncate(start, granularity) == start and truncate(end, granularity) == end:
+            return granularity, start, end
+
+    finest = granularities[0]
+    end_ = truncate(end, finest)
+    if end_ < end:
+        end_ += BUCKET_SIZES[finest]
+
+    return finest, truncate(start, finest), end_
+
+
+def _chunks(items: List, size=REFRESH_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+async def refresh_mime_rollups(
+    session,
+    granularities=GRANULARITIES,
+    buckets: Optional[Dict[str, Set[datetime]]] = None,
+) -> None:
+    """Aggregate mime_rollup from revision_rollup.
+
+    buckets:    per granularity the buckets to aggregate, all buckets when not passed
+    """
+    for granularity in granularities:
+        params = {"granularity": granularity, "buckets": None}
+        if buckets is not None:
+            if not buckets.get(granularity):
+                continue
+            params["buckets"] = sorted(buckets[granularity])
+        await session.execute(DELETE_MIME_ROLLUP, params)
+        await session.execute(INSERT_MIME_ROLLUP, params)
+
+
+async def refresh_file_ids(
+    session,
+    file_ids: Iterable[str],
+    granularities=GRANULARITIES,
+    rebuild=False,
+    mime=True,
+    halflife_days=SCORE_HALFLIFE_DAYS,
+) -> int:
+    """Update rollups of `file_ids` inside the caller's transaction.
+
+    Only files with revisions that file_activity has not counted are updated, from
+    their oldest such revision on. Return number of files updated
+
+    rebuild:    recompute all rollups of the files from all revisions
+    mime:       also aggregate mime_rollup
+    """
+    file_ids = sorted(set(f for f in file_ids if f is not None))
+    activity_params = {"epoch": SCORE_EPOCH, "halflife": halflife_days * 86_400}
+    buckets: Dict[str, Set[datetime]] = {g: set() for g in granularities}
+    nfile = 0
+    for chunk in _chunks(file_ids):
+        if rebuild:
+            await session.execute(
+                REBUILD_FILE_ACTIVITY, {"file_ids": chunk, **activity_params}
+            )
+            for granularity in granularities:
+                params = {"granularity": granularity, "file_ids": chunk}
+                await session.execute(INSERT_ROLLUP, params)
+                await session.execute(DELETE_STALE_ROLLUP, params)
+            nfile += len(chunk)
+            continue
+
+        res = await session.execute(SELECT_NEW_SINCE, {"file_ids": chunk})
+        new_since = dict(res.fetchall())
+        if not new_since:
+            continue
+
+        await session.execute(
+            UPDATE_FILE_ACTIVITY, {"file_ids": list(new_since), **activity_params}
+        )
+        for granularity in granularities:
+            params = {
+                "granularity": granularity,
+                "file_ids": list(new_since),
+                "sinces": list(new_since.values()),
+            }
+            res = await session.execute(INSERT_NEW_ROLLUP, params)
+            buckets[granularity].update(res.scalars().all())
+        nfile += len(new_since)
+
+    if nfile and mime:
+        await refresh_mime_rollups(
+            session, granularities, buckets=None if rebuild else buckets
+        )
+
+    if nfile:
+        await anotify(session, ROLLUP_TABLES)
+
+    return nfile
+
+
+async def refresh_rollups(async_session, df: pd.DataFrame) -> int:
+    """Refresh rollups of files in a dataframe of pushed revisions."""
+    if df.empty:
+        return 0
+
+    col = "file_id" if "file_id" in df.columns else "fileId"
+    async with async_session() as session, session.begin():
+        nfile = await refresh_file_ids(session, df[col].tolist())
+
+    logger.info(f"refreshed rollups of {nfile:,} files")
+
+    return nfile
+
+
+async def backfill(async_session) -> int:
+    """Recompute rollups of all files with revisions."""
+    async with async_session() as session:
+        file_ids = (await session.execute(SELECT_FILE_IDS)).scalars().all()
+
+    nfile = 0
+    for chunk in _chunks(file_ids, size=REFRESH_CHUNK_SIZE * 10):
+        async with async_session() as session, session.begin():
+            nfile += await refresh_file_ids(session, chunk, rebuild=True, mime=False)
+        logger.info(f"backfilled {nfile:,}/{len(file_ids):,} files")
+
+    async with async_session() as session, session.begin():
+        await refresh_mime_rollups(session)
+        await anotify(session, ROLLUP_TABLES)
+
+    return nfile
+
+
+if __name__ == "__main__":
+    from gdrive_insights import config as config_dir
+    from rarc_utils.log import LOG_FMT, setup_logger
+    from rarc_utils.sqlalchemy_base import get_async_session, load_config
+
+    logger = setup_logger(
+        cmdLevel=logging.INFO,
+        saveFile=0,
+        savePandas=0,
+        jsonLogger=0,
+        color=1,
+        fmt=LOG_FMT,
+    )
+
+    parser = argparse.ArgumentParser(description="rollups.py cli parameters")
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        default=False,
+        help="recompute rollups of all files",
+    )
+    args = parser.parse_args()
+
+    psql = load_config(db_name="gdrive", cfg_file="postgres.cfg", config_dir=config_dir)
+    async_session = get_async_session(psql)
+
+    if args.backfill:
+        asyncio.run(backfill(async_session))
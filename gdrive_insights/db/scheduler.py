@@ -0,0 +1,228 @@
+"""scheduler.py, orders revision fetches by priority under a daily budget.
+
+Every file to fetch gets a priority: its value times the hours since its revisions
+were last fetched. The value is 1 plus its recent changes and its activity score,
+both decayed with SCORE_HALFLIFE_DAYS. Staleness is capped at MAX_STALE_HOURS, so a
+valuable file fetched two hours ago still goes before a backlog of files nobody
+uses. Files without a change since their last fetch have no new revisions and are
+skipped.
+
+Files are popped from a heap until the day's budget of API calls, kept in
+`fetch_budget`, is spent. The scheduler then stops, and the files left over get
+staler and rank higher the next day. worker.py pops its revision jobs from the same
+heap, see `drain_revisions`, and checks the budget left before every batch, since
+other workers spend it too
+
+Usage:
+    scheduler = RevisionScheduler.from_db(psession, file_ids)
+    for file_id in scheduler:
+        ...
+        scheduler.commit(psession, fetched_ids)
+
+    scheduler = await RevisionScheduler.afrom_db(session, file_ids)
+    file_ids = scheduler.take(50)
+"""
+import heapq
+import logging
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import text
+
+from ..settings import REVISION_DAILY_BUDGET, SCORE_HALFLIFE_DAYS
+from .rollups import CURRENT_SCORE, score_shift
+
+logger = logging.getLogger(__name__)
+
+CHANGE_WEIGHT = 1.0
+USAGE_WEIGHT = 1.0
+MAX_STALE_HOURS = 7 * 24.0
+# changes older than this do not count as recent activity
+CHANGE_WINDOW = timedelta(days=30)
+
+# change.time and file.revisions_fetched are UTC without time zone, as is :now
+PRIORITY_INPUTS = text(
+    """
+    WITH recent AS (
+        SELECT file_id, max(time) AS last_change,
+            sum(power(
+                0.5, extract(epoch FROM CAST(:now AS timestamp) - time) / :halflife_secs
+            )) AS activity
+        FROM change
+        WHERE file_id = ANY(:file_ids) AND time > :window_start
+        GROUP BY file_id
+    )
+    SELECT file.id AS file_id,
+        coalesce(recent.activity, 0) AS activity,
+        {} AS usage,
+        extract(epoch FROM CAST(:now AS timestamp) - file.revisions_fetched) / 3600
+            AS stale_hours,
+        file.revisions_fetched IS NULL
+            OR recent.last_change > file.revisions_fetched AS changed
+    FROM file
+    LEFT JOIN recent ON recent.file_id = file.id
+    LEFT JOIN file_activity AS fa ON fa.file_id = file.id
+    WHERE file.id = ANY(:file_ids);
+    """.format(
+        CURRENT_SCORE.format(":shift")
+    )
+)
+
+SPENT_TODAY = text(
+    "SELECT spent FROM fetch_budget WHERE day = CAST(now() AT TIME ZONE 'utc' AS date);"
+)
+
+SPEND = text(
+    """
+    INSERT INTO fetch_budget (day, spent)
+    VALUES (CAST(now() AT TIME ZONE 'utc' AS date), :n)
+    ON CONFLICT (day) DO UPDATE
+    SET spent = fetch_budget.spent + excluded.spent, updated = now();
+    """
+)
+
+SET_FETCHED = text(
+    "UPDATE file SET revisions_fetched = now() AT TIME ZONE 'utc' "
+    "WHERE id = ANY(:file_ids);"
+)
+
+
+def priorities(inputs: pd.DataFrame) -> pd.Series:
+    """Priority per file id, from the columns of PRIORITY_INPUTS."""
+    value = 1.0 + CHANGE_WEIGHT * inputs["activity"] + USAGE_WEIGHT * inputs["usage"]
+    # never fetched counts as stale as it gets
+    stale = inputs["stale_hours"].fillna(MAX_STALE_HOURS).clip(0, MAX_STALE_HOURS)
+    changed = inputs["changed"].fillna(False).astype(bool)
+    prio = (value * stale).where(changed, 0.0)
+
+    return pd.Series(prio.to_numpy(), index=inputs["file_id"])
+
+
+class RevisionScheduler:
+    """Priority queue of files to fetch revisions of, limited by a budget of calls."""
+
+    def __init__(self, prio: Dict[str, float], budget: int):
+        # heapq is a min-heap
+        self.heap: List[Tuple[float, str]] = [(-p, f) for f, p in prio.items() if p > 0]
+        # no change since their last fetch
+        self.skipped: List[str] = [f for f, p in prio.items() if p <= 0]
+        heapq.heapify(self.heap)
+        self.budget = budget
+        self.spent = 0
+        self._unsaved = 0
+        self._stopped = False
+
+    @staticmethod
+    def _params(file_ids: List[str], now: Optional[datetime]) -> dict:
+        now = now or datetime.utcnow()
+        return {
+            "file_ids": file_ids,
+            "now": now,
+            "halflife_secs": SCORE_HALFLIFE_DAYS * 86_400,
+            "window_start": now - CHANGE_WINDOW,
+            "shift": score_shift(now),
+        }
+
+    @classmethod
+    def _from_rows(
+        cls, rows, file_ids: List[str], spent: int, daily_budget: int
+    ) -> "RevisionScheduler":
+        inputs = pd.DataFrame(
+            rows, columns=["file_id", "activity", "usage", "stale_hours", "changed"]
+        )
+        prio = priorities(inputs)
+        # files not in the db yet were never fetched
+        missing = [f for f in file_ids if f not in prio.index]
+        prio = pd.concat([prio, pd.Series(MAX_STALE_HOURS, index=missing)])
+
+        scheduler = cls(prio.to_dict(), max(daily_budget - spent, 0))
+        logger.info(
+            f"{len(scheduler):,} of {len(file_ids):,} files to fetch, "
+            f"budget {scheduler.budget:,} of {daily_budget:,} calls left today"
+        )
+
+        return scheduler
+
+    @classmethod
+    def from_db(
+        cls,
+        session,
+        file_ids: Iterable[str],
+        daily_budget=REVISION_DAILY_BUDGET,
+        now: Optional[datetime] = None,
+    ) -> "RevisionScheduler":
+        """Rank `file_ids`, with what is left of today's budget."""
+        file_ids = list(dict.fromkeys(file_ids))
+        res = session.execute(PRIORITY_INPUTS, cls._params(file_ids, now))
+        rows = res.fetchall()
+        spent = session.execute(SPENT_TODAY).scalar() or 0
+
+        return cls._from_rows(rows, file_ids, spent, daily_budget)
+
+    @classmethod
+    async def afrom_db(
+        cls,
+        session,
+        file_ids: Iterable[str],
+        daily_budget=REVISION_DAILY_BUDGET,
+        now: Optional[datetime] = None,
+    ) -> "RevisionScheduler":
+        file_ids = list(dict.fromkeys(file_ids))
+        res = await session.execute(PRIORITY_INPUTS, cls._params(file_ids, now))
+        rows = res.fetchall()
+        spent = (await session.execute(SPENT_TODAY)).scalar() or 0
+
+        return cls._from_rows(rows, file_ids, spent, daily_budget)
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def __iter__(self) -> Iterator[str]:
+        """Pop files in priority order, one call of budget each."""
+        while self.heap and not self._stopped:
+            if self.spent >= self.budget:
+                logger.info(
+                    f"daily budget spent, {len(self.heap):,} files left for tomorrow"
+                )
+                return
+            _, file_id = heapq.heappop(self.heap)
+            self.spent += 1
+            self._unsaved += 1
+            yield file_id
+
+    def take(self, n: int) -> List[str]:
+        """Pop up to `n` files, within the budget."""
+        return list(islice(self, n))
+
+    def stop(self) -> None:
+        """Stop before the budget is spent, e.g. when the API reports no quota left."""
+        self._stopped = True
+
+    @property
+    def left_over(self) -> List[str]:
+        return [f for _, f in sorted(self.heap)]
+
+    def commit(self, session, fetched_ids: Iterable[str]) -> None:
+        """Write calls spent and successful fetches since the last commit."""
+        if fetched_ids := list(fetched_ids):
+            session.execute(SET_FETCHED, {"file_ids": fetched_ids})
+        if self._unsaved:
+            session.execute(SPEND, {"n": self._unsaved})
+            self._unsaved = 0
+        session.commit()
+
+
+async def abudget_left(session, daily_budget=REVISION_DAILY_BUDGET) -> int:
+    """revisions.list calls left today, over all workers."""
+    spent = (await session.execute(SPENT_TODAY)).scalar() or 0
+    return max(daily_budget - spent, 0)
+
+
+async def aspend(session, ncall: int, fetched_ids: Iterable[str]) -> None:
+    """Write calls spent and successful fetches, inside the caller's transaction."""
+    if fetched_ids := list(fetched_ids):
+        await session.execute(SET_FETCHED, {"file_ids": fetched_ids})
+    if ncall:
+        await session.execute(SPEND, {"n": ncall})
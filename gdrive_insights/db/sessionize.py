@@ -0,0 +1,292 @@
+"""sessionize.py, detects reading sessions from bursts of revisions.
+
+Reading and highlighting a PDF creates revisions in bursts. Revisions are sorted by
+time and split wherever two revisions are more than SESSION_GAP_MINUTES apart, the
+files revised within one burst form a candidate fileSession (`is_candidate`).
+All of it runs on NumPy arrays, no Python loop over revisions.
+
+Runs incrementally: only revisions after the end of the last closed burst are read,
+and `revision` is partitioned on "modifiedTime", so old partitions are skipped. The
+end of the last closed burst is kept in page_checkpoint, written in the same
+transaction as the sessions. Bursts that ended less than `settle` ago may still grow,
+or receive revisions fetched late, and are left for the next run. Bursts overlapping
+a detected session that was opened, and so promoted by `open_pdfs`, are skipped:
+after a rebuild they would come back as duplicate candidates
+
+Usage:
+    # detect sessions in new revisions
+    python sessionize.py
+    # delete all candidates and detect them again, e.g. after changing the gap
+    python sessionize.py --rebuild
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from gdrive_insights.db.notify import anotify
+from gdrive_insights.settings import PDF_FILETYPE, SESSION_GAP_MINUTES
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_STREAM = "sessionize"
+MIN_FILES = 2
+# bigger bursts are bulk uploads or syncs, not reading sessions
+MAX_FILES = 50
+SETTLE = timedelta(hours=6)
+EPOCH = datetime(1970, 1, 1)
+
+SELECT_REVISIONS = text(
+    """
+    SELECT file_id, "modifiedTime"
+    FROM revision
+    WHERE "modifiedTime" > :after AND "mimeType" = ANY(:mime_types);
+    """
+)
+
+SELECT_CHECKPOINT = text("SELECT token FROM page_checkpoint WHERE stream = :stream;")
+
+UPSERT_CHECKPOINT = text(
+    """
+    INSERT INTO page_checkpoint (stream, token) VALUES (:stream, :token)
+    ON CONFLICT (stream) DO UPDATE SET token = excluded.token, updated = now();
+    """
+)
+
+# detected sessions that were opened, they survive a rebuild
+SELECT_PROMOTED = text(
+    """
+    SELECT started, ended FROM file_session
+    WHERE NOT is_candidate AND started IS NOT NULL AND ended > :after;
+    """
+)
+
+NEXT_SESSION_IDS = text(
+    "SELECT nextval('file_session_id_seq') FROM generate_series(1, :n);"
+)
+
+INSERT_SESSIONS = text(
+    """
+    INSERT INTO file_session (id, name, nused, is_candidate, started, ended)
+    SELECT id, name, 0, true, started, ended
+    FROM unnest(
+        CAST(:ids AS integer[]),
+        CAST(:names AS varchar[]),
+        CAST(:started AS timestamp[]),
+        CAST(:ended AS timestamp[])
+    ) AS s(id, name, started, ended);
+    """
+)
+
+INSERT_MEMBERS = text(
+    """
+    INSERT INTO file_session_association (file_session_id, file_id)
+    SELECT * FROM unnest(CAST(:session_ids AS integer[]), CAST(:file_ids AS varchar[]))
+    ON CONFLICT DO NOTHING;
+    """
+)
+
+DELETE_CANDIDATES = [
+    text(
+        """
+        DELETE FROM file_session_association
+        WHERE file_session_id IN (SELECT id FROM file_session WHERE is_candidate);
+        """
+    ),
+    text("DELETE FROM file_session WHERE is_candidate;"),
+    text("DELETE FROM page_checkpoint WHERE stream = :stream;"),
+]
+
+
+def find_bursts(df: pd.DataFrame, gap: timedelta) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Split revisions into bursts. Return bursts and their distinct files.
+
+    df:         revisions with columns file_id, modifiedTime
+    bursts:     started, ended, nrevision and nfile, indexed by burst number
+    members:    burst, file_id
+    """
+    codes, uniques = pd.factorize(df["file_id"])
+    times = df["modifiedTime"].to_numpy(dtype="datetime64[ns]")
+    order = np.argsort(times, kind="stable")
+    times, codes = times[order], codes[order]
+
+    new = np.ones(len(times), dtype=bool)
+    new[1:] = np.diff(times) > np.timedelta64(gap)
+    starts = np.flatnonzero(new)
+    burst = np.cumsum(new) - 1
+
+    # distinct (burst, file) pairs, sorted by burst
+    keys = np.unique(burst * len(uniques) + codes)
+    member_burst, member_file = np.divmod(keys, len(uniques))
+
+    bursts = pd.DataFrame(
+        {
+            "started": times[starts],
+            "ended": times[np.append(starts[1:], len(times)) - 1],
+            "nrevision": np.diff(np.append(starts, len(times))),
+            "nfile": np.bincount(member_burst, minlength=len(starts)),
+        }
+    )
+    members = pd.DataFrame(
+        {"burst": member_burst, "file_id": np.asarray(uniques)[member_file]}
+    )
+
+    return bursts, members
+
+
+def overlapping(bursts: pd.DataFrame, sessions: pd.DataFrame) -> np.ndarray:
+    """Tell per burst whether it overlaps any of `sessions` in time.
+
+    Both have columns started and ended
+    """
+    if sessions.empty:
+        return np.zeros(len(bursts), dtype=bool)
+
+    order = np.argsort(sessions["started"].to_numpy(dtype="datetime64[ns]"))
+    started = sessions["started"].to_numpy(dtype="datetime64[ns]")[order]
+    # latest end among the sessions started so far
+    ended = np.maximum.accumulate(
+        sessions["ended"].to_numpy(dtype="datetime64[ns]")[order]
+    )
+    # number of sessions started before each burst ended
+    nbefore = np.searchsorted(
+        started, bursts["ended"].to_numpy(dtype="datetime64[ns]"), side="right"
+    )
+    latest_end = ended[np.maximum(nbefore - 1, 0)]
+
+    return (nbefore > 0) & (
+        latest_end >= bursts["started"].to_numpy(dtype="datetime64[ns]")
+    )
+
+
+async def _write_sessions(session, bursts: pd.DataFrame, members: pd.DataFrame) -> int:
+    """Insert bursts as candidate sessions, all in a few statements."""
+    if bursts.empty:
+        return 0
+
+    res = await session.execute(NEXT_SESSION_IDS, {"n": len(bursts)})
+    ids = pd.Series([row[0] for row in res.fetchall()], index=bursts.index)
+    started = bursts["started"].dt.to_pydatetime().tolist()
+    await session.execute(
+        INSERT_SESSIONS,
+        {
+            "ids": ids.tolist(),
+            "names": [f"burst {s:%Y-%m-%d %H:%M}" for s in started],
+            "started": started,
+            "ended": bursts["ended"].dt.to_pydatetime().tolist(),
+        },
+    )
+    members = members[members["burst"].isin(bursts.index)]
+    await session.execute(
+        INSERT_MEMBERS,
+        {
+            "session_ids": ids.loc[members["burst"]].tolist(),
+            "file_ids": members["file_id"].tolist(),
+        },
+    )
+    await anotify(session, ["file_session", "file_session_association"])
+
+    return len(bursts)
+
+
+async def sessionize(
+    async_session,
+    gap=timedelta(minutes=SESSION_GAP_MINUTES),
+    settle=SETTLE,
+    mime_types: Tuple[str, ...] = (PDF_FILETYPE,),
+) -> int:
+    """Write candidate sessions for bursts in new revisions. Return number written."""
+    async with async_session() as session, session.begin():
+        token = (
+            await session.execute(SELECT_CHECKPOINT, {"stream": CHECKPOINT_STREAM})
+        ).scalar_one_or_none()
+        after = EPOCH + timedelta(microseconds=token or 0)
+
+        res = await session.execute(
+            SELECT_REVISIONS, {"after": after, "mime_types": list(mime_types)}
+        )
+        df = pd.DataFrame(res.fetchall(), columns=["file_id", "modifiedTime"])
+        if df.empty:
+            return 0
+
+        bursts, members = find_bursts(df, gap)
+        closed = bursts["ended"] < datetime.utcnow() - max(gap, settle)
+        if not closed.any():
+            return 0
+
+        # bursts are in time order, so the closed ones come first
+        closed_bursts = bursts[closed]
+        res = await session.execute(SELECT_PROMOTED, {"after": after})
+        promoted = pd.DataFrame(res.fetchall(), columns=["started", "ended"])
+        keep = closed_bursts["nfile"].between(MIN_FILES, MAX_FILES) & ~overlapping(
+            closed_bursts, promoted
+        )
+        nsession = await _write_sessions(session, closed_bursts[keep], members)
+
+        last_ended = pd.Timestamp(closed_bursts["ended"].iloc[-1]).to_pydatetime()
+        await session.execute(
+            UPSERT_CHECKPOINT,
+            {
+                "stream": CHECKPOINT_STREAM,
+                "token": (last_ended - EPOCH) // timedelta(microseconds=1),
+            },
+        )
+
+    logger.info(
+        f"{len(df):,} revisions in {len(bursts):,} bursts, {nsession:,} sessions, "
+        f"up to {last_ended}"
+    )
+
+    return nsession
+
+
+async def rebuild(async_session, **kwargs) -> int:
+    """Delete all candidate sessions and detect them again.
+
+    Promoted sessions are kept, bursts overlapping them are not written again
+    """
+    async with async_session() as session, session.begin():
+        for stmt in DELETE_CANDIDATES:
+            await session.execute(stmt, {"stream": CHECKPOINT_STREAM})
+
+    return await sessionize(async_session, **kwargs)
+
+
+if __name__ == "__main__":
+    from gdrive_insights import config as config_dir
+    from rarc_utils.log import LOG_FMT, setup_logger
+    from rarc_utils.sqlalchemy_base import get_async_session, load_config
+
+    logger = setup_logger(
+        cmdLevel=logging.INFO,
+        saveFile=0,
+        savePandas=0,
+        jsonLogger=0,
+        color=1,
+        fmt=LOG_FMT,
+    )
+
+    parser = argparse.ArgumentParser(description="sessionize.py cli parameters")
+    parser.add_argument(
+        "--gap",
+        type=int,
+        default=SESSION_GAP_MINUTES,
+        help="split bursts on revisions more than X minutes apart",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        default=False,
+        help="delete all candidate sessions and detect them again",
+    )
+    args = parser.parse_args()
+
+    psql = load_config(db_name="gdrive", cfg_file="postgres.cfg", config_dir=config_dir)
+    async_session = get_async_session(psql)
+
+    run = rebuild if args.rebuild else sessionize
+    asyncio.run(run(async_session, gap=timedelta(minutes=args.gap)))
@@ -1,65 +1,221 @@
-"""sqlite.py.
+"""sqlite.py, embedded SQLite backend for db.models.
 
-Legacy code. Projects uses PostgreSQL now
-"""
+Set GDRIVE_INSIGHTS_DB_BACKEND=sqlite to run the models on SQLITE_DB_FILE instead of
+postgres, e.g. for single-user installs and CI. Every connection is opened in WAL
+mode, so readers do not block the writer, with synchronous=NORMAL, which is safe
+under WAL and skips an fsync per commit.
+
+Writes are batched: `insert_many` sends rows with executemany in chunks, all inside
+one transaction. SQLite has no materialized views, the views of views.sql are plain
+tables here, rebuilt by `refresh_views`.
+
+Sync sessions only. Modules with postgres specific SQL, like rollups.py, sessionize.py
+and the async helpers, still need postgres
 
+Usage:
+    # create the schema and the views
+    GDRIVE_INSIGHTS_DB_BACKEND=sqlite python models.py --create
+    # rebuild the views
+    python sqlite.py --refresh
+
+    engine = get_sqlite_engine()
+    insert_many(engine, File, rows)
+"""
+import argparse
 import logging
-import sqlite3
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
 
-SQLITE_DB = "data/db.sqlite"
+from gdrive_insights.settings import SQLITE_BATCH_SIZE, SQLITE_DB_FILE
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
 
 logger = logging.getLogger(__name__)
 
-##### sqlite
-con = sqlite3.connect(SQLITE_DB)
-cur = con.cursor()
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA foreign_keys = ON;",
+    # wait for the writer instead of failing with 'database is locked'
+    "PRAGMA busy_timeout = 5000;",
+    "PRAGMA temp_store = MEMORY;",
+    # 64 MiB page cache, 256 MiB memory-mapped reads
+    "PRAGMA cache_size = -65536;",
+    "PRAGMA mmap_size = 268435456;",
+]
 
-# pandas + sqlite can also create default schema, but I do need the unique constraint
-CHANGE_SCHEMA = """
-    shape_id INTEGER PRIMARY KEY,
-    background_color TEXT,
-    foreground_color TEXT,
-    UNIQUE(background_color,foreground_color)
-"""
+# the materialized views of views.sql, in SQLite syntax
+VIEWS: Dict[str, List[str]] = {
+    "last_revised_files": [
+        """
+        CREATE TABLE last_revised_files AS
+        SELECT
+            file.id AS file_id,
+            substr(file.name, 1, 60) AS tr_file_name,
+            revision.id AS rev_id,
+            revision.updated AS rev_updated
+        FROM file
+        LEFT JOIN revision ON file.id = revision.file_id
+        ORDER BY revision.updated ASC
+        LIMIT 100000;
+        """,
+    ],
+    "revisions_by_file": [
+        """
+        CREATE TABLE revisions_by_file AS
+        SELECT
+            file.name AS file_name,
+            file."mimeType" AS file_type,
+            max(revision.updated) AS last_update,
+            count(revision.id) AS nrevision,
+            file.id AS file_id,
+            file.path AS file_path
+        FROM file
+        LEFT JOIN revision ON file.id = revision.file_id
+        GROUP BY file.id
+        ORDER BY nrevision DESC
+        LIMIT 100000;
+        """,
+        "CREATE INDEX ix_revisions_by_file_type ON revisions_by_file (file_type, nrevision DESC);",
+        "CREATE INDEX ix_revisions_by_file_file_id ON revisions_by_file (file_id);",
+    ],
+    "vw_file_sessions": [
+        """
+        CREATE TABLE vw_file_sessions AS
+        SELECT
+            file_session.id AS sid,
+            count(file.id) AS nfile,
+            file_session.nused AS nused,
+            strftime('%Y-%m-%d %H:%M:%S', file_session.updated) AS last_updated,
+            group_concat(substr(file.name, 1, 30), ', ') AS file_name_agg
+        FROM file_session_association AS fsa
+        LEFT JOIN file ON file.id = fsa.file_id
+        LEFT JOIN file_session ON file_session.id = fsa.file_session_id
+        GROUP BY file_session.id
+        ORDER BY last_updated DESC
+        LIMIT 100000;
+        """,
+    ],
+}
 
-REVISION_SCHEMA = """
-    shape_id INTEGER PRIMARY KEY,
-    background_color TEXT,
-    foreground_color TEXT,
-    UNIQUE(background_color,foreground_color)
-"""
+SET_FILE_IS_FORBIDDEN = [
+    text("UPDATE file SET is_forbidden = 1 WHERE id = :file_id;"),
+    text("UPDATE change SET is_forbidden = 1 WHERE file_id = :file_id;"),
+]
+
+
+def _set_pragmas(dbapi_con, connection_record) -> None:
+    cur = dbapi_con.cursor()
+    for pragma in PRAGMAS:
+        cur.execute(pragma)
+    cur.close()
 
-# add_revision_index = "CREATE UNIQUE INDEX ux_id_fileId ON revision(id, fileId);"
-add_revision_index = "CREATE UNIQUE INDEX ux_id ON revision(id);"
-#####
 
+def get_sqlite_engine(path: Path = SQLITE_DB_FILE, echo=False) -> Engine:
+    """Engine on a SQLite file, every connection gets PRAGMAS."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    engine = create_engine(f"sqlite:///{path}", echo=echo)
+    event.listen(engine, "connect", _set_pragmas)
 
-def set_file_is_forbidden(file_id: str) -> None:
-    """Set file.is_forbidden to True.
+    return engine
+
+
+def get_sqlite_session(path: Path = SQLITE_DB_FILE) -> sessionmaker:
+    """Session factory, like rarc_utils' `get_session` for postgres."""
+    return sessionmaker(bind=get_sqlite_engine(path))
+
+
+def create_schema(engine: Engine, metadata) -> None:
+    """Create all tables of `metadata` that do not exist yet, and the views."""
+    metadata.create_all(engine)
+    refresh_views(engine)
+
+
+def refresh_views(engine: Engine, views: Optional[Iterable[str]] = None) -> None:
+    """Rebuild view tables, all of VIEWS by default, in one transaction.
+
+    DDL is transactional in SQLite, readers see the old tables until commit
+    """
+    views = list(views or VIEWS)
+    with engine.begin() as con:
+        for view in views:
+            con.execute(text(f'DROP TABLE IF EXISTS "{view}";'))
+            for stmt in VIEWS[view]:
+                con.execute(text(stmt))
+
+    logger.info(f"refreshed {views}")
+
+
+def insert_many(
+    engine: Engine,
+    table,
+    rows: Iterable[dict],
+    batch_size=SQLITE_BATCH_SIZE,
+    replace=False,
+) -> int:
+    """Insert rows in batches inside one transaction, return number of rows sent.
+
+    table:      model or Table
+    replace:    overwrite rows with the same key, instead of skipping them
+    """
+    table = getattr(table, "__table__", table)
+    stmt = insert(table)
+    if replace:
+        stmt = stmt.prefix_with("OR REPLACE")
+    else:
+        stmt = stmt.on_conflict_do_nothing()
+
+    it = iter(rows)
+    nrow = 0
+    with engine.begin() as con:
+        while batch := list(islice(it, batch_size)):
+            con.execute(stmt, batch)
+            nrow += len(batch)
+
+    logger.debug(f"sent {nrow:,} rows to {table.name}")
+
+    return nrow
+
+
+def set_file_is_forbidden(engine: Engine, file_id: str) -> None:
+    """Set is_forbidden of a file and its changes.
 
     Some files cannot be fetched from Google Drive API.
-    Todo:
-        - fix that
     """
-    try:
-        q = "ALTER TABLE change \
-         ADD COLUMN is_forbidden; \
-         "
-        cur.execute(q)
-
-        q = "UPDATE change \
-         SET is_forbidden=0; \
-         "
-        cur.execute(q)
-        logger.info("added col `is_forbidden`")
-
-    except Exception as e:
-        pass
-
-    q = "UPDATE change  \
-    SET is_forbidden='t' \
-    WHERE file_id='{}';".format(
-        file_id
+    with engine.begin() as con:
+        for stmt in SET_FILE_IS_FORBIDDEN:
+            con.execute(stmt, {"file_id": file_id})
+
+
+if __name__ == "__main__":
+    from rarc_utils.log import LOG_FMT, setup_logger
+
+    logger = setup_logger(
+        cmdLevel=logging.INFO,
+        saveFile=0,
+        savePandas=0,
+        jsonLogger=0,
+        color=1,
+        fmt=LOG_FMT,
+    )
+
+    parser = argparse.ArgumentParser(description="sqlite.py cli parameters")
+    parser.add_argument(
+        "--refresh",
+        nargs="*",
+        default=None,
+        help=f"rebuild views, of {list(VIEWS)}, all by default",
+    )
+    parser.add_argument(
+        "--file",
+        type=Path,
+        default=SQLITE_DB_FILE,
+        help="SQLite database file",
     )
+    args = parser.parse_args()
 
-    cur.execute(q)
+    if args.refresh is not None:
+        refresh_views(get_sqlite_engine(args.file), args.refresh)
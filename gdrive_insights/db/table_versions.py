@@ -0,0 +1,59 @@
+"""table_versions.py, change counters per table.
+
+Pushes bump the counter of every table they write to (see `notify.anotify`).
+Readers compare counters to find out whether their cached results are stale,
+with one primary key lookup. `updated` is stored as UTC, without time zone
+"""
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+BUMP_VERSION = text(
+    """
+    INSERT INTO table_version (name, version, updated)
+    VALUES (:name, 1, now() AT TIME ZONE 'utc')
+    ON CONFLICT (name) DO UPDATE
+    SET version = table_version.version + 1, updated = now() AT TIME ZONE 'utc';
+    """
+)
+
+SELECT_VERSIONS = text("SELECT name, version FROM table_version;")
+SELECT_VERSIONS_UPDATED = text("SELECT name, version, updated FROM table_version;")
+
+# readers share one lookup for this many seconds
+VERSIONS_TTL = 2.0
+
+_versions: Dict[str, int] = {}
+_versions_fetched: float = 0.0
+_aversions: Dict[str, Tuple[int, Optional[datetime]]] = {}
+_aversions_fetched: float = 0.0
+
+
+def get_table_versions(engine, max_age=VERSIONS_TTL) -> Dict[str, int]:
+    """Get counters of all tables, at most `max_age` seconds old."""
+    global _versions, _versions_fetched
+    if time.monotonic() - _versions_fetched > max_age:
+        with engine.connect() as conn:
+            _versions = dict(conn.execute(SELECT_VERSIONS).fetchall())
+        _versions_fetched = time.monotonic()
+
+    return _versions
+
+
+async def aget_table_versions(
+    async_session, max_age=VERSIONS_TTL
+) -> Dict[str, Tuple[int, Optional[datetime]]]:
+    """Get counter and time of the last bump of all tables, at most `max_age` old."""
+    global _aversions, _aversions_fetched
+    if time.monotonic() - _aversions_fetched > max_age:
+        async with async_session() as session:
+            res = await session.execute(SELECT_VERSIONS_UPDATED)
+            _aversions = {name: (version, updated) for name, version, updated in res}
+        _aversions_fetched = time.monotonic()
+
+    return _aversions
@@ -31,6 +31,8 @@ ORDER BY
     nrevision DESC
 LIMIT
     100000 WITH DATA;
+CREATE INDEX ix_revisions_by_file_type ON revisions_by_file (file_type, nrevision DESC);
+CREATE INDEX ix_revisions_by_file_file_id ON revisions_by_file (file_id);
 
 DROP MATERIALIZED VIEW vw_file_sessions;
 CREATE MATERIALIZED VIEW vw_file_sessions AS
@@ -37,6 +37,7 @@ import psycopg2  # type: ignore[import]
 from gdrive_insights import config as config_dir
 from gdrive_insights.args import ArgParser
 from gdrive_insights.data_methods import data_methods as dm
+from gdrive_insights.db.instrument import instrument_from_env
 from gdrive_insights.db.methods import methods as db_methods
 from gdrive_insights.db.models import psql
 from gdrive_insights.settings import CHANGES_FILE, FILES_FILE, REVISIONS_FILE
@@ -63,6 +64,7 @@ FILE_ID = "id"
 con = psycopg2.connect(
     database=psql.db, user=psql.user, password=psql.passwd, host=psql.host, port="5432"
 )
+instrument_from_env(con, async_session, psession)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,191 @@
+"""duck_methods.py, analytics over the local data files with DuckDB.
+
+The analysis methods of data_methods, as DuckDB SQL over the Arrow exports in
+ARROW_DIR (see db/arrow_export.py), or over the feather files saved by
+display_changes.py for tables without an export. Files are scanned lazily as pyarrow
+datasets, so a query only reads the columns it needs. DuckDB runs on all cores and
+spills to DUCKDB_TMP_DIR beyond `memory_limit`.
+
+Needs no database connection: unlike data_methods, importing this module does not
+connect to postgres or Google Drive
+
+Usage:
+    con = duck_methods.connect()
+    duck_methods.revisions_data_analysis(con).tail(25)
+    duck_methods.filter_files(con, keep=10)
+    duck_methods.rollup(con, granularity="week", by="mime_type")
+"""
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+import duckdb  # type: ignore[import]
+import pandas as pd
+import pyarrow.dataset as ds  # type: ignore[import]
+
+from .settings import (ARROW_DIR, ARROW_SFX, CHANGES_FILE, DUCKDB_TMP_DIR,
+                       FILES_FILE, GOOGLE_DOCUMENT_FILETYPE, PDF_FILETYPE,
+                       REVISIONS_FILE, UNNAMED)
+
+logger = logging.getLogger(__name__)
+
+# table -> feather file used when there is no Arrow export
+FEATHER_FILES: Dict[str, Path] = {
+    "file": FILES_FILE,
+    "change": CHANGES_FILE,
+    "revision": REVISIONS_FILE,
+}
+
+REVISIONS_DATA_ANALYSIS = """
+    WITH gb AS (
+        SELECT file_id, count(*) AS count,
+            min("modifiedTime") AS first_modified,
+            max("modifiedTime") AS last_modified
+        FROM revision
+        GROUP BY file_id
+    )
+    SELECT gb.*, gb.last_modified - gb.first_modified AS last_min_first,
+        file.id, file.name, file."mimeType"
+    FROM gb
+    LEFT JOIN file ON file.id = gb.file_id
+    ORDER BY gb.count;
+"""
+
+GOOGLE_DOCUMENTS = """
+    SELECT * FROM file WHERE "mimeType" = $mime_type AND name <> $unnamed;
+"""
+
+PDF_FILES = """
+    SELECT * FROM file WHERE "mimeType" = $mime_type;
+"""
+
+ROLLUP_BY_FILE = """
+    SELECT date_trunc($granularity, "modifiedTime") AS bucket, file_id,
+        count(*) AS nrevision
+    FROM revision
+    WHERE "modifiedTime" >= $start AND "modifiedTime" < $end
+    GROUP BY ALL
+    ORDER BY bucket, nrevision DESC;
+"""
+
+ROLLUP_BY_MIME_TYPE = """
+    SELECT date_trunc($granularity, r."modifiedTime") AS bucket,
+        coalesce(file."mimeType", '') AS mime_type,
+        count(*) AS nrevision, count(DISTINCT r.file_id) AS nfile
+    FROM revision AS r
+    LEFT JOIN file ON file.id = r.file_id
+    WHERE r."modifiedTime" >= $start AND r."modifiedTime" < $end
+    GROUP BY ALL
+    ORDER BY bucket, mime_type;
+"""
+
+
+def _source(table: str, data_dir: Path) -> Optional[Path]:
+    export = (data_dir / table).with_suffix(ARROW_SFX)
+    if export.exists():
+        return export
+    if FEATHER_FILES[table].exists():
+        return FEATHER_FILES[table]
+
+    return None
+
+
+class duck_methods:
+    """Implements the analysis of data_methods in DuckDB, over local files."""
+
+    @staticmethod
+    def connect(
+        data_dir: Path = ARROW_DIR,
+        threads: Optional[int] = None,
+        memory_limit: Optional[str] = None,
+    ) -> duckdb.DuckDBPyConnection:
+        """Open an in-memory DuckDB with a view per local table.
+
+        threads:        defaults to the number of cores
+        memory_limit:   e.g. '4GB', defaults to 80% of RAM, beyond it DuckDB spills
+        """
+        con = duckdb.connect()
+        DUCKDB_TMP_DIR.mkdir(parents=True, exist_ok=True)
+        con.execute(f"SET temp_directory = '{DUCKDB_TMP_DIR}';")
+        if threads is not None:
+            con.execute(f"SET threads = {int(threads)};")
+        if memory_limit is not None:
+            con.execute("SET memory_limit = $limit;", {"limit": memory_limit})
+
+        for table in FEATHER_FILES:
+            if (path := _source(table, Path(data_dir))) is None:
+                logger.warning(f"no local data for {table}, export it first")
+                continue
+
+            # feather v2 is the Arrow IPC file format
+            dataset = ds.dataset(str(path), format="ipc")
+            con.register(f"{table}_src", dataset)
+            # revisions saved from the API name the file id fileId
+            extra = (
+                ', "fileId" AS file_id'
+                if "fileId" in dataset.schema.names
+                and "file_id" not in dataset.schema.names
+                else ""
+            )
+            con.execute(
+                f'CREATE OR REPLACE VIEW "{table}" AS SELECT *{extra} FROM {table}_src;'
+            )
+            logger.debug(f"{table=} {path=}")
+
+        return con
+
+    @staticmethod
+    def sql(con, query: str, **params) -> pd.DataFrame:
+        """Run a query and return the result as a dataframe."""
+        return con.execute(query, params or None).df()
+
+    @classmethod
+    def revisions_data_analysis(cls, con) -> pd.DataFrame:
+        """Revisions per file, with first and last modified time, least revised first."""
+        return cls.sql(con, REVISIONS_DATA_ANALYSIS)
+
+    @classmethod
+    def filter_google_documents(cls, con, keep: Optional[int] = None) -> pd.DataFrame:
+        """Google documents that have a name."""
+        view = cls.sql(
+            con, GOOGLE_DOCUMENTS, mime_type=GOOGLE_DOCUMENT_FILETYPE, unnamed=UNNAMED
+        )
+        return view if keep is None else view.tail(keep)
+
+    @classmethod
+    def filter_pdf_files(cls, con, keep: Optional[int] = None) -> pd.DataFrame:
+        view = cls.sql(con, PDF_FILES, mime_type=PDF_FILETYPE)
+        return view if keep is None else view.tail(keep)
+
+    @classmethod
+    def filter_files(cls, con, keep: Optional[int] = None) -> pd.DataFrame:
+        """Filter files on google documents and pdf type."""
+        view = pd.concat(
+            [cls.filter_google_documents(con), cls.filter_pdf_files(con)],
+            ignore_index=True,
+        )
+        return view if keep is None else view.tail(keep)
+
+    @classmethod
+    def rollup(
+        cls,
+        con,
+        granularity="day",
+        by="file",
+        start: datetime = datetime(1970, 1, 1),
+        end: datetime = datetime(9999, 1, 1),
+    ) -> pd.DataFrame:
+        """Revisions per bucket, like the rollup tables, computed from local files.
+
+        granularity     any date_trunc part: hour, day, week, month, ..
+        by              'file' or 'mime_type'
+        """
+        if by == "file":
+            query = ROLLUP_BY_FILE
+        elif by == "mime_type":
+            query = ROLLUP_BY_MIME_TYPE
+        else:
+            raise ValueError(f"cannot roll up {by=}")
+
+        return cls.sql(con, query, granularity=granularity, start=start, end=end)
@@ -1,25 +1,44 @@
 """fetch_new_files.py.
 
 fetch new files in google drive
-uses pageToken saved in db, and starts fetching from lastPageToken[-1] till latest new item
+uses the page_checkpoint saved in db, and starts fetching from there till latest new item.
+files, changes and the next page token are committed together per batch of pages,
+so a restart resumes exactly where the last run stopped
 
 Usage:
     ipy fetch_new_files.py -i -- -t 2080713
-    # or without -t, uses second last page_token from db
+    # or without -t, resumes from page_checkpoint in db
     ipy fetch_new_files.py
+    # fetch all accounts and shared drives in config/accounts.cfg in parallel
+    ipy fetch_new_files.py -i -- --accounts
+    # also fetch revisions and paths of changed files every cycle, instead of running worker.py
+    ipy fetch_new_files.py -i -- --revisions
 """
 
 import argparse
 import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from time import sleep
+from typing import List, Optional
 
+import pandas as pd
 import psycopg2  # type: ignore[import]
 from gdrive_insights import config as config_dir
+from gdrive_insights.core.accounts import Account, RateLimiter, load_accounts
+from gdrive_insights.core.metrics import CHANGE_LAG, serve_metrics, start_metrics_dumper
+from gdrive_insights.core.utils import create_gdrive
 from gdrive_insights.data_methods import data_methods as dm
-from gdrive_insights.db.helpers import get_page_tokens
+from gdrive_insights.db import instrument
+from gdrive_insights.db.async_helpers import aget_checkpoint
+from gdrive_insights.db.helpers import CHANGE_STREAM, get_checkpoint, get_page_tokens
 from gdrive_insights.db.methods import methods as db_methods
 from gdrive_insights.db.models import psql
+from gdrive_insights.db.partitions import ensure_partitions
+from gdrive_insights.db.projection import project
+from gdrive_insights.worker import drain_jobs
+from gdrive_insights.settings import ACCOUNTS_CFG_FILE, METRICS_FILE
 from rarc_utils.log import LOG_FMT, setup_logger
 from rarc_utils.sqlalchemy_base import get_async_session, load_config
 
@@ -34,6 +53,7 @@ async_session = get_async_session(psql)
 con = psycopg2.connect(
     database=psql.db, user=psql.user, password=psql.passwd, host=psql.host, port="5432"
 )
+instrument.instrument_from_env(con, async_session)
 
 parser = argparse.ArgumentParser(description="fetch_new_files.py cli parameters")
 parser.add_argument(
@@ -50,36 +70,184 @@ parser.add_argument(
     default=None,
     help="run every X hours",
 )
+parser.add_argument(
+    "--metrics_port",
+    type=int,
+    default=None,
+    help="serve Prometheus metrics on this port",
+)
+parser.add_argument(
+    "--metrics_file",
+    nargs="?",
+    const=str(METRICS_FILE),
+    default=None,
+    help=f"dump Prometheus metrics to file every minute (default: {METRICS_FILE})",
+)
+parser.add_argument(
+    "--revisions",
+    action="store_true",
+    default=False,
+    help="fetch revisions and paths of changed files after every cycle",
+)
+parser.add_argument(
+    "--accounts",
+    nargs="?",
+    const=str(ACCOUNTS_CFG_FILE),
+    default=None,
+    help=f"run one worker per account or shared drive in file \
+    (default: {ACCOUNTS_CFG_FILE})",
+)
 
 
-def fetch_new_files(args):
-    """Fetch new files from gdrive API."""
-    start_page_token: str = (
-        args.start_page_token or get_page_tokens(con, n=2).iloc[0].val_int
+def get_start_page_token(args, stream=CHANGE_STREAM) -> str:
+    """Get token to start from: cli argument, checkpoint, or legacy page_token table."""
+    start_page_token = (
+        args.start_page_token
+        or get_checkpoint(stream)
+        or get_page_tokens(con, n=2).iloc[0].val_int
+    )
+
+    return str(start_page_token)
+
+
+def checkpoint_batch(changes, next_token, stream=CHANGE_STREAM) -> None:
+    """Push files and changes of a batch of pages together with the next token."""
+    df = dm.changes_to_pandas(changes)
+    nchange = loop.run_until_complete(
+        db_methods.push_change_batch(
+            df, async_session, stream=stream, token=int(next_token)
+        )
     )
-    start_page_token = str(start_page_token)
+    logger.info(f"pushed {nchange:,} new changes, checkpoint at {next_token}")
+
+
+def fetch_new_files(args) -> pd.DataFrame:
+    """Fetch new files from gdrive API."""
+    start_page_token = get_start_page_token(args)
 
-    changes = dm.fetch_changes(saved_start_page_token=start_page_token)
+    changes = dm.fetch_changes(
+        saved_start_page_token=start_page_token, on_batch=checkpoint_batch
+    )
     df = dm.changes_to_pandas(changes)
+    set_change_lag(df)
+
+    return df
+
+
+def set_change_lag(df: pd.DataFrame) -> None:
+    if not df.empty:
+        newest = pd.to_datetime(df["time"]).max().tz_localize(None)
+        CHANGE_LAG.set((datetime.utcnow() - newest).total_seconds())
+
+
+def fetch_account(
+    account: Account, start_page_token: Optional[str], main_loop
+) -> pd.DataFrame:
+    """Fetch changes of one account or shared drive, runs in a worker thread.
 
-    res_files = loop.run_until_complete(db_methods.push_files(df, async_session))
+    Every worker has its own credentials, checkpoint stream and rate limiter.
+    Batches are pushed on the main event loop, sharing its connection pool
+    """
+    drive = create_gdrive(account.storage_json, account.client_id_json)
+    limiter = RateLimiter(account.qps)
+    if start_page_token is None:
+        limiter.acquire()
+        start_page_token = dm.fetch_start_page_token(drive, account.drive_id)
+        logger.info(f"{account.name}: no checkpoint, starting at {start_page_token}")
 
-    return res_files
+    def on_batch(changes, next_token):
+        df = dm.changes_to_pandas(changes)
+        coro = db_methods.push_change_batch(
+            df, async_session, stream=account.stream, token=int(next_token)
+        )
+        # wait for the push, so a slow db slows down fetching instead of buffering
+        nchange = asyncio.run_coroutine_threadsafe(coro, main_loop).result()
+        logger.info(f"{account.name}: pushed {nchange:,} new changes")
+
+    changes = dm.fetch_changes(
+        saved_start_page_token=start_page_token,
+        on_batch=on_batch,
+        drive=drive,
+        drive_id=account.drive_id,
+        limiter=limiter,
+        stream=account.stream,
+    )
+
+    return dm.changes_to_pandas(changes)
+
+
+async def fetch_accounts(accounts: List[Account]) -> pd.DataFrame:
+    """Fetch all accounts in parallel, one worker thread per account."""
+    main_loop = asyncio.get_running_loop()
+    checkpoints = await asyncio.gather(
+        *(aget_checkpoint(async_session, a.stream) for a in accounts)
+    )
+    tokens = {a.name: token for a, token in zip(accounts, checkpoints)}
+
+    with ThreadPoolExecutor(max_workers=len(accounts)) as pool:
+        results = await asyncio.gather(
+            *(
+                main_loop.run_in_executor(
+                    pool,
+                    fetch_account,
+                    account,
+                    None if tokens[account.name] is None else str(tokens[account.name]),
+                    main_loop,
+                )
+                for account in accounts
+            ),
+            return_exceptions=True,
+        )
+
+    dfs = []
+    for account, res in zip(accounts, results):
+        if isinstance(res, Exception):
+            logger.error(f"{account.name}: worker failed: {res!r}")
+            continue
+        logger.info(f"{account.name}: fetched {len(res):,} changes")
+        dfs.append(res)
+
+    df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+    set_change_lag(df)
+
+    return df
 
 
 def main(args):
     """Run main app."""
+    if args.metrics_port is not None:
+        serve_metrics(args.metrics_port)
+    if args.metrics_file is not None:
+        start_metrics_dumper(args.metrics_file)
+
+    accounts = load_accounts(args.accounts) if args.accounts is not None else []
+    logger.info(f"accounts: {[a.name for a in accounts]}")
+
     while True:
-        res_files = fetch_new_files(args)
+        ensure_partitions(con)
+        if accounts:
+            changes_df = loop.run_until_complete(fetch_accounts(accounts))
+        else:
+            changes_df = fetch_new_files(args)
+        # next cycles resume from the checkpoint
+        args.start_page_token = None
+
+        # renames, moves and removals of the new changes
+        loop.run_until_complete(project(async_session))
+
+        # changed files are queued in the job table, usually for worker.py
+        if args.revisions:
+            ndone = loop.run_until_complete(drain_jobs(async_session))
+            logger.info(f"{ndone=}")
 
-        # TODO: fetch revisions ??
+        instrument.report()
 
         if args.interval is not None:
             sleep_secs = args.interval * 3600
             logger.info(f"sleeping for {sleep_secs:,} seconds / {args.interval} hours")
             sleep(sleep_secs)
         else:
-            return res_files
+            return changes_df
 
 
 if __name__ == "__main__":
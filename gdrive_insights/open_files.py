@@ -7,6 +7,8 @@ Usage:
     cd ~/repos/gdrive-insights/gdrive_insights
     ipy open_files.py -i -- -m session
     ipy open_files.py -i -- -m manual
+    # also open 3 files usually opened with the selected ones, see suggest.py
+    ipy open_files.py -i -- -m manual -s 3
     ipy open_files.py -i -- -m add_file
 """
 import argparse
@@ -15,13 +17,17 @@ import sys
 from enum import Enum
 from typing import Optional
 
+import pandas as pd
 import psycopg2  # type: ignore[import]
 from gdrive_insights import config as config_dir
+from gdrive_insights.core.co_usage import CoUsage
 from gdrive_insights.db.helpers import (add_file_to_session,
                                         get_file_ids_of_session, get_pdfs,
                                         get_pdfs_manual, get_session_by_input,
                                         open_pdfs)
+from gdrive_insights.db.instrument import instrument_from_env
 from gdrive_insights.db.models import fileSession
+from gdrive_insights.settings import MOUNT_DIR
 from rarc_utils.log import setup_logger
 from rarc_utils.sqlalchemy_base import load_config
 
@@ -34,6 +40,7 @@ logger = setup_logger(
 con = psycopg2.connect(
     database=psql.db, user=psql.user, password=psql.passwd, host=psql.host, port="5432"
 )
+instrument_from_env(con)
 
 
 class programMode(Enum):
@@ -60,6 +67,13 @@ CLI.add_argument(
     default=0,
     help="open max n files",
 )
+CLI.add_argument(
+    "-s",
+    "--suggest",
+    type=int,
+    default=0,
+    help="add X files usually opened with the selected files to the new session",
+)
 CLI.add_argument(
     "-d",
     "--dryrun",
@@ -86,6 +100,14 @@ if __name__ == "__main__":
     with con:
         if mode == programMode.MANUAL:
             pdfs = get_pdfs_manual(con, n=25)
+            if args.suggest > 0:
+                co = CoUsage.load()
+                suggested = co.suggest(pdfs.file_id.tolist(), n=args.suggest)
+                if suggested:
+                    extra = get_pdfs(con, file_ids=[f for f, _ in suggested])
+                    extra = extra.dropna(subset=["file_path"])
+                    print(f"adding suggested files:\n{extra.file_name.to_string()}")
+                    pdfs = pd.concat([pdfs, extra], ignore_index=True)
 
         elif mode == programMode.SESSION:
             fs = get_session_by_input(n=20)
@@ -103,4 +125,4 @@ if __name__ == "__main__":
         else:
             raise Exception(f"Invalid programMode: {msg}")
 
-    open_pdfs(pdfs, fs=fs, pfx="/home/paul/gdrive", ctxmgr=False)
+    open_pdfs(pdfs, fs=fs, pfx=MOUNT_DIR, ctxmgr=False)
@@ -0,0 +1,122 @@
+"""prefetch.py.
+
+copy frequently opened PDFs from the rclone mount to a local cache
+takes the files of recently used sessions first, then the most revised PDFs, and keeps
+them in PDF_CACHE_DIR within PDF_CACHE_BUDGET. open_pdfs opens cached copies when present
+
+Usage:
+    ipy prefetch.py
+    # keep prefetching every 30 minutes
+    ipy prefetch.py -i -- --interval 30
+"""
+
+import argparse
+import logging
+from pathlib import Path
+from time import sleep
+from typing import List, Tuple
+
+import pandas as pd
+import psycopg2  # type: ignore[import]
+from gdrive_insights import config as config_dir
+from gdrive_insights.core.pdf_cache import PdfCache
+from gdrive_insights.db.helpers import get_pdfs
+from gdrive_insights.db.instrument import instrument_from_env
+from gdrive_insights.settings import MOUNT_DIR, PDF_CACHE_BUDGET, PDF_FILETYPE
+from rarc_utils.log import LOG_FMT, setup_logger
+from rarc_utils.sqlalchemy_base import load_config
+
+logger = logging.getLogger(__name__)
+
+RECENT_SESSION_FILES = """
+    SELECT file.id AS file_id, file.path AS file_path
+    FROM file_session AS fs
+    JOIN file_session_association AS fsa ON fsa.file_session_id = fs.id
+    JOIN file ON file.id = fsa.file_id
+    WHERE fs.id IN (SELECT id FROM file_session ORDER BY updated DESC LIMIT %(n)s)
+        AND file."mimeType" = %(file_type)s
+        AND file.path IS NOT NULL
+    ORDER BY fs.updated DESC;
+"""
+
+
+def get_candidates(con, nsession=5, ntop=25, mount=MOUNT_DIR) -> List[Tuple[str, Path]]:
+    """Get (file_id, path on mount) of files to prefetch, most important first."""
+    sessions = pd.read_sql(
+        RECENT_SESSION_FILES, con, params={"n": nsession, "file_type": PDF_FILETYPE}
+    )
+    top = get_pdfs(con, n=ntop)[["file_id", "file_path"]]
+    df = (
+        pd.concat([sessions, top], ignore_index=True)
+        .dropna(subset=["file_path"])
+        .drop_duplicates("file_id")
+    )
+
+    return [(fid, Path(mount + path)) for fid, path in zip(df.file_id, df.file_path)]
+
+
+parser = argparse.ArgumentParser(description="prefetch.py cli parameters")
+parser.add_argument(
+    "--sessions",
+    type=int,
+    default=5,
+    help="prefetch files of the X most recently used sessions",
+)
+parser.add_argument(
+    "--top",
+    type=int,
+    default=25,
+    help="prefetch the X most revised PDFs",
+)
+parser.add_argument(
+    "--budget",
+    type=int,
+    default=PDF_CACHE_BUDGET // 2**20,
+    help="size of the cache in MB",
+)
+parser.add_argument(
+    "--interval",
+    type=int,
+    default=None,
+    help="run every X minutes",
+)
+
+
+def main(args):
+    """Run main app."""
+    psql = load_config(db_name="gdrive", cfg_file="postgres.cfg", config_dir=config_dir)
+    con = psycopg2.connect(
+        database=psql.db,
+        user=psql.user,
+        password=psql.passwd,
+        host=psql.host,
+        port="5432",
+    )
+    instrument_from_env(con)
+    cache = PdfCache(budget=args.budget * 2**20)
+
+    while True:
+        files = get_candidates(con, nsession=args.sessions, ntop=args.top)
+        cached = cache.prefetch(files)
+        logger.info(
+            f"{len(cached):,} of {len(files):,} files cached, "
+            f"{cache.size() / 2**20:,.1f} MB in {cache.cache_dir}"
+        )
+
+        if args.interval is None:
+            return cached
+        sleep(args.interval * 60)
+
+
+if __name__ == "__main__":
+    logger = setup_logger(
+        cmdLevel=logging.INFO,
+        saveFile=0,
+        savePandas=0,
+        jsonLogger=0,
+        color=1,
+        fmt=LOG_FMT,
+    )
+    cli_args = parser.parse_args()
+
+    main(cli_args)
@@ -0,0 +1,147 @@
+"""resolve_paths.py.
+
+fill File.path from an index of the rclone mount, instead of calling the API
+the mount is indexed once, later runs only list directories whose modification time
+changed. Files are matched on (name, size), and on modified time when names repeat.
+Only ambiguous matches fall back to `construct_file_path`, which costs an API call per
+parent folder
+
+Usage:
+    ipy resolve_paths.py
+    # rebuild the index from scratch, and resolve at most 100 ambiguous files via the API
+    ipy resolve_paths.py -i -- --full --max_api 100
+"""
+
+import argparse
+import logging
+from typing import Dict, Optional
+
+import pandas as pd
+import psycopg2  # type: ignore[import]
+from gdrive_insights import config as config_dir
+from gdrive_insights.core.mount_index import MountIndex
+from gdrive_insights.core.utils import create_gdrive
+from gdrive_insights.db.helpers import construct_file_path, update_file_paths
+from gdrive_insights.db.instrument import instrument_from_env
+from gdrive_insights.db.jobs import PATH, cancel_jobs
+from gdrive_insights.settings import MOUNT_DIR, MOUNT_INDEX_FILE
+from googleapiclient import discovery  # type: ignore[import]
+from rarc_utils.log import LOG_FMT, setup_logger
+from rarc_utils.sqlalchemy_base import load_config
+
+logger = logging.getLogger(__name__)
+
+MISSING_PATHS = """
+    SELECT id, name, size, "modifiedTime" FROM file
+    WHERE path IS NULL AND size IS NOT NULL AND NOT is_forbidden;
+"""
+
+
+def resolve_paths(
+    df: pd.DataFrame,
+    index: MountIndex,
+    max_api=0,
+    drive: Optional[discovery.Resource] = None,
+) -> pd.DataFrame:
+    """Find paths of files in the index. Return dataframe with `id`, `path`, `how`.
+
+    `drive` is created on the first API fallback, when not passed
+    """
+    paths: Dict[str, str] = {}
+    how: Dict[str, str] = {}
+    nmissing, nambiguous = 0, 0
+    for row in df.itertuples(index=False):
+        modified = None if pd.isna(row.modifiedTime) else row.modifiedTime
+        path, nmatch = index.lookup(row.name, int(row.size), modified)
+        if path is not None:
+            paths[row.id], how[row.id] = path, "index"
+        elif nmatch == 0:
+            nmissing += 1
+        else:
+            nambiguous += 1
+            if nambiguous <= max_api:
+                if drive is None:
+                    drive = create_gdrive()
+                paths[row.id] = construct_file_path(
+                    row.id, drive=drive, fileName=row.name
+                )
+                how[row.id] = "api"
+
+    logger.info(
+        f"{len(paths):,} of {len(df):,} paths resolved, "
+        f"{nmissing=:,} {nambiguous=:,} (API fallback for {min(nambiguous, max_api):,})"
+    )
+    res = pd.DataFrame({"id": list(paths), "path": list(paths.values())})
+    res["how"] = res["id"].map(how)
+
+    return res
+
+
+parser = argparse.ArgumentParser(description="resolve_paths.py cli parameters")
+parser.add_argument(
+    "--mount",
+    type=str,
+    default=MOUNT_DIR,
+    help="rclone mount of Google Drive",
+)
+parser.add_argument(
+    "--full",
+    action="store_true",
+    default=False,
+    help="list every directory, not only those that changed",
+)
+parser.add_argument(
+    "--max_api",
+    type=int,
+    default=0,
+    help="resolve at most X ambiguous files through the Drive API",
+)
+parser.add_argument(
+    "-d",
+    "--dryrun",
+    action="store_true",
+    default=False,
+    help="resolve paths, but do not update db",
+)
+
+
+def main(args):
+    """Run main app."""
+    psql = load_config(db_name="gdrive", cfg_file="postgres.cfg", config_dir=config_dir)
+    con = psycopg2.connect(
+        database=psql.db,
+        user=psql.user,
+        password=psql.passwd,
+        host=psql.host,
+        port="5432",
+    )
+    instrument_from_env(con)
+
+    index = MountIndex(MOUNT_INDEX_FILE)
+    index.scan(args.mount, full=args.full)
+    logger.info(f"{len(index):,} files on {args.mount}")
+
+    df = pd.read_sql(MISSING_PATHS, con)
+    res = resolve_paths(df, index, max_api=args.max_api)
+    if args.dryrun or res.empty:
+        return res
+
+    update_file_paths(res[["id", "path"]])
+    ncancel = cancel_jobs(con, PATH, res["id"].tolist())
+    logger.info(f"cancelled {ncancel:,} path jobs")
+
+    return res
+
+
+if __name__ == "__main__":
+    logger = setup_logger(
+        cmdLevel=logging.INFO,
+        saveFile=0,
+        savePandas=0,
+        jsonLogger=0,
+        color=1,
+        fmt=LOG_FMT,
+    )
+    cli_args = parser.parse_args()
+
+    main(cli_args)
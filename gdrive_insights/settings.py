@@ -1,11 +1,13 @@
 """settings.py, general settings for gdrive-insights."""
 
 import os
+from datetime import datetime
 from pathlib import Path
 
 REPO_PATH = os.environ.get("GDRIVE_INSIGHTS_REPO", "/home/paul/repos/gdrive-insights")
 
 FEATHER_SFX = ".feather"
+ARROW_SFX = ".arrow"
 JSON_SFX = ".json"
 
 REPO_DIR = Path(REPO_PATH) / "gdrive_insights"
@@ -16,8 +18,63 @@ FILES_FILE = (DATA_DIR / "files").with_suffix(FEATHER_SFX)
 REVISIONS_FILE = (DATA_DIR / "revisions").with_suffix(FEATHER_SFX)
 BOOK_FILE = (DATA_DIR / "df_book").with_suffix(FEATHER_SFX)
 
+METRICS_FILE = (DATA_DIR / "metrics").with_suffix(".prom")
+
+# port of the read api, see api.py
+API_PORT = int(os.environ.get("GDRIVE_INSIGHTS_API_PORT", 8050))
+
 STORAGE_JSON_FILE = (REPO_DIR / "storage").with_suffix(JSON_SFX)
 CLIENT_ID_JSON_FILE = (REPO_DIR / "client_id").with_suffix(JSON_SFX)
 
+# one section per account or shared drive to ingest, see README
+ACCOUNTS_CFG_FILE = REPO_DIR / "config" / "accounts.cfg"
+
+# rclone mount of Google Drive, see README
+MOUNT_DIR = os.environ.get("GDRIVE_INSIGHTS_MOUNT", "/home/paul/gdrive")
+
+# local copies of frequently opened PDFs, see prefetch.py
+PDF_CACHE_DIR = DATA_DIR / "pdf_cache"
+PDF_CACHE_BUDGET = int(os.environ.get("GDRIVE_INSIGHTS_PDF_CACHE_MB", 5_000)) * 2**20
+
+# "postgres", or "sqlite" to run db.models on an embedded file, see db/sqlite.py
+DB_BACKEND = os.environ.get("GDRIVE_INSIGHTS_DB_BACKEND", "postgres")
+SQLITE_DB_FILE = Path(
+    os.environ.get("GDRIVE_INSIGHTS_SQLITE_FILE", DATA_DIR / "gdrive.sqlite")
+)
+# rows per executemany in db/sqlite.py `insert_many`
+SQLITE_BATCH_SIZE = 5_000
+
+# (name, size, modified time) -> path of every file on the mount, see resolve_paths.py
+MOUNT_INDEX_FILE = (DATA_DIR / "mount_index").with_suffix(".sqlite")
+
+# revisions further apart than this start a new reading session, see db/sessionize.py
+SESSION_GAP_MINUTES = int(os.environ.get("GDRIVE_INSIGHTS_SESSION_GAP_MINUTES", 30))
+
+# Arrow IPC exports of file, change and revision, see db/arrow_export.py
+ARROW_DIR = DATA_DIR / "arrow"
+# spill directory of duck_methods.py
+DUCKDB_TMP_DIR = DATA_DIR / "duckdb_tmp"
+
+# files used together, see suggest.py
+CO_USAGE_FILE = (DATA_DIR / "co_usage").with_suffix(".npz")
+
+# name Google Docs gives to new documents
+UNNAMED = "Naamloos document"
+
 GOOGLE_DOCUMENT_FILETYPE = "application/vnd.google-apps.document"
 PDF_FILETYPE = "application/pdf"
+
+# recent revisions weigh more: a revision counts half after this many days
+SCORE_HALFLIFE_DAYS = float(os.environ.get("GDRIVE_INSIGHTS_SCORE_HALFLIFE_DAYS", 14))
+if not SCORE_HALFLIFE_DAYS > 0:
+    raise ValueError(
+        f"GDRIVE_INSIGHTS_SCORE_HALFLIFE_DAYS should be positive, got {SCORE_HALFLIFE_DAYS}"
+    )
+SCORE_EPOCH = datetime(2020, 1, 1)
+
+# Drive API calls allowed per day, used to report quota headroom
+DRIVE_DAILY_QUOTA = int(os.environ.get("GDRIVE_INSIGHTS_DAILY_QUOTA", 1_000_000))
+# revisions.list calls per day, the most valuable files first, see db/scheduler.py
+REVISION_DAILY_BUDGET = int(
+    os.environ.get("GDRIVE_INSIGHTS_REVISION_BUDGET", DRIVE_DAILY_QUOTA // 2)
+)
@@ -0,0 +1,99 @@
+"""suggest.py.
+
+update the co-usage matrix of files, and show files usually opened with a file
+files are used together when they are in the same session, or were revised on the same
+day. The matrix is saved to CO_USAGE_FILE and read by `open_files.py --suggest`
+
+Usage:
+    ipy suggest.py
+    # files usually opened with a file
+    ipy suggest.py -i -- --file_id 1a2b3c -n 10
+    # count all sessions and days again, e.g. after files were added to old sessions
+    ipy suggest.py -i -- --full
+"""
+
+import argparse
+import logging
+
+import pandas as pd
+import psycopg2  # type: ignore[import]
+from gdrive_insights import config as config_dir
+from gdrive_insights.core.co_usage import CoUsage
+from gdrive_insights.db.instrument import instrument_from_env
+from rarc_utils.log import LOG_FMT, setup_logger
+from rarc_utils.sqlalchemy_base import load_config
+
+logger = logging.getLogger(__name__)
+
+FILE_NAMES = (
+    "SELECT id AS file_id, name AS file_name FROM file WHERE id = ANY(%(ids)s);"
+)
+
+parser = argparse.ArgumentParser(description="suggest.py cli parameters")
+parser.add_argument(
+    "--file_id",
+    nargs="+",
+    default=None,
+    help="show files usually opened with these files",
+)
+parser.add_argument(
+    "-n",
+    type=int,
+    default=10,
+    help="number of files to suggest",
+)
+parser.add_argument(
+    "--full",
+    action="store_true",
+    default=False,
+    help="rebuild the matrix from all sessions and days",
+)
+parser.add_argument(
+    "--no_update",
+    action="store_true",
+    default=False,
+    help="only read the saved matrix",
+)
+
+
+def main(args):
+    """Run main app."""
+    psql = load_config(db_name="gdrive", cfg_file="postgres.cfg", config_dir=config_dir)
+    con = psycopg2.connect(
+        database=psql.db,
+        user=psql.user,
+        password=psql.passwd,
+        host=psql.host,
+        port="5432",
+    )
+    instrument_from_env(con)
+
+    co = CoUsage() if args.full else CoUsage.load()
+    if not args.no_update:
+        co.update(con)
+        co.save()
+
+    if args.file_id is None:
+        return co
+
+    suggested = pd.DataFrame(
+        co.suggest(args.file_id, n=args.n), columns=["file_id", "weight"]
+    )
+    names = pd.read_sql(FILE_NAMES, con, params={"ids": suggested.file_id.tolist()})
+    print(suggested.merge(names, on="file_id", how="left").to_string())
+
+    return co
+
+
+if __name__ == "__main__":
+    logger = setup_logger(
+        cmdLevel=logging.INFO,
+        saveFile=0,
+        savePandas=0,
+        jsonLogger=0,
+        color=1,
+        fmt=LOG_FMT,
+    )
+    cli_args = parser.parse_args()
+
+    main(cli_args)
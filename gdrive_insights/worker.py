@@ -0,0 +1,253 @@
+"""worker.py.
+
+run revision and path jobs from the job table
+fetch_new_files.py queues jobs for every PDF or Google Doc with new changes. Any number
+of workers, on any machine, can run next to each other: every batch of jobs is claimed
+with FOR UPDATE SKIP LOCKED, so no job is run twice at the same time. Revision jobs
+run most valuable files first, within the daily budget of db/scheduler.py
+
+Usage:
+    ipy worker.py
+    # only fetch revisions, drain the queue once and exit
+    ipy worker.py -i -- --kind revisions --once
+    # show number of jobs per kind and status
+    ipy worker.py -i -- --stats
+"""
+
+import argparse
+import asyncio
+import logging
+from typing import Dict, List, Tuple
+
+import pandas as pd
+from gdrive_insights import config as config_dir
+from gdrive_insights.core.metrics import FORBIDDEN_FILES
+from gdrive_insights.data_methods import DRIVE
+from gdrive_insights.data_methods import data_methods as dm
+from gdrive_insights.db import jobs
+from gdrive_insights.db.async_helpers import aupdate_file_paths
+from gdrive_insights.db.fetch_failures import (PERMANENT, FetchFailure,
+                                               arecord_failures, classify)
+from gdrive_insights.db.helpers import construct_file_path
+from gdrive_insights.db.methods import methods as db_methods
+from gdrive_insights.db.notify import connect_listener, wait_for
+from gdrive_insights.db.scheduler import (RevisionScheduler, abudget_left,
+                                          aspend)
+from gdrive_insights.settings import REVISION_DAILY_BUDGET
+from googleapiclient.errors import HttpError  # type: ignore[import]
+from rarc_utils.log import LOG_FMT, setup_logger
+from rarc_utils.sqlalchemy_base import get_async_session, load_config
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+
+
+def is_forbidden(error: Exception) -> bool:
+    """Tell whether retrying `error` is pointless."""
+    if not isinstance(error, HttpError):
+        return False
+
+    return classify(error) in PERMANENT
+
+
+def fetch_revisions(file_id: str) -> pd.DataFrame:
+    recs = [{"fileId": file_id, **rev} for rev in dm.fetch_revisions(file_id)]
+    return dm.revisions_to_pandas(recs)
+
+
+def fetch_path(file_id: str) -> pd.DataFrame:
+    path = construct_file_path(file_id, drive=DRIVE)
+    return pd.DataFrame([{"id": file_id, "path": path}])
+
+
+async def push_revisions(df: pd.DataFrame, async_session) -> None:
+    await db_methods.push_revisions(df, async_session)
+
+
+async def push_paths(df: pd.DataFrame, async_session) -> None:
+    await aupdate_file_paths(async_session, df)
+
+
+HANDLERS = {
+    jobs.REVISIONS: (fetch_revisions, push_revisions),
+    jobs.PATH: (fetch_path, push_paths),
+}
+
+
+async def run_jobs(async_session, kind: str, claimed: List[jobs.ClaimedJob]) -> int:
+    """Run a batch of claimed jobs, push their results together. Return number done.
+
+    If the push fails, the fetched jobs are retried later and the error is raised
+    """
+    fetch, push = HANDLERS[kind]
+    done: List[jobs.ClaimedJob] = []
+    dfs: List[pd.DataFrame] = []
+    failures: List[FetchFailure] = []
+    for job in claimed:
+        try:
+            dfs.append(fetch(job.file_id))
+            done.append(job)
+
+        except Exception as e:
+            forbidden = is_forbidden(e)
+            if forbidden:
+                FORBIDDEN_FILES.inc()
+            failures.append(FetchFailure.from_error(job.file_id, e))
+            await jobs.afail(async_session, job, repr(e), dead=forbidden)
+
+    # failures, and the revisions.list calls spent, of the whole batch in one
+    # transaction
+    async with async_session() as session, session.begin():
+        await arecord_failures(session, failures, [job.file_id for job in done])
+        if kind == jobs.REVISIONS:
+            await aspend(session, len(claimed), [job.file_id for job in done])
+
+    df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+    if not df.empty:
+        try:
+            await push(df, async_session)
+
+        except Exception as e:
+            # retry the fetched jobs later, instead of when their lease expires
+            for job in done:
+                await jobs.afail(async_session, job, repr(e))
+            raise
+
+    return await jobs.acomplete(async_session, done)
+
+
+async def drain_revisions(
+    async_session, batch_size=BATCH_SIZE, daily_budget=REVISION_DAILY_BUDGET
+) -> int:
+    """Run revision jobs, most valuable files first, within today's budget.
+
+    Stops when no jobs are left to claim or the budget is spent. Jobs queued while
+    draining are ranked in the next round. Return number done
+    """
+    ndone = 0
+    while True:
+        async with async_session() as session:
+            file_ids = await jobs.arunnable_file_ids(session, jobs.REVISIONS)
+            scheduler = await RevisionScheduler.afrom_db(
+                session, file_ids, daily_budget=daily_budget
+            )
+        # no change since their last fetch
+        await jobs.acancel_jobs(async_session, jobs.REVISIONS, scheduler.skipped)
+
+        nclaimed = 0
+        while len(scheduler):
+            # other workers spend the same budget
+            async with async_session() as session:
+                left = await abudget_left(session, daily_budget)
+            if left == 0:
+                logger.info(f"daily budget spent, {len(scheduler):,} files left")
+                return ndone
+
+            file_ids = scheduler.take(min(batch_size, left))
+            if not file_ids:
+                break
+            claimed = await jobs.aclaim(
+                async_session, jobs.REVISIONS, len(file_ids), file_ids=file_ids
+            )
+            nclaimed += len(claimed)
+            ndone += await run_jobs(async_session, jobs.REVISIONS, claimed)
+            logger.info(f"{jobs.REVISIONS}: {ndone:,} jobs done")
+
+        if nclaimed == 0:
+            return ndone
+
+
+async def drain_jobs(
+    async_session, kinds=jobs.JOB_KINDS, batch_size=BATCH_SIZE
+) -> Dict[str, int]:
+    """Claim and run jobs of `kinds`, until none are left to claim."""
+    ndone = {}
+    for kind in kinds:
+        if kind == jobs.REVISIONS:
+            ndone[kind] = await drain_revisions(async_session, batch_size)
+            continue
+
+        ndone[kind] = 0
+        while claimed := await jobs.aclaim(async_session, kind, batch_size):
+            ndone[kind] += await run_jobs(async_session, kind, claimed)
+            logger.info(f"{kind}: {ndone[kind]:,} jobs done")
+
+    return ndone
+
+
+def format_stats(rows: List[Tuple[str, str, int]]) -> str:
+    df = pd.DataFrame(rows, columns=["kind", "status", "njob"])
+    return df.pivot(index="kind", columns="status", values="njob").to_string()
+
+
+parser = argparse.ArgumentParser(description="worker.py cli parameters")
+parser.add_argument(
+    "--kind",
+    nargs="+",
+    choices=jobs.JOB_KINDS,
+    default=list(jobs.JOB_KINDS),
+    help="job kinds to run",
+)
+parser.add_argument(
+    "--batch_size",
+    type=int,
+    default=BATCH_SIZE,
+    help="jobs to claim per batch, should finish within the lease",
+)
+parser.add_argument(
+    "--interval",
+    type=int,
+    default=15,
+    help="check the queue at least every X minutes, also without notifications",
+)
+parser.add_argument(
+    "--once",
+    action="store_true",
+    default=False,
+    help="drain the queue once and exit",
+)
+parser.add_argument(
+    "--stats",
+    action="store_true",
+    default=False,
+    help="show number of jobs per kind and status, and exit",
+)
+
+
+def main(args):
+    """Run main app."""
+    psql = load_config(db_name="gdrive", cfg_file="postgres.cfg", config_dir=config_dir)
+    async_session = get_async_session(psql)
+    loop = asyncio.get_event_loop()
+
+    if args.stats:
+        print(format_stats(loop.run_until_complete(jobs.acount_jobs(async_session))))
+        return
+
+    # listen before draining, so jobs queued while draining are not missed
+    con = connect_listener(psql)
+
+    while True:
+        ndone = loop.run_until_complete(
+            drain_jobs(async_session, args.kind, args.batch_size)
+        )
+        logger.info(f"{ndone=}")
+        if args.once:
+            return ndone
+
+        wait_for(con, jobs.JOB_TABLE, timeout=args.interval * 60)
+
+
+if __name__ == "__main__":
+    logger = setup_logger(
+        cmdLevel=logging.INFO,
+        saveFile=0,
+        savePandas=0,
+        jsonLogger=0,
+        color=1,
+        fmt=LOG_FMT,
+    )
+    cli_args = parser.parse_args()
+
+    main(cli_args)
@@ -0,0 +1,87 @@
+"""Tests of core/co_usage.py that need no database."""
+from datetime import datetime
+
+import numpy as np
+from gdrive_insights.core.co_usage import MAX_GROUP_SIZE, CoUsage
+
+
+def _weights(co):
+    return {
+        (co.ids[i], co.ids[j]): float(w)
+        for i, j, w in zip(*co.matrix.nonzero(), co.matrix.data)
+    }
+
+
+def test_add_groups():
+    co = CoUsage()
+    ngroup = co.add_groups([["a", "b", "c"], ["a", "b"], ["a"], ["b", None]], weight=2)
+
+    assert ngroup == 2
+    assert co.ids == ["a", "b", "c"]
+    weights = _weights(co)
+    assert weights[("a", "b")] == weights[("b", "a")] == 4
+    assert weights[("a", "c")] == 2
+    assert ("a", "a") not in weights
+
+
+def test_add_groups_skips_big_groups():
+    co = CoUsage()
+    group = [str(i) for i in range(MAX_GROUP_SIZE + 1)]
+
+    assert co.add_groups([group]) == 0
+    assert co.matrix.nnz == 0
+
+
+def test_add_groups_only_new_pairs():
+    co = CoUsage()
+    co.add_groups([["a", "b"]])
+    # c was revised on a day that was counted before, with a and b
+    co.add_groups([["a", "b", "c"]], new=[["c"]])
+
+    weights = _weights(co)
+    assert weights[("a", "b")] == 1
+    assert weights[("a", "c")] == weights[("c", "b")] == 1
+
+
+def test_suggest():
+    co = CoUsage()
+    co.add_groups([["a", "b"], ["a", "b"], ["a", "c"], ["b", "d"]])
+
+    assert co.suggest(["a"]) == [("b", 2.0), ("c", 1.0)]
+    assert co.suggest(["a"], n=1) == [("b", 2.0)]
+    # weights of several files add up, the files themselves are left out
+    assert co.suggest(["a", "b"]) == [("c", 1.0), ("d", 1.0)]
+    assert co.suggest(["unknown"]) == []
+
+
+def test_save_load(tmp_path):
+    co = CoUsage(sessions=[3, 1], last_update=datetime(2026, 10, 19, 12))
+    co.add_groups([["a", "b"]])
+    path = tmp_path / "co_usage.npz"
+    co.save(path)
+
+    loaded = CoUsage.load(path)
+    assert loaded.ids == ["a", "b"]
+    assert loaded.sessions == {1, 3}
+    assert loaded.last_update == datetime(2026, 10, 19, 12)
+    assert loaded.suggest(["a"]) == [("b", 1.0)]
+
+
+def test_load_before_created(tmp_path):
+    path = tmp_path / "co_usage.npz"
+    m = CoUsage().matrix
+    with open(path, "wb") as f:
+        np.savez_compressed(
+            f,
+            data=m.data,
+            indices=m.indices,
+            indptr=m.indptr,
+            shape=np.array(m.shape),
+            ids=np.array([], dtype=str),
+            last_session=np.array(3),
+            last_day=np.datetime64("2026-10-01"),
+        )
+
+    loaded = CoUsage.load(path)
+    assert loaded.sessions == {1, 2, 3}
+    assert loaded.last_update == datetime(2026, 10, 2)
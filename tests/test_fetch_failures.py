@@ -0,0 +1,99 @@
+"""Tests of db/fetch_failures.py that need no database."""
+from datetime import timedelta
+
+from gdrive_insights.db import fetch_failures as ff
+
+
+class FakeResp:
+    def __init__(self, status):
+        self.status = status
+
+
+class FakeHttpError(Exception):
+    """Like googleapiclient's HttpError: a response with a status, reason in str."""
+
+    def __init__(self, status, msg=""):
+        super().__init__(msg)
+        self.resp = FakeResp(status)
+
+
+class FakeSession:
+    def __init__(self):
+        self.executed = []
+        self.ncommit = 0
+
+    def execute(self, stmt, params=None):
+        self.executed.append((stmt, params))
+
+    def commit(self):
+        self.ncommit += 1
+
+
+def test_classify():
+    assert ff.classify(FakeHttpError(404)) == ff.NOT_FOUND
+    assert ff.classify(FakeHttpError("404")) == ff.NOT_FOUND
+    assert ff.classify(FakeHttpError(429)) == ff.RATE_LIMITED
+    assert ff.classify(FakeHttpError(403, "userRateLimitExceeded")) == ff.RATE_LIMITED
+    assert ff.classify(FakeHttpError(403, "insufficientFilePermissions")) == (
+        ff.FORBIDDEN
+    )
+    assert ff.classify(FakeHttpError(503)) == ff.SERVER
+    assert ff.classify(FakeHttpError(403, "something else")) == ff.OTHER
+    assert ff.classify(TimeoutError("timed out")) == ff.OTHER
+    assert ff.classify(ValueError("File not found: notFound")) == ff.NOT_FOUND
+
+
+def test_retry_delay_doubles_up_to_max():
+    first, max_ = ff.BACKOFF[ff.RATE_LIMITED]
+    delays = [ff.retry_delay(ff.RATE_LIMITED, n) for n in range(1, 10)]
+
+    assert delays[:3] == [first, 2 * first, 4 * first]
+    assert delays[-1] == max_
+    assert all(a <= b for a, b in zip(delays, delays[1:]))
+    assert all(ff.retry_delay(c, 1) > timedelta(0) for c in ff.BACKOFF)
+
+
+def test_params_last_failure_per_file():
+    failures = [
+        ff.FetchFailure("a", ff.SERVER, "first"),
+        ff.FetchFailure("b", ff.FORBIDDEN, "denied"),
+        ff.FetchFailure("a", ff.RATE_LIMITED, "second"),
+    ]
+    params = ff._params(failures)
+
+    assert params["file_ids"] == ["a", "b"]
+    assert params["error_classes"] == [ff.RATE_LIMITED, ff.FORBIDDEN]
+    assert params["errors"] == ["second", "denied"]
+    first, max_ = ff.BACKOFF[ff.RATE_LIMITED]
+    assert params["first_secs"][0] == first.total_seconds()
+    assert params["max_secs"][0] == max_.total_seconds()
+
+
+def test_from_error():
+    failure = ff.FetchFailure.from_error("a", FakeHttpError(404, "x" * 2000))
+
+    assert failure.error_class == ff.NOT_FOUND
+    assert failure.is_permanent
+    assert len(failure.error) == 1000
+
+
+def test_record_failures():
+    session = FakeSession()
+    failures = [
+        ff.FetchFailure("a", ff.NOT_FOUND, "gone"),
+        ff.FetchFailure("b", ff.SERVER, "oops"),
+    ]
+    ff.record_failures(session, failures, ok_ids=["c"])
+
+    params = {stmt: p for stmt, p in session.executed}
+    assert params[ff.UPSERT_FAILURES]["file_ids"] == ["a", "b"]
+    assert params[ff.SET_FORBIDDEN] == {"file_ids": ["a"]}
+    assert params[ff.CLEAR_FAILURES] == {"file_ids": ["c"]}
+    assert session.ncommit == 1
+
+
+def test_record_nothing():
+    session = FakeSession()
+    ff.record_failures(session, [])
+
+    assert session.executed == [] and session.ncommit == 0
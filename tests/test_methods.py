@@ -0,0 +1,91 @@
+"""Tests of db/methods.py that need no database."""
+import asyncio
+
+import pandas as pd
+from gdrive_insights.db.methods import methods
+
+# a page of only removals, as returned by `data_methods.changes_to_pandas`: removed
+# files come without `file`, so there are no file_* columns
+REMOVALS = pd.DataFrame(
+    {
+        "index": [0],
+        "kind": ["drive#change"],
+        "removed": [True],
+        "fileId": ["removed-file"],
+        "time": ["2026-10-19T10:00:00.000Z"],
+        "type": ["file"],
+        "changeType": ["file"],
+        "page_token": [42],
+        "id": ["removed-file"],
+    }
+)
+
+
+class FakeResult:
+    def __init__(self, known=()):
+        self.known = list(known)
+
+    def fetchall(self):
+        return []
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.known
+
+
+class FakeSession:
+    """Records executed statements, knows `known` file ids."""
+
+    def __init__(self, known=()):
+        self.known = known
+        self.statements = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def begin(self):
+        return self
+
+    async def execute(self, stmt, params=None):
+        self.statements.append(stmt)
+        return FakeResult(self.known)
+
+
+def _tables(session):
+    return [
+        getattr(getattr(s, "table", None), "name", None) for s in session.statements
+    ]
+
+
+def test_removal_only_page():
+    df = REMOVALS
+    assert methods._batch_file_recs(df) == []
+
+    recs = methods._make_change_recs(df)
+    assert len(recs) == 1
+    assert recs[0]["removed"] and recs[0]["name"] is None
+
+    session = FakeSession(known=["removed-file"])
+    asyncio.run(methods.push_change_batch(df, lambda: session, "changes", 43))
+
+    tables = _tables(session)
+    assert "file" not in tables
+    assert "change" in tables
+    assert "page_checkpoint" in tables
+
+
+def test_batch_file_recs_skips_removed():
+    df = pd.DataFrame(
+        {
+            "fileId": ["a", "b"],
+            "id": ["a", "b"],
+            "file_name": ["a.pdf", None],
+            "file_mimeType": ["application/pdf", None],
+        }
+    )
+    assert [r["id"] for r in methods._batch_file_recs(df)] == ["a"]
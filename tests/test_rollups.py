@@ -0,0 +1,84 @@
+"""Tests of db/rollups.py that need no database."""
+import asyncio
+from datetime import datetime
+
+from gdrive_insights.db import rollups
+
+
+class FakeResult:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+
+    def fetchall(self):
+        return self.rows
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.rows
+
+
+class FakeSession:
+    """Records executed statements and params, answers from `results`."""
+
+    def __init__(self, results=None):
+        self.results = results or {}
+        self.executed = []
+
+    async def execute(self, stmt, params=None):
+        self.executed.append((stmt, params))
+        return FakeResult(self.results.get(stmt, ()))
+
+
+def _statements(session):
+    return [stmt for stmt, _ in session.executed]
+
+
+def test_no_new_revisions_changes_nothing():
+    session = FakeSession()
+    nfile = asyncio.run(rollups.refresh_file_ids(session, ["a", "b"]))
+
+    assert nfile == 0
+    assert _statements(session) == [rollups.SELECT_NEW_SINCE]
+
+
+def test_refresh_only_new_buckets():
+    since = datetime(2026, 10, 19, 10, 30)
+    bucket = datetime(2026, 10, 19)
+    session = FakeSession(
+        {
+            rollups.SELECT_NEW_SINCE: [("a", since)],
+            rollups.INSERT_NEW_ROLLUP: [bucket],
+        }
+    )
+    nfile = asyncio.run(
+        rollups.refresh_file_ids(session, ["a", "b"], granularities=("day",))
+    )
+
+    assert nfile == 1
+    statements = _statements(session)
+    assert rollups.DELETE_STALE_ROLLUP not in statements
+    for stmt, params in session.executed:
+        if stmt is rollups.INSERT_NEW_ROLLUP:
+            assert params["file_ids"] == ["a"] and params["sinces"] == [since]
+        if stmt is rollups.INSERT_MIME_ROLLUP:
+            assert params["buckets"] == [bucket]
+
+
+def test_rebuild_refreshes_all_mime_buckets():
+    session = FakeSession()
+    nfile = asyncio.run(
+        rollups.refresh_file_ids(session, ["a"], granularities=("day",), rebuild=True)
+    )
+
+    assert nfile == 1
+    assert rollups.SELECT_NEW_SINCE not in _statements(session)
+    mime = [p for s, p in session.executed if s is rollups.INSERT_MIME_ROLLUP]
+    assert mime == [{"granularity": "day", "buckets": None}]
+
+
+def test_pick_granularity():
+    start, end = datetime(2026, 10, 5), datetime(2026, 10, 19)
+    assert rollups.pick_granularity(start, end) == ("week", start, end)
+    assert rollups.pick_granularity(start, datetime(2026, 10, 6, 12))[0] == "hour"
@@ -0,0 +1,49 @@
+"""Tests of db/scheduler.py that need no database."""
+import pandas as pd
+from gdrive_insights.db.scheduler import (MAX_STALE_HOURS, RevisionScheduler,
+                                          priorities)
+
+
+def test_priorities():
+    inputs = pd.DataFrame(
+        {
+            "file_id": ["used", "plain", "never", "unchanged", "ancient"],
+            "activity": [1.0, 0.0, 0.0, 5.0, 0.0],
+            "usage": [2.0, 0.0, 0.0, 5.0, 0.0],
+            "stale_hours": [2.0, 2.0, None, 2.0, 10 * MAX_STALE_HOURS],
+            "changed": [True, True, True, False, True],
+        }
+    )
+    prio = priorities(inputs)
+
+    assert prio["used"] == 4 * 2.0
+    assert prio["plain"] == 2.0
+    # never fetched, and staleness is capped
+    assert prio["never"] == prio["ancient"] == MAX_STALE_HOURS
+    assert prio["unchanged"] == 0
+
+
+def test_take_in_priority_order():
+    scheduler = RevisionScheduler({"a": 1.0, "b": 3.0, "c": 2.0, "d": 0.0}, budget=10)
+
+    assert scheduler.skipped == ["d"]
+    assert len(scheduler) == 3
+    assert scheduler.take(2) == ["b", "c"]
+    assert scheduler.take(2) == ["a"]
+    assert scheduler.take(2) == []
+    assert scheduler.spent == 3
+
+
+def test_take_within_budget():
+    scheduler = RevisionScheduler({"a": 1.0, "b": 3.0, "c": 2.0}, budget=2)
+
+    assert scheduler.take(5) == ["b", "c"]
+    assert scheduler.take(5) == []
+    assert scheduler.left_over == ["a"]
+
+
+def test_stop():
+    scheduler = RevisionScheduler({"a": 1.0, "b": 3.0}, budget=10)
+    scheduler.stop()
+
+    assert scheduler.take(5) == []